@@ -12,7 +12,11 @@ registry = []
 
 def register(model, parent_attr='parent', left_attr='lft', right_attr='rght',
              tree_id_attr='tree_id', level_attr='level',
-             tree_manager_attr='tree', order_insertion_by=None):
+             tree_manager_attr='tree', order_insertion_by=None,
+             tree_router=None, tree_scope_attr=None, tree_id_gap=None,
+             update_chunk_size=None, update_chunk_pause=0,
+             defer_insertion=False, lazy_delete=False,
+             compact_threshold=None):
     """
     Sets the given model class up for Modified Preorder Tree Traversal.
     """
@@ -43,6 +47,14 @@ def register(model, parent_attr='parent', left_attr='lft', right_attr='rght',
     opts.level_attr = level_attr
     opts.tree_manager_attr = tree_manager_attr
     opts.order_insertion_by = order_insertion_by
+    opts.tree_router = tree_router
+    opts.tree_scope_attr = tree_scope_attr
+    opts.tree_id_gap = tree_id_gap
+    opts.update_chunk_size = update_chunk_size
+    opts.update_chunk_pause = update_chunk_pause
+    opts.defer_insertion = defer_insertion
+    opts.lazy_delete = lazy_delete
+    opts.compact_threshold = compact_threshold
 
     # Add tree fields if they do not exist
     for attr in [left_attr, right_attr, tree_id_attr, level_attr]:
@@ -57,19 +69,25 @@ def register(model, parent_attr='parent', left_attr='lft', right_attr='rght',
     setattr(model, 'get_children', models.get_children)
     setattr(model, 'get_descendants', models.get_descendants)
     setattr(model, 'get_descendant_count', models.get_descendant_count)
+    setattr(model, 'get_leafnodes', models.get_leafnodes)
     setattr(model, 'get_next_sibling', models.get_next_sibling)
     setattr(model, 'get_previous_sibling', models.get_previous_sibling)
     setattr(model, 'get_root', models.get_root)
     setattr(model, 'get_siblings', models.get_siblings)
     setattr(model, 'insert_at', models.insert_at)
+    setattr(model, 'is_ancestor_of', models.is_ancestor_of)
     setattr(model, 'is_child_node', models.is_child_node)
+    setattr(model, 'is_descendant_of', models.is_descendant_of)
     setattr(model, 'is_leaf_node', models.is_leaf_node)
     setattr(model, 'is_root_node', models.is_root_node)
     setattr(model, 'move_to', models.move_to)
 
     # Add a custom tree manager
     TreeManager(parent_attr, left_attr, right_attr, tree_id_attr,
-                level_attr).contribute_to_class(model, tree_manager_attr)
+                level_attr, tree_router, tree_scope_attr,
+                tree_id_gap, update_chunk_size, update_chunk_pause,
+                defer_insertion, lazy_delete,
+                compact_threshold).contribute_to_class(model, tree_manager_attr)
     setattr(model, '_tree_manager', getattr(model, tree_manager_attr))
 
     # Set up signal receiver to manage the tree when instances of the
@@ -82,13 +100,27 @@ def register(model, parent_attr='parent', left_attr='lft', right_attr='rght',
     # only want to manage the tree based on the topmost node which is
     # being deleted.
     def wrap_delete(delete):
-        def _wrapped_delete(self):
+        def _wrapped_delete(self, using=None):
             opts = self._meta
-            tree_width = (getattr(self, opts.right_attr) -
-                          getattr(self, opts.left_attr) + 1)
-            target_right = getattr(self, opts.right_attr)
+            tree_manager = self._tree_manager
             tree_id = getattr(self, opts.tree_id_attr)
-            self._tree_manager._close_gap(tree_width, target_right, tree_id)
-            delete(self)
+            tree_using = tree_manager._db_for_write(self, using)
+            scope = tree_manager._get_scope(self)
+            # Deferred nodes haven't been given any space in their tree,
+            # and lazily deleted nodes leave their space as a gap
+            if getattr(self, opts.left_attr) and not opts.lazy_delete:
+                tree_width = (getattr(self, opts.right_attr) -
+                              getattr(self, opts.left_attr) + 1)
+                target_right = getattr(self, opts.right_attr)
+                tree_manager._close_gap(tree_width, target_right, tree_id,
+                                        tree_using, scope)
+            if using is None:
+                delete(self)
+            else:
+                # Django >= 1.2
+                delete(self, using=using)
+            if opts.lazy_delete and opts.compact_threshold is not None:
+                tree_manager.compact_tree(tree_id, tree_using, scope,
+                                          opts.compact_threshold)
         return wraps(delete)(_wrapped_delete)
     model.delete = wrap_delete(model.delete)
@@ -2,21 +2,74 @@
 Form components for working with trees.
 """
 from django import forms
+from django.db.models.query import Q
+from django.forms.fields import EMPTY_VALUES
 from django.forms.forms import NON_FIELD_ERRORS
 from django.forms.util import ErrorList
 from django.utils.encoding import smart_unicode
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import ugettext, ugettext_lazy as _
 
 from mptt.exceptions import InvalidMove
 
-__all__ = ('TreeNodeChoiceField', 'TreeNodePositionField', 'MoveNodeForm')
+__all__ = ('TreeNodeChoiceField', 'TreeNodePositionField', 'MoveNodeForm',
+           'TreeNodeSelect')
+
+# Widgets #####################################################################
+
+class TreeNodeSelect(forms.Select):
+    """
+    A Select which, when used with a paginated ``TreeNodeChoiceField``,
+    renders an option for the currently selected node in addition to
+    the field's choices.
+    """
+    def render(self, name, value, attrs=None, choices=()):
+        field = getattr(self.choices, 'field', None)
+        if (field is not None and field.page_size and
+            value not in EMPTY_VALUES):
+            choices = list(choices) + field.choices_for_pks([value])
+        return super(TreeNodeSelect, self).render(name, value, attrs, choices)
 
 # Fields ######################################################################
 
+class TreeNodeChoiceIterator(object):
+    """
+    Creates choices for a ``TreeNodeChoiceField`` with a ``label_field``
+    from ``values_list``, without creating any model instances.
+
+    When the field is paginated, only its empty label is created - the
+    remaining choices are served in pages by ``choices_page``.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.queryset = field.queryset
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield (u'', self.field.empty_label)
+        if not self.field.page_size:
+            for pk, level, label in self.field._values_list(self.queryset):
+                yield (pk, self.field.label_from_values(level, label))
+
 class TreeNodeChoiceField(forms.ModelChoiceField):
-    """A ModelChoiceField for tree nodes."""
+    """
+    A ModelChoiceField for tree nodes.
+
+    If ``label_field`` is given, choices are created from the primary
+    key, level and ``label_field`` of each node using ``values_list``
+    instead of from model instances.
+
+    If ``page_size`` is also given, the field will only render the
+    currently selected node - other choices should be retrieved in
+    pages of ``page_size`` nodes using ``choices_page``.
+    """
+    widget = TreeNodeSelect
+
     def __init__(self, level_indicator=u'---', *args, **kwargs):
         self.level_indicator = level_indicator
+        self.label_field = kwargs.pop('label_field', None)
+        self.page_size = kwargs.pop('page_size', None)
+        if self.page_size and not self.label_field:
+            raise ValueError(ugettext('A label_field must be given to paginate choices.'))
         if kwargs.get('required', True) and not 'empty_label' in kwargs:
             kwargs['empty_label'] = None
         super(TreeNodeChoiceField, self).__init__(*args, **kwargs)
@@ -26,9 +79,87 @@ class TreeNodeChoiceField(forms.ModelChoiceField):
         Creates labels which represent the tree level of each node when
         generating option labels.
         """
-        return u'%s %s' % (self.level_indicator * getattr(obj,
-                                                  obj._meta.level_attr),
-                           smart_unicode(obj))
+        return self.label_from_values(getattr(obj, obj._meta.level_attr),
+                                      smart_unicode(obj))
+
+    def label_from_values(self, level, label):
+        """
+        Creates a label which represents the tree level of a node from
+        its ``level`` and ``label``.
+        """
+        return u'%s %s' % (self.level_indicator * level, smart_unicode(label))
+
+    def _get_choices(self):
+        if self.label_field and not hasattr(self, '_choices'):
+            return TreeNodeChoiceIterator(self)
+        return super(TreeNodeChoiceField, self)._get_choices()
+
+    choices = property(_get_choices, forms.ModelChoiceField._set_choices)
+
+    def _values_list(self, queryset, *extra_fields):
+        """
+        Retrieves the primary key, level and label of nodes in
+        ``queryset``, followed by any ``extra_fields``.
+        """
+        opts = queryset.model._meta
+        return queryset.values_list('pk', opts.level_attr, self.label_field,
+                                    *extra_fields)
+
+    def choices_for_pks(self, pks):
+        """
+        Creates choices for the nodes with the given primary keys.
+        """
+        return [(pk, self.label_from_values(level, label))
+                for pk, level, label in self._values_list(
+                    self.queryset.filter(pk__in=pks))]
+
+    def choices_page(self, after=None, search=None):
+        """
+        Retrieves a page of at most ``page_size`` choices in tree order,
+        returning a two-tuple of the choices and a cursor which may be
+        passed as ``after`` to retrieve the next page, or ``None`` if
+        there are no more choices.
+
+        Pages are located using the tree id and left edge indicator of
+        the last node in the previous page rather than with an offset,
+        so every page can be retrieved using the tree id and left edge
+        indicator indexes. If trees are scoped, the node's scope is also
+        used.
+
+        If ``search`` is given, only nodes whose ``label_field``
+        contains it (ignoring case) will be included.
+        """
+        opts = self.queryset.model._meta
+        ordering = self.queryset.model._tree_manager._tree_ordering()
+        queryset = self.queryset.order_by(*ordering)
+        if after:
+            bits = after.rsplit(':', len(ordering) - 1)
+            try:
+                if len(bits) != len(ordering):
+                    raise ValueError
+                tree_id, left = [int(bit) for bit in bits[-2:]]
+            except ValueError:
+                raise ValueError(ugettext('An invalid cursor was given: %s.') % after)
+            filters = (Q(**{'%s__gt' % opts.tree_id_attr: tree_id}) |
+                       Q(**{opts.tree_id_attr: tree_id,
+                            '%s__gt' % opts.left_attr: left}))
+            if len(ordering) > 2:
+                scope = bits[0]
+                filters = (Q(**{'%s__gt' % ordering[0]: scope}) |
+                           (Q(**{ordering[0]: scope}) & filters))
+            queryset = queryset.filter(filters)
+        if search:
+            queryset = queryset.filter(**{
+                '%s__icontains' % self.label_field: search,
+            })
+        page_size = self.page_size or 100
+        rows = list(self._values_list(queryset, *ordering)[:page_size + 1])
+        cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            cursor = ':'.join([str(value) for value in rows[-1][3:]])
+        return ([(row[0], self.label_from_values(row[1], row[2]))
+                 for row in rows], cursor)
 
 class TreeNodePositionField(forms.ChoiceField):
     """A ChoiceField for specifying position relative to another node."""
@@ -89,20 +220,43 @@ class MoveNodeForm(forms.Form):
         ``level_indicator``
            A string which will be used to represent a single tree level
            in the target options.
+
+        ``label_field``
+           The name of a field whose value should be used to label the
+           target options, which will be created without creating any
+           model instances.
+
+        ``page_size``
+           If given along with ``label_field``, only the currently
+           selected target will be rendered - other targets should be
+           retrieved in pages of ``page_size`` using the target field's
+           ``choices_page`` method.
         """
         self.node = node
         valid_targets = kwargs.pop('valid_targets', None)
         target_select_size = kwargs.pop('target_select_size', 10)
         position_choices = kwargs.pop('position_choices', None)
         level_indicator = kwargs.pop('level_indicator', None)
+        label_field = kwargs.pop('label_field', None)
+        page_size = kwargs.pop('page_size', None)
         super(MoveNodeForm, self).__init__(*args, **kwargs)
         opts = node._meta
         if valid_targets is None:
-            valid_targets = node._tree_manager.exclude(**{
+            # Nodes can't be moved to trees in another scope
+            scope_filters = node._tree_manager._scope_filters(
+                node._tree_manager._get_scope(node))
+            exclude_filters = dict(scope_filters)
+            exclude_filters.update({
                 opts.tree_id_attr: getattr(node, opts.tree_id_attr),
                 '%s__gte' % opts.left_attr: getattr(node, opts.left_attr),
                 '%s__lte' % opts.right_attr: getattr(node, opts.right_attr),
             })
+            valid_targets = node._tree_manager.filter(
+                **scope_filters).exclude(**exclude_filters)
+        if page_size and not label_field:
+            raise ValueError(ugettext('A label_field must be given to paginate choices.'))
+        self.fields['target'].label_field = label_field
+        self.fields['target'].page_size = page_size
         self.fields['target'].queryset = valid_targets
         self.fields['target'].widget.attrs['size'] = target_select_size
         if level_indicator:
@@ -0,0 +1,47 @@
+"""
+A management command which closes the gaps left in the trees of models
+which have been set up for MPTT with lazy deletion.
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError, LabelCommand
+from django.db.models import get_model
+from django.utils.translation import ugettext as _
+
+import mptt
+
+class Command(LabelCommand):
+    help = ('Compacts the trees of the given models, which must have been '
+            'registered with mptt with lazy_delete.')
+    args = '<appname.modelname appname.modelname ...>'
+    label = 'model'
+    option_list = LabelCommand.option_list + (
+        make_option('--threshold', action='store', type='int',
+                    dest='threshold', default=None,
+                    help='Only compact trees with more than this many '
+                         'unused edge indicators.'),
+        make_option('--database', action='store', dest='database',
+                    default=None,
+                    help='The alias of the database to compact trees in.'),
+    )
+
+    def handle_label(self, label, **options):
+        try:
+            app_label, model_name = label.split('.')
+        except ValueError:
+            raise CommandError(_('Models must be given in appname.modelname format: %s') % label)
+        model = get_model(app_label, model_name)
+        if model is None or model not in mptt.registry:
+            raise CommandError(_('%s is not a model registered with mptt.') % label)
+        if not model._meta.lazy_delete:
+            raise CommandError(_('%s was not registered with lazy_delete.') % label)
+
+        trees = model._tree_manager.compact_trees(options.get('threshold'),
+                                                  options.get('database'))
+        if not trees:
+            return _('%s: no trees needed compacting.') % label
+        return _('%(model)s: compacted trees: %(trees)s') % {
+            'model': label,
+            'trees': ', '.join([isinstance(tree, tuple) and '%s:%s' % tree
+                                or str(tree) for tree in trees]),
+        }
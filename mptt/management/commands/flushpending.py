@@ -0,0 +1,51 @@
+"""
+A management command which positions nodes whose insertion into their
+trees has been deferred, optionally doing so repeatedly.
+"""
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError, LabelCommand
+from django.db.models import get_model
+from django.utils.translation import ugettext as _
+
+import mptt
+
+class Command(LabelCommand):
+    help = ('Positions the deferred nodes of the given models, which must '
+            'have been registered with mptt with defer_insertion.')
+    args = '<appname.modelname appname.modelname ...>'
+    label = 'model'
+    option_list = LabelCommand.option_list + (
+        make_option('--interval', action='store', type='float',
+                    dest='interval', default=None,
+                    help='Keep positioning deferred nodes, waiting this '
+                         'many seconds between passes.'),
+        make_option('--database', action='store', dest='database',
+                    default=None,
+                    help='The alias of the database to position nodes in.'),
+    )
+
+    def handle_label(self, label, **options):
+        try:
+            app_label, model_name = label.split('.')
+        except ValueError:
+            raise CommandError(_('Models must be given in appname.modelname format: %s') % label)
+        model = get_model(app_label, model_name)
+        if model is None or model not in mptt.registry:
+            raise CommandError(_('%s is not a model registered with mptt.') % label)
+        if not model._meta.defer_insertion:
+            raise CommandError(_('%s was not registered with defer_insertion.') % label)
+
+        tree_manager = model._tree_manager
+        interval = options.get('interval')
+        while True:
+            flushed = tree_manager.flush_pending(
+                using=options.get('database'))
+            if not interval:
+                break
+            time.sleep(interval)
+        return _('%(model)s: positioned %(count)s deferred nodes.') % {
+            'model': label,
+            'count': flushed,
+        }
@@ -0,0 +1,81 @@
+"""
+A management command which verifies and optionally repairs the trees of
+models which have been set up for MPTT.
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError, LabelCommand
+from django.db.models import get_model
+from django.utils.translation import ugettext as _
+
+import mptt
+
+def _format_tree(tree):
+    """
+    Formats a tree id, or a ``(scope, tree_id)`` tuple for scoped trees.
+    """
+    if isinstance(tree, tuple):
+        return '%s:%s' % tree
+    return str(tree)
+
+class Command(LabelCommand):
+    help = ('Verifies the trees of the given models, which must have been '
+            'registered with mptt, optionally repairing any invalid trees.')
+    args = '<appname.modelname appname.modelname ...>'
+    label = 'model'
+    option_list = LabelCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair',
+                    default=False, help='Rebuild any invalid trees.'),
+        make_option('--details', action='store_true', dest='details',
+                    default=False,
+                    help='Check each tree in tree order, reporting what is '
+                         'wrong with any invalid trees.'),
+        make_option('--processes', action='store', type='int',
+                    dest='processes', default=None,
+                    help='The number of processes to check trees with when '
+                         'reporting details.'),
+        make_option('--database', action='store', dest='database',
+                    default=None,
+                    help='The alias of the database to check trees in.'),
+    )
+
+    def handle_label(self, label, **options):
+        try:
+            app_label, model_name = label.split('.')
+        except ValueError:
+            raise CommandError(_('Models must be given in appname.modelname format: %s') % label)
+        model = get_model(app_label, model_name)
+        if model is None or model not in mptt.registry:
+            raise CommandError(_('%s is not a model registered with mptt.') % label)
+
+        tree_manager = model._tree_manager
+        using = options.get('database')
+        if options.get('details'):
+            errors = tree_manager.check_tree_integrity(
+                processes=options.get('processes'), using=using)
+            tree_ids = errors.keys()
+            tree_ids.sort()
+        else:
+            errors = {}
+            tree_ids = tree_manager.verify_trees(using)
+        if not tree_ids:
+            return _('%s: all trees are valid.') % label
+        if not options.get('repair'):
+            output = [_('%(model)s: invalid trees: %(tree_ids)s') % {
+                'model': label,
+                'tree_ids': ', '.join([_format_tree(tree) for tree in tree_ids]),
+            }]
+            for tree_id in tree_ids:
+                for error in errors.get(tree_id, []):
+                    output.append(_('  Tree %(tree_id)s: %(error)s') % {
+                        'tree_id': _format_tree(tree_id),
+                        'error': error,
+                    })
+            return '\n'.join(output)
+        for tree in tree_ids:
+            tree_id, scope = tree_manager._split_tree(tree)
+            tree_manager.rebuild_tree(tree_id, using, scope)
+        return _('%(model)s: rebuilt trees: %(tree_ids)s') % {
+            'model': label,
+            'tree_ids': ', '.join([_format_tree(tree) for tree in tree_ids]),
+        }
@@ -1,14 +1,24 @@
 """
 A custom manager for working with trees of objects.
 """
+import itertools
+import operator
+import time
+
 from django.db import connection, models, transaction
+from django.utils import simplejson
 from django.utils.translation import ugettext as _
 
+from mptt import models as tree_models
 from mptt.exceptions import InvalidMove
 
-__all__ = ('TreeManager',)
+try:
+    from django.db import DEFAULT_DB_ALIAS, connections, router
+except ImportError:
+    # Django < 1.2 only supports a single database
+    DEFAULT_DB_ALIAS = connections = router = None
 
-qn = connection.ops.quote_name
+__all__ = ('TreeManager', 'TreeQuerySet')
 
 COUNT_SUBQUERY = """(
     SELECT COUNT(*)
@@ -23,22 +33,458 @@ CUMULATIVE_COUNT_SUBQUERY = """(
     (
         SELECT m2.%(mptt_pk)s
         FROM %(mptt_table)s m2
-        WHERE m2.%(tree_id)s = %(mptt_table)s.%(tree_id)s
+        WHERE m2.%(tree_id)s = %(mptt_table)s.%(tree_id)s%(scope)s
           AND m2.%(left)s BETWEEN %(mptt_table)s.%(left)s
                               AND %(mptt_table)s.%(right)s
     )
 )"""
 
+RELATED_AGGREGATE_QUERY = """
+SELECT related.node_id, %(aggregate)s(%(value)s)
+FROM (
+    SELECT DISTINCT m.%(mptt_pk)s AS node_id, j.%(item_fk)s AS item_id
+    FROM %(mptt_table)s m
+    INNER JOIN %(mptt_table)s d
+        ON %(descendant_join)s
+    INNER JOIN %(join_table)s j
+        ON j.%(mptt_fk)s = d.%(mptt_pk)s
+    WHERE m.%(mptt_pk)s IN (%(node_pks)s)
+) related%(rel_join)s
+GROUP BY related.node_id"""
+
+AGGREGATE_FUNCTIONS = ('AVG', 'COUNT', 'MAX', 'MIN', 'SUM')
+
+# Each of these queries finds the trees which break one of the rules a
+# valid tree must follow. %(mod)s is the modulo operator, which is
+# escaped to survive parameter substitution. Trees are identified by
+# their tree id, preceded by their scope if trees are scoped - %(tree)s
+# is the list of these columns, prefixed with a table alias where one is
+# given, %(same_tree)s matches rows in the same tree and
+# %(different_tree)s matches rows in different trees. %(max_edge)s is
+# <> unless trees may have gaps left by lazy deletion, in which case it
+# is < and only rules out edge indicators running short. %(table)s is
+# always given an alias, as it is replaced by a derived table which
+# leaves out deferred nodes that haven't been positioned yet if the
+# model was registered with defer_insertion.
+INVALID_TREE_QUERIES = (
+    # Left edge indicators must be less than right edge indicators and
+    # every node must enclose an even number of edge indicators.
+    """
+    SELECT DISTINCT %(tree)s
+    FROM %(table)s n
+    WHERE %(left)s >= %(right)s
+       OR (%(right)s - %(left)s + 1) %(mod)s 2 <> 0""",
+    # Every tree must have exactly one root node, which must be at the
+    # first level, and edge indicators must run from 1 to twice the
+    # number of nodes in the tree.
+    """
+    SELECT %(tree)s
+    FROM %(table)s n
+    GROUP BY %(tree)s
+    HAVING MIN(%(left)s) <> 1
+        OR MAX(%(right)s) %(max_edge)s 2 * COUNT(*)
+        OR SUM(CASE WHEN %(parent)s IS NULL THEN 1 ELSE 0 END) <> 1
+    UNION
+    SELECT %(tree)s
+    FROM %(table)s n
+    WHERE %(parent)s IS NULL
+      AND (%(left)s <> 1 OR %(level)s <> 0)""",
+    # Every edge indicator must be unique within its tree.
+    """
+    SELECT DISTINCT %(edges_tree)s
+    FROM (
+        SELECT %(tree_as)s, %(left)s AS edge FROM %(table)s n
+        UNION ALL
+        SELECT %(tree_as)s, %(right)s AS edge FROM %(table)s n
+    ) edges
+    GROUP BY %(edges_tree)s, edges.edge
+    HAVING COUNT(*) > 1""",
+    # Every node must be contained by its parent, in the same tree, one
+    # level below it.
+    """
+    SELECT %(c_tree)s
+    FROM %(table)s c
+    INNER JOIN %(table)s p
+        ON p.%(pk)s = c.%(parent)s
+    WHERE %(different_tree)s
+       OR c.%(left)s <= p.%(left)s
+       OR c.%(right)s >= p.%(right)s
+       OR c.%(level)s <> p.%(level)s + 1
+    UNION
+    SELECT %(p_tree)s
+    FROM %(table)s c
+    INNER JOIN %(table)s p
+        ON p.%(pk)s = c.%(parent)s
+    WHERE %(different_tree)s""",
+    # Nodes must not partially overlap.
+    """
+    SELECT DISTINCT %(a_tree)s
+    FROM %(table)s a
+    INNER JOIN %(table)s b
+        ON %(same_tree)s
+       AND b.%(left)s > a.%(left)s
+       AND b.%(left)s < a.%(right)s
+       AND b.%(right)s > a.%(right)s""",
+)
+
+def get_connection(using=None):
+    """
+    Returns the connection to the database with the alias ``using``,
+    defaulting to the default database.
+    """
+    if connections is None:
+        return connection
+    return connections[using or DEFAULT_DB_ALIAS]
+
+def commit_unless_managed(using=None):
+    """
+    Commits changes made to the database with the alias ``using`` if
+    it is not in managed transaction mode.
+    """
+    if connections is None:
+        transaction.commit_unless_managed()
+    else:
+        transaction.commit_unless_managed(using=using)
+
+def query_set_using(queryset, using):
+    """
+    Makes ``queryset`` read from the database with the alias ``using``,
+    unless it is ``None``.
+    """
+    if using is None or connections is None:
+        return queryset
+    return queryset.using(using)
+
+def get_db_prep_save(field, value, using=None):
+    """
+    Prepares ``value`` for saving to ``field``'s column in the database
+    with the alias ``using``.
+    """
+    if connections is None:
+        return field.get_db_prep_save(value)
+    return field.get_db_prep_save(value, connection=get_connection(using))
+
+def _has_row_value(row, field):
+    """
+    Returns ``True`` if an imported ``row`` contains a value for
+    ``field``.
+    """
+    return (field.attname in row or field.name in row or
+            (field.primary_key and 'pk' in row))
+
+def _row_value(row, field):
+    """
+    Retrieves the value for ``field`` from an imported ``row``, which
+    may be keyed by the field's attribute name or its name, or by
+    ``'pk'`` for the primary key.
+    """
+    for key in (field.attname, field.name):
+        if key in row:
+            return row[key]
+    if field.primary_key:
+        return row.get('pk')
+    return None
+
+def check_tree_rows(rows, gaps=False):
+    """
+    Checks the structure of a single tree in one pass, given an iterable
+    of ``(pk, parent_pk, tree_id, left, right, level)`` rows for its
+    nodes in tree order, returning a list of error messages. Any further
+    columns in each row are ignored.
+
+    If ``gaps`` is ``True``, unused edge indicators aren't errors.
+
+    Only the nodes which enclose the current node are held in memory.
+    """
+    errors = []
+    # (pk, right) for each node which encloses the current node
+    enclosing = []
+    state = {'edge': 0, 'roots': 0}
+
+    def close_node(pk, right):
+        if right > state['edge'] + 1 and not gaps:
+            errors.append(_('Edge indicators %(start)s to %(end)s are unused before the right edge of node %(pk)s.') % {
+                'start': state['edge'] + 1, 'end': right - 1, 'pk': pk})
+        state['edge'] = max(state['edge'], right)
+
+    for row in rows:
+        pk, parent_pk, tree_id, left, right, level = row[:6]
+        while enclosing and enclosing[-1][1] <= left:
+            close_node(*enclosing.pop())
+
+        if left > state['edge'] + 1 and not gaps:
+            errors.append(_('Edge indicators %(start)s to %(end)s are unused before node %(pk)s.') % {
+                'start': state['edge'] + 1, 'end': left - 1, 'pk': pk})
+        elif left <= state['edge']:
+            errors.append(_('Node %(pk)s overlaps the node before it.') % {
+                'pk': pk})
+        if right <= left:
+            errors.append(_('Node %(pk)s has a right edge indicator which is not greater than its left edge indicator.') % {
+                'pk': pk})
+        elif enclosing and right >= enclosing[-1][1]:
+            errors.append(_('Node %(pk)s overlaps node %(other)s.') % {
+                'pk': pk, 'other': enclosing[-1][0]})
+
+        enclosing_pks = [node_pk for node_pk, node_right in enclosing]
+        if parent_pk is None:
+            state['roots'] += 1
+            if enclosing:
+                errors.append(_('Root node %(pk)s is enclosed by node %(other)s.') % {
+                    'pk': pk, 'other': enclosing_pks[-1]})
+            elif state['roots'] > 1:
+                errors.append(_('Node %(pk)s is an additional root node.') % {
+                    'pk': pk})
+        elif parent_pk not in enclosing_pks:
+            errors.append(_('Node %(pk)s is not enclosed by its parent, node %(parent)s.') % {
+                'pk': pk, 'parent': parent_pk})
+        elif parent_pk != enclosing_pks[-1]:
+            errors.append(_('Node %(pk)s is enclosed by node %(other)s, which is not its parent.') % {
+                'pk': pk, 'other': enclosing_pks[-1]})
+        if level != len(enclosing):
+            errors.append(_('Node %(pk)s has a level of %(level)s instead of %(expected)s.') % {
+                'pk': pk, 'level': level, 'expected': len(enclosing)})
+
+        enclosing.append((pk, right))
+        state['edge'] = max(state['edge'], left)
+
+    while enclosing:
+        close_node(*enclosing.pop())
+    return errors
+
+def _check_tree(args):
+    """
+    Checks a single tree of a given model in a worker process.
+    """
+    app_label, model_name, tree, using = args
+    model = models.get_model(app_label, model_name)
+    return tree, model._tree_manager._check_tree(tree, using=using)
+
+_node_classes = {}
+
+def node_class(model, fields):
+    """
+    Creates a lightweight, read-only class for representing nodes of
+    ``model`` which have the given ``fields``, in addition to their
+    primary key and tree fields.
+
+    Instances of the class support the same navigation helpers which
+    don't require database access as model instances do and have the
+    same ``_meta``, so they may be used anywhere tree utilities expect a
+    list of model instances.
+
+    Classes are cached, so the same class will be returned for the same
+    model and fields.
+    """
+    key = (model, tuple(fields))
+    if key in _node_classes:
+        return _node_classes[key]
+
+    opts = model._meta
+    attrs = ['pk', '%s_id' % opts.parent_attr, opts.tree_id_attr,
+             opts.left_attr, opts.right_attr, opts.level_attr]
+    attrs.extend([f for f in fields if f not in attrs])
+
+    class TreeNode(object):
+        __slots__ = tuple(attrs)
+        _meta = opts
+
+        def __init__(self, *values):
+            for attr, value in zip(attrs, values):
+                object.__setattr__(self, attr, value)
+
+        def __setattr__(self, attr, value):
+            raise AttributeError(_('%s nodes are read-only.') %
+                                 opts.object_name)
+
+        def __unicode__(self):
+            if fields:
+                return unicode(getattr(self, fields[0]))
+            return unicode(self.pk)
+
+        def __str__(self):
+            return unicode(self).encode('utf-8')
+
+        def __repr__(self):
+            return '<%s node: %s>' % (opts.object_name, self)
+
+        # Lightweight nodes never query, so descendants are counted from
+        # edge indicators even if trees have gaps
+        get_descendant_count = tree_models._get_enclosed_count
+        is_ancestor_of = tree_models.is_ancestor_of
+        is_child_node = tree_models.is_child_node
+        is_descendant_of = tree_models.is_descendant_of
+        is_leaf_node = tree_models.is_leaf_node
+        is_root_node = tree_models.is_root_node
+
+    TreeNode.__name__ = '%sNode' % opts.object_name
+    _node_classes[key] = TreeNode
+    return TreeNode
+
+class TreeQuerySet(models.query.QuerySet):
+    """
+    A ``QuerySet`` of tree items which keeps their trees intact when
+    the items are deleted.
+    """
+    # The number of items, if it is known from a node's edge indicators.
+    # Cloning a QuerySet doesn't copy this, so any further filtering
+    # falls back on counting items in the database.
+    _node_count = None
+
+    def count(self):
+        """
+        Returns the number of items in this ``QuerySet``, without
+        querying the database if it holds the descendants of a node.
+        """
+        if self._node_count is not None and self._result_cache is None:
+            return self._node_count
+        return super(TreeQuerySet, self).count()
+
+    def delete(self):
+        """
+        Deletes the nodes in this ``QuerySet`` along with their
+        descendants, then closes the gaps left in their trees.
+
+        Nodes which have an ancestor in this ``QuerySet`` are already
+        covered by their ancestor's deletion, so the remaining subtrees
+        are deleted together and the edge indicators of each tree they
+        were in are renumbered with a single query, rather than closing
+        a gap for each node.
+
+        If trees are sharded, nodes are deleted from every database
+        their trees are kept in, unless this ``QuerySet`` has been bound
+        to one database with ``using``.
+        """
+        assert self.query.can_filter(), \
+                "Cannot use 'limit' or 'offset' with delete."
+
+        tree_manager = self.model._tree_manager
+        using = tree_manager._db_for_write(using=getattr(self, '_db', None))
+        if tree_manager.tree_router is not None and getattr(self, '_db', None):
+            aliases = [self._db]
+        else:
+            # Sharded trees could be in any of their databases
+            aliases = tree_manager._get_databases(using)
+        for alias in aliases:
+            self._delete_subtrees(alias)
+
+    def leaf_nodes(self):
+        """
+        Filters this ``QuerySet`` down to leaf nodes, which are found
+        by comparing their edge indicators, unless trees may have gaps
+        left by lazy deletion.
+        """
+        tree_manager = self.model._tree_manager
+        if tree_manager.lazy_delete:
+            # Gaps can leave room between a leaf node's edge indicators,
+            # so look for nodes without children instead.
+            field = self.model._meta.get_field(tree_manager.parent_attr)
+            return self.filter(**{'%s__isnull' % (field.rel.related_name or
+                                  self.model._meta.object_name.lower()): True})
+        return self.filter(**{
+            tree_manager.right_attr: models.F(tree_manager.left_attr) + 1,
+        })
+
+    def _delete_subtrees(self, using):
+        """
+        Deletes the subtrees of the nodes in this ``QuerySet`` which are
+        in the database with the alias ``using``, grouped by the
+        database each of their trees is kept in, then closes the gaps
+        left in each tree.
+        """
+        tree_manager = self.model._tree_manager
+        fields = ['pk', tree_manager.tree_id_attr, tree_manager.left_attr,
+                  tree_manager.right_attr]
+        if tree_manager.tree_scope_attr is not None:
+            fields.append(tree_manager.tree_scope_attr)
+        rows = query_set_using(self.values_list(*fields), using).order_by(
+            *tree_manager._tree_ordering())
+
+        pending = []
+        trees = []
+        subtrees = {}
+        for row in rows:
+            pk, tree_id, left, right = row[:4]
+            if not left:
+                # Deferred nodes haven't been given any space in their tree
+                pending.append(pk)
+                continue
+            if tree_manager.tree_scope_attr is None:
+                tree = tree_id
+            else:
+                tree = (row[4], tree_id)
+            if tree not in subtrees:
+                trees.append(tree)
+                subtrees[tree] = []
+            ranges = subtrees[tree]
+            # Nodes come in tree order, so a node which starts within
+            # the last subtree being deleted is one of its descendants.
+            if ranges and left < ranges[-1][1]:
+                continue
+            ranges.append((left, right))
+
+        doomed = {}
+        if pending:
+            doomed[using] = [models.Q(pk__in=pending)]
+        for tree in trees:
+            tree_id, scope = tree_manager._split_tree(tree)
+            tree_using = tree_manager._db_for_tree(tree_id, using)
+            for left, right in subtrees[tree]:
+                filters = tree_manager._scope_filters(scope)
+                filters[tree_manager.tree_id_attr] = tree_id
+                filters['%s__range' % tree_manager.left_attr] = (left, right)
+                doomed.setdefault(tree_using, []).append(models.Q(**filters))
+        for alias, filters in doomed.items():
+            query_set_using(models.query.QuerySet(self.model), alias).filter(
+                reduce(operator.or_, filters)).delete()
+
+        for tree in trees:
+            tree_id, scope = tree_manager._split_tree(tree)
+            tree_using = tree_manager._db_for_tree(tree_id, using)
+            if not tree_manager.lazy_delete:
+                tree_manager._close_gaps(subtrees[tree], tree_id, tree_using,
+                                         scope)
+            elif tree_manager.compact_threshold is not None:
+                tree_manager.compact_tree(tree_id, tree_using, scope,
+                                          tree_manager.compact_threshold)
+        for alias in doomed.keys():
+            commit_unless_managed(alias)
+
 class TreeManager(models.Manager):
     """
     A manager for working with trees of objects.
     """
     def __init__(self, parent_attr, left_attr, right_attr, tree_id_attr,
-                 level_attr):
+                 level_attr, tree_router=None, tree_scope_attr=None,
+                 tree_id_gap=None, update_chunk_size=None,
+                 update_chunk_pause=0, defer_insertion=False,
+                 lazy_delete=False, compact_threshold=None):
         """
         Tree attributes for the model being managed are held as
         attributes of this manager for later use, since it will be using
         them a **lot**.
+
+        If a ``tree_router`` is given, trees will be sharded across the
+        databases it maps tree ids to.
+
+        If a ``tree_scope_attr`` is given, tree ids and the ordering of
+        root nodes are independent for each value of that field.
+
+        If a ``tree_id_gap`` is given, new trees are given tree ids that
+        far apart, so root nodes can usually be reordered without
+        changing the tree ids of other trees.
+
+        If an ``update_chunk_size`` is given, edge indicators are shifted
+        that many edge indicators at a time, pausing for
+        ``update_chunk_pause`` seconds between chunks.
+
+        If ``defer_insertion`` is ``True``, new child nodes are saved
+        without being positioned in their trees until ``flush_pending``
+        is called.
+
+        If ``lazy_delete`` is ``True``, deleting nodes leaves gaps in
+        edge indicators until ``compact_tree`` is called, which is done
+        after a deletion leaves more than ``compact_threshold`` unused
+        edge indicators in a tree, if given.
         """
         super(TreeManager, self).__init__()
         self.parent_attr = parent_attr
@@ -46,6 +492,14 @@ class TreeManager(models.Manager):
         self.right_attr = right_attr
         self.tree_id_attr = tree_id_attr
         self.level_attr = level_attr
+        self.tree_router = tree_router
+        self.tree_scope_attr = tree_scope_attr
+        self.tree_id_gap = tree_id_gap
+        self.update_chunk_size = update_chunk_size
+        self.update_chunk_pause = update_chunk_pause
+        self.defer_insertion = defer_insertion
+        self.lazy_delete = lazy_delete
+        self.compact_threshold = compact_threshold
 
     def add_related_count(self, queryset, rel_model, rel_field, count_attr,
                           cumulative=False):
@@ -74,6 +528,7 @@ class TreeManager(models.Manager):
            descendants, otherwise it will be for each item itself.
         """
         opts = self.model._meta
+        qn = get_connection(getattr(queryset, 'db', None)).ops.quote_name
         if cumulative:
             subquery = CUMULATIVE_COUNT_SUBQUERY % {
                 'rel_table': qn(rel_model._meta.db_table),
@@ -83,6 +538,7 @@ class TreeManager(models.Manager):
                 'tree_id': qn(opts.get_field(self.tree_id_attr).column),
                 'left': qn(opts.get_field(self.left_attr).column),
                 'right': qn(opts.get_field(self.right_attr).column),
+                'scope': self._same_scope_sql(qn, 'm2', qn(opts.db_table)),
             }
         else:
             subquery = COUNT_SUBQUERY % {
@@ -93,17 +549,895 @@ class TreeManager(models.Manager):
             }
         return queryset.extra(select={count_attr: subquery})
 
+    def add_related_aggregate(self, queryset, rel_model, rel_path,
+                              aggregate_attr, aggregate='COUNT',
+                              aggregate_field=None, cumulative=False):
+        """
+        Adds an aggregate of related items to each item in a given
+        ``QuerySet``, for a ``Model`` class which has a foreign key or a
+        many-to-many relation to this ``Manager``'s ``Model`` class.
+
+        The aggregate for all items is calculated with a single grouped
+        query and the ``QuerySet`` is evaluated, so a list of the items
+        it contains is returned.
+
+        Arguments:
+
+        ``rel_model``
+           A ``Model`` class which has a relation to this ``Manager``'s
+           ``Model`` class.
+
+        ``rel_path``
+           The name of the ``ForeignKey`` or ``ManyToManyField`` in
+           ``rel_model`` which holds the relation.
+
+        ``aggregate_attr``
+           The name of an attribute which should be added to each item,
+           containing the aggregated value.
+
+        ``aggregate``
+           The SQL aggregate function to use - one of ``'AVG'``,
+           ``'COUNT'``, ``'MAX'``, ``'MIN'`` or ``'SUM'``.
+
+        ``aggregate_field``
+           The name of the field in ``rel_model`` to be aggregated. This
+           is required for every aggregate apart from ``'COUNT'``, which
+           counts related items.
+
+        ``cumulative``
+           If ``True``, the aggregate will be for each item and all of
+           its descendants, otherwise it will be for each item itself.
+           Related items which are related to more than one node in a
+           subtree are only included once.
+        """
+        aggregate = aggregate.upper()
+        if aggregate not in AGGREGATE_FUNCTIONS:
+            raise ValueError(_('An invalid aggregate was given: %s.') % aggregate)
+        if aggregate_field is None and aggregate != 'COUNT':
+            raise ValueError(_('An aggregate field must be given for %s.') % aggregate)
+
+        items = list(queryset)
+        if not items:
+            return items
+
+        connection = get_connection(getattr(queryset, 'db', None))
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        rel_opts = rel_model._meta
+        rel_field = rel_opts.get_field(rel_path)
+        if isinstance(rel_field, models.ManyToManyField):
+            join_table = rel_field.m2m_db_table()
+            mptt_fk = rel_field.m2m_reverse_name()
+            item_fk = rel_field.m2m_column_name()
+        else:
+            join_table = rel_opts.db_table
+            mptt_fk = rel_field.column
+            item_fk = rel_opts.pk.column
+
+        mptt_pk = qn(opts.pk.column)
+        if cumulative:
+            descendant_join = ('d.%(tree_id)s = m.%(tree_id)s%(scope)s AND '
+                               'd.%(left)s BETWEEN m.%(left)s AND m.%(right)s' % {
+                'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+                'left': qn(opts.get_field(self.left_attr).column),
+                'right': qn(opts.get_field(self.right_attr).column),
+                'scope': self._same_scope_sql(qn, 'd', 'm'),
+            })
+        else:
+            descendant_join = 'd.%s = m.%s' % (mptt_pk, mptt_pk)
+
+        if aggregate_field is None:
+            value = 'related.item_id'
+            rel_join = ''
+        else:
+            value = 'r.%s' % qn(rel_opts.get_field(aggregate_field).column)
+            rel_join = """
+INNER JOIN %s r
+    ON r.%s = related.item_id""" % (qn(rel_opts.db_table),
+                                    qn(rel_opts.pk.column))
+
+        pks = [item.pk for item in items]
+        cursor = connection.cursor()
+        cursor.execute(RELATED_AGGREGATE_QUERY % {
+            'aggregate': aggregate,
+            'value': value,
+            'mptt_table': qn(opts.db_table),
+            'mptt_pk': mptt_pk,
+            'item_fk': qn(item_fk),
+            'descendant_join': descendant_join,
+            'join_table': qn(join_table),
+            'mptt_fk': qn(mptt_fk),
+            'node_pks': ', '.join(['%s'] * len(pks)),
+            'rel_join': rel_join,
+        }, pks)
+        values = dict(cursor.fetchall())
+
+        default = None
+        if aggregate == 'COUNT':
+            default = 0
+        for item in items:
+            setattr(item, aggregate_attr, values.get(item.pk, default))
+        return items
+
+    def all_root_nodes(self):
+        """
+        Returns a list of root nodes in tree order.
+
+        If trees are sharded, root nodes are retrieved from every
+        database, as ``root_nodes`` only queries one of them.
+        """
+        queryset = self.root_nodes()
+        if self.tree_router is None or getattr(self, '_db', None):
+            return list(queryset)
+        roots = []
+        for alias in self._get_databases():
+            roots.extend([(self._get_scope(root),
+                           getattr(root, self.tree_id_attr), root)
+                          for root in query_set_using(queryset, alias)])
+        roots.sort()
+        return [root for scope, tree_id, root in roots]
+
+    def at_level(self, level, tree_id=None, scope=None):
+        """
+        Creates a ``QuerySet`` containing the nodes at the given
+        ``level``, in the tree with the given id if one is given, using
+        the indexed level field rather than reading whole trees.
+
+        If trees are scoped, only nodes in the given ``scope`` will be
+        included.
+        """
+        filters = {self.level_attr: level}
+        if tree_id is not None:
+            filters[self.tree_id_attr] = tree_id
+        if scope is not None:
+            filters.update(self._scope_filters(scope))
+        return self.filter(**filters)
+
+    def check_tree_integrity(self, tree_ids=None, processes=None,
+                             chunk_size=1000, using=None):
+        """
+        Checks the structure of every tree, or of the trees with the
+        given ``tree_ids``, in a single pass over each tree's nodes in
+        tree order, returning a ``dict`` mapping the ids of any invalid
+        trees to lists of error messages describing gaps and overlaps
+        in edge indicators, nodes which aren't enclosed by their parents
+        and nodes at the wrong level.
+
+        Nodes are read ``chunk_size`` at a time, using a server-side
+        cursor where the database adapter supports one, so the table is
+        never held in memory.
+
+        If ``processes`` is greater than ``1``, trees will be checked in
+        parallel using a pool of that many processes, each of which has
+        its own database connection.
+
+        If trees are sharded, each tree is checked in the database it is
+        kept in. If trees are scoped, trees are identified by
+        ``(scope, tree_id)`` tuples rather than by tree ids.
+        """
+        using = self._db_for_read(using=using)
+        if processes is not None and processes > 1:
+            try:
+                import multiprocessing
+            except ImportError:
+                # Python < 2.6 - check trees one at a time
+                processes = None
+        if processes is not None and processes > 1:
+            if tree_ids is None:
+                tree_ids = self._get_tree_ids(using)
+            opts = self.model._meta
+            # Each worker process must open its own connections
+            for alias in self._get_databases(using):
+                get_connection(alias).close()
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_check_tree, [
+                    (opts.app_label, opts.object_name, tree,
+                     self._db_for_tree(self._split_tree(tree)[0], using))
+                    for tree in tree_ids])
+            finally:
+                pool.close()
+                pool.join()
+        elif tree_ids is None:
+            rows = itertools.chain(*[
+                self._iterate_tree_rows(None, chunk_size, alias)
+                for alias in self._get_databases(using)])
+            if self.tree_scope_attr is None:
+                key = operator.itemgetter(2)
+            else:
+                key = operator.itemgetter(6, 2)
+            results = [(tree, check_tree_rows(tree_rows, self.lazy_delete))
+                       for tree, tree_rows in itertools.groupby(rows, key)]
+        else:
+            results = [(tree, self._check_tree(tree, chunk_size,
+                self._db_for_tree(self._split_tree(tree)[0], using)))
+                for tree in tree_ids]
+        return dict([(tree, errors) for tree, errors in results if errors])
+
+    def compact_tree(self, tree_id, using=None, scope=None, threshold=None):
+        """
+        Closes the gaps left in the edge indicators of the tree with the
+        given id by deleting nodes of a model registered with
+        ``lazy_delete``, renumbering its edge indicators in order in a
+        single pass and updating only the nodes whose edge indicators
+        change.
+
+        If ``threshold`` is given, the tree is only compacted if more
+        than ``threshold`` of its edge indicators are unused.
+
+        If trees are scoped, the ``scope`` of the tree must be given.
+
+        Returns ``True`` if any nodes were updated.
+        """
+        using = self._db_for_tree(tree_id, self._db_for_write(using=using))
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        # Deferred nodes have edge indicators of 0 and are left alone
+        columns = {
+            'pk': qn(opts.pk.column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'table': qn(opts.db_table),
+            'scope': scope_sql,
+        }
+        cursor = connection.cursor()
+        if threshold is not None:
+            cursor.execute("""
+            SELECT MAX(%(right)s) - 2 * COUNT(*)
+            FROM %(table)s
+            WHERE %(tree_id)s = %%s AND %(left)s > 0%(scope)s""" % columns,
+                [tree_id] + scope_params)
+            unused = cursor.fetchone()[0]
+            if unused is None or unused <= threshold:
+                return False
+
+        cursor.execute("""
+        SELECT %(pk)s, %(left)s, %(right)s, %(level)s
+        FROM %(table)s
+        WHERE %(tree_id)s = %%s AND %(left)s > 0%(scope)s""" % columns,
+            [tree_id] + scope_params)
+        rows = cursor.fetchall()
+        edges = []
+        for pk, left, right, level in rows:
+            edges.append((left, pk))
+            edges.append((right, pk))
+        edges.sort()
+        # Each edge indicator becomes its position in order, which
+        # always comes to a node's left edge indicator first
+        new_edges = {}
+        for i, (edge, pk) in enumerate(edges):
+            new_edges.setdefault(pk, []).append(i + 1)
+        updates = []
+        for pk, left, right, level in rows:
+            new_left, new_right = new_edges[pk]
+            if new_left != left or new_right != right:
+                updates.append((tree_id, new_left, new_right, level, pk))
+        self._update_tree_fields(updates, using)
+        commit_unless_managed(using)
+        return bool(updates)
+
+    def compact_trees(self, threshold=None, using=None):
+        """
+        Compacts every tree with more than ``threshold`` unused edge
+        indicators, or with any unused edge indicators if no threshold
+        is given, using ``compact_tree``.
+
+        Returns a sorted list of the ids of the trees which were
+        compacted, or ``(scope, tree_id)`` tuples if trees are scoped.
+        """
+        opts = self.model._meta
+        trees = []
+        for alias in self._get_databases(self._db_for_write(using=using)):
+            connection = get_connection(alias)
+            qn = connection.ops.quote_name
+            tree_columns = qn(opts.get_field(self.tree_id_attr).column)
+            if self.tree_scope_attr is not None:
+                tree_columns = '%s, %s' % (qn(opts.get_field(
+                    self.tree_scope_attr).column), tree_columns)
+            cursor = connection.cursor()
+            cursor.execute("""
+            SELECT %(tree)s
+            FROM %(table)s
+            WHERE %(left)s > 0
+            GROUP BY %(tree)s
+            HAVING MAX(%(right)s) - 2 * COUNT(*) > %%s""" % {
+                'tree': tree_columns,
+                'table': qn(opts.db_table),
+                'left': qn(opts.get_field(self.left_attr).column),
+                'right': qn(opts.get_field(self.right_attr).column),
+            }, [threshold or 0])
+            if self.tree_scope_attr is None:
+                trees.extend([row[0] for row in cursor.fetchall()])
+            else:
+                trees.extend([tuple(row) for row in cursor.fetchall()])
+        trees.sort()
+        for tree in trees:
+            tree_id, scope = self._split_tree(tree)
+            self.compact_tree(tree_id, using, scope)
+        return trees
+
+    def copy_subtree(self, node, target, position='last-child', overrides=None,
+                     copy_related=None, using=None):
+        """
+        Copies ``node`` and its descendants, positioning the copy
+        relative to the given ``target`` node as specified by
+        ``position``, returning the copy of ``node``. A ``target`` of
+        ``None`` indicates that the copy should be the last root node.
+
+        Space is made for the copy once, every node is copied with a
+        single ``INSERT ... SELECT`` and the parents of the copied nodes
+        are then pointed at their copied parents with a single
+        ``UPDATE``.
+
+        ``overrides`` is a ``dict`` of values to give fields of every
+        copied node, by field name. If ``copy_related`` is given, it is
+        called with a ``dict`` mapping the primary key of each node to
+        the primary key of its copy, so related rows can be copied.
+        """
+        opts = self.model._meta
+        if not isinstance(opts.pk, models.AutoField):
+            raise ValueError(_('Only nodes with automatically assigned primary keys can be copied.'))
+        using = self._db_for_write(node, using)
+        self._flush_for([node, target], using)
+        if target is None:
+            scope = self._get_scope(node)
+        else:
+            scope = self._get_scope(target)
+        width = getattr(node, self.right_attr) - getattr(node, self.left_attr) + 1
+
+        if target is None or (target.is_root_node() and
+                              position in ['left', 'right']):
+            if target is None or self.tree_router is not None:
+                new_tree_id = self._get_next_tree_id(using=using, scope=scope)
+            elif self.tree_id_gap:
+                new_tree_id = self._get_root_sibling_tree_id(self.model(),
+                    target, position, using)
+            else:
+                space_target = getattr(target, self.tree_id_attr)
+                if position == 'left':
+                    space_target -= 1
+                self._create_tree_space(space_target, using, scope)
+                new_tree_id = space_target + 1
+            new_left = 1
+            new_level = 0
+            parent_pk = None
+        else:
+            if position in ['last-child', 'first-child']:
+                parent_pk = target.pk
+                new_level = getattr(target, self.level_attr) + 1
+            elif position in ['left', 'right']:
+                parent_pk = getattr(target, opts.get_field(
+                    self.parent_attr).attname)
+                new_level = getattr(target, self.level_attr)
+            else:
+                raise ValueError(_('An invalid position was given: %s.') % position)
+            space_target = self._calculate_inter_tree_move_values(node,
+                target, position)[0]
+            new_tree_id = getattr(target, self.tree_id_attr)
+            if (new_tree_id == getattr(node, self.tree_id_attr) and
+                scope == self._get_scope(node) and
+                getattr(node, self.left_attr) <= space_target <
+                getattr(node, self.right_attr)):
+                raise InvalidMove(_('A node may not be copied into its own subtree.'))
+            if self._db_for_tree(new_tree_id, using) == using:
+                self._create_space(width, space_target, new_tree_id, using,
+                                   scope)
+            new_left = space_target + 1
+        if self._db_for_tree(new_tree_id, using) != using:
+            # Rows can only be copied within a database
+            raise InvalidMove(_('A node may not be copied to a tree in another database.'))
+
+        # Making space may have changed the node's tree fields
+        tree_id, left, right, level = query_set_using(
+            self.model._base_manager.filter(pk=node.pk), using).values_list(
+                self.tree_id_attr, self.left_attr, self.right_attr,
+                self.level_attr)[0]
+        left_right_change = new_left - left
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        overrides = overrides or {}
+        fields = [f for f in opts.local_fields if f is not opts.pk]
+        values = []
+        params = []
+        for f in fields:
+            if f.name in overrides:
+                values.append('%s')
+                params.append(get_db_prep_save(f, overrides[f.name], using))
+            elif f.name in (self.left_attr, self.right_attr):
+                values.append('%s + %%s' % qn(f.column))
+                params.append(left_right_change)
+            elif f.name == self.level_attr:
+                values.append('%s + %%s' % qn(f.column))
+                params.append(new_level - level)
+            elif f.name == self.tree_id_attr:
+                values.append('%s')
+                params.append(new_tree_id)
+            elif f.name == self.tree_scope_attr:
+                values.append('%s')
+                params.append(get_db_prep_save(f, scope, using))
+            elif f.name == self.parent_attr:
+                # The copy of the node is given its new parent - the rest
+                # are pointed at their copied parents below.
+                values.append('CASE WHEN %s = %%s THEN %%s ELSE %s END' % (
+                    qn(opts.get_field(self.left_attr).column), qn(f.column)))
+                params.extend([left, parent_pk])
+            else:
+                values.append(qn(f.column))
+        scope_sql, scope_params = self._scope_sql(qn, self._get_scope(node))
+        columns = {
+            'table': qn(opts.db_table),
+            'pk': qn(opts.pk.column),
+            'parent': qn(opts.get_field(self.parent_attr).column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'level': qn(opts.get_field(self.level_attr).column),
+        }
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT INTO %(table)s (%(columns)s)
+        SELECT %(values)s
+        FROM %(table)s
+        WHERE %(tree_id)s = %%s
+          AND %(left)s >= %%s AND %(left)s <= %%s%(scope)s""" % dict(columns,
+            columns=', '.join([qn(f.column) for f in fields]),
+            values=', '.join(values), scope=scope_sql),
+            params + [tree_id, left, right] + scope_params)
+
+        # Each copied node's parent is the copied node which encloses it
+        # at the level above. The copied nodes are selected in a derived
+        # table, as MySQL won't update a table it selects from.
+        new_scope_sql, new_scope_params = self._scope_sql(qn, scope)
+        copied = """
+            SELECT %(pk)s, %(left)s, %(right)s, %(level)s
+            FROM %(table)s
+            WHERE %(tree_id)s = %%s
+              AND %(left)s >= %%s AND %(left)s <= %%s%(scope)s""" % dict(
+            columns, scope=new_scope_sql)
+        copied_params = [new_tree_id, new_left, new_left + width - 1]
+        copied_params.extend(new_scope_params)
+        cursor.execute("""
+        UPDATE %(table)s
+        SET %(parent)s = (
+            SELECT p.%(pk)s
+            FROM (%(copied)s) p
+            WHERE p.%(left)s < %(table)s.%(left)s
+              AND p.%(right)s > %(table)s.%(right)s
+              AND p.%(level)s = %(table)s.%(level)s - 1)
+        WHERE %(tree_id)s = %%s
+          AND %(left)s > %%s AND %(left)s <= %%s%(scope)s""" % dict(columns,
+            copied=copied, scope=new_scope_sql),
+            copied_params + copied_params)
+
+        new_filters = self._scope_filters(scope)
+        new_filters.update({
+            self.tree_id_attr: new_tree_id,
+            '%s__range' % self.left_attr: (new_left, new_left + width - 1),
+        })
+        if copy_related is not None:
+            old_filters = self._scope_filters(self._get_scope(node))
+            old_filters.update({
+                self.tree_id_attr: tree_id,
+                '%s__range' % self.left_attr: (left, right),
+            })
+            old_pks = dict([(node_left + left_right_change, pk) for
+                            node_left, pk in query_set_using(
+                                self.model._base_manager.filter(**old_filters),
+                                using).values_list(self.left_attr, 'pk')])
+            copy_related(dict([(old_pks[node_left], pk) for node_left, pk in
+                               query_set_using(self.model._base_manager.filter(
+                                   **new_filters), using).values_list(
+                                       self.left_attr, 'pk')]))
+        commit_unless_managed(using)
+        new_filters[self.left_attr] = new_filters.pop(
+            '%s__range' % self.left_attr)[0]
+        return query_set_using(self.all(), using).get(**new_filters)
+
+    def estimate(self, op, node, target=None, position='last-child',
+                 using=None):
+        """
+        Estimates the cost of an operation on ``node`` without performing
+        it, returning a dictionary containing the number of ``rows``
+        which would be inserted, updated or deleted and the number of
+        ``queries`` which would be issued to write them.
+
+        Valid values for ``op`` are ``'insert'``, ``'move'`` and
+        ``'delete'``. For insertions and moves, ``target`` and
+        ``position`` have the same meaning as they do for
+        ``insert_node`` and ``move_node``; they are ignored for
+        deletions.
+
+        The estimate is calculated from the edge indicators of ``node``
+        and ``target``, with a single query counting the rows which
+        would be shifted in each database involved. Queries which only
+        read, such as those which find tree ids, aren't included, and
+        tree ids allocated with gaps are assumed to have room between
+        root nodes.
+        """
+        if op not in ('insert', 'move', 'delete'):
+            raise ValueError(_('An invalid operation was given: %s.') % op)
+        using = self._db_for_write(node, using)
+        left = getattr(node, self.left_attr)
+        right = getattr(node, self.right_attr)
+        tree_id = getattr(node, self.tree_id_attr)
+        if target is None:
+            scope = self._get_scope(node)
+            root_sibling = False
+        else:
+            scope = self._get_scope(target)
+            target_tree_id = getattr(target, self.tree_id_attr)
+            root_sibling = (target.is_root_node() and
+                            position in ['left', 'right'])
+            if root_sibling and position == 'left':
+                tree_space_target = target_tree_id - 1
+            else:
+                tree_space_target = target_tree_id
+
+        # Rows and queries which can be counted from the edge indicators
+        # alone, plus (tree_id, lower, upper, own_query) ranges of edge
+        # indicators which would be shifted, where an upper bound of
+        # None is the end of the tree and own_query indicates whether
+        # the range is shifted with its own query rather than as part of
+        # a subtree move, and (lower, upper) ranges of tree ids which
+        # would be shifted.
+        rows = queries = 0
+        edge_ranges = []
+        tree_ranges = []
+        if op == 'delete':
+            rows = (right - left + 1) // 2
+            queries = 1
+            if not self.lazy_delete:
+                edge_ranges.append((tree_id, right + 1, None, True))
+        elif op == 'insert':
+            rows = queries = 1
+            if target is None or (root_sibling and
+                                  (self.tree_router is not None or
+                                   self.tree_id_gap)):
+                pass
+            elif root_sibling:
+                tree_ranges.append((tree_space_target + 1, None))
+            else:
+                edge_ranges.append((target_tree_id,
+                    self._get_space_target(target, position) + 1, None,
+                    True))
+        elif target is None or (root_sibling and
+                                self.tree_router is not None):
+            if node.is_child_node():
+                rows = (right - left + 1) // 2
+                queries = 1
+                edge_ranges.append((tree_id, right + 1, None, False))
+        elif root_sibling:
+            if node.is_child_node():
+                rows = (right - left + 1) // 2
+                queries = 1
+                edge_ranges.append((tree_id, right + 1, None, False))
+                if not self.tree_id_gap:
+                    tree_ranges.append((tree_space_target + 1, None))
+                    if tree_id > tree_space_target:
+                        # The subtree is counted with the rest of its tree
+                        rows = 0
+            elif node != target:
+                if self.tree_id_gap:
+                    rows = (right - left + 1) // 2
+                    queries = 1
+                elif target_tree_id > tree_id:
+                    tree_ranges.append((tree_id, tree_space_target))
+                else:
+                    tree_ranges.append((tree_space_target + 1, tree_id))
+        elif node.is_child_node() and tree_id == target_tree_id:
+            width = right - left + 1
+            new_left, new_right = self._calculate_within_tree_move_values(
+                node, target, position)[:2]
+            left_boundary = min(left, new_left)
+            right_boundary = max(right, new_right)
+            if self.update_chunk_size:
+                queries = (2 * self._count_chunks(width) +
+                           self._count_chunks(right_boundary -
+                                              left_boundary + 1) + 1)
+            else:
+                queries = 1
+            edge_ranges.append((tree_id, left_boundary, right_boundary,
+                                False))
+        else:
+            rows = (right - left + 1) // 2
+            queries = 1
+            edge_ranges.append((target_tree_id,
+                self._get_space_target(target, position) + 1, None, True))
+            if node.is_child_node():
+                edge_ranges.append((tree_id, right + 1, None, False))
+
+        alias_ranges = {}
+        for edge_range in edge_ranges:
+            alias = self._db_for_tree(edge_range[0], using)
+            alias_ranges.setdefault(alias, ([], []))[0].append(edge_range)
+        if tree_ranges:
+            alias_ranges.setdefault(using, ([], []))[1].extend(tree_ranges)
+
+        opts = self.model._meta
+        for alias, (alias_edge_ranges, alias_tree_ranges) in \
+                alias_ranges.items():
+            connection = get_connection(alias)
+            qn = connection.ops.quote_name
+            left_column = qn(opts.get_field(self.left_attr).column)
+            right_column = qn(opts.get_field(self.right_attr).column)
+            tree_id_column = qn(opts.get_field(self.tree_id_attr).column)
+            # The largest edge indicator in each range which extends to
+            # the end of a tree determines how many chunks it would be
+            # shifted in.
+            max_edges, max_edge_params = [], []
+            conditions, params = [], []
+            for edge_tree_id, lower, upper, own_query in alias_edge_ranges:
+                if upper is None:
+                    condition = '%s = %%s AND %s >= %%s' % (tree_id_column,
+                                                            right_column)
+                    condition_params = [edge_tree_id, lower]
+                else:
+                    condition = ('%(tree_id)s = %%s AND '
+                                 '(%(left)s >= %%s AND %(left)s <= %%s OR '
+                                 '%(right)s >= %%s AND %(right)s <= %%s)' % {
+                        'tree_id': tree_id_column,
+                        'left': left_column,
+                        'right': right_column,
+                    })
+                    condition_params = [edge_tree_id, lower, upper, lower,
+                                        upper]
+                max_edges.append(', MAX(CASE WHEN %s THEN %s END)' % (
+                    condition, right_column))
+                max_edge_params.extend(condition_params)
+                conditions.append('(%s)' % condition)
+                params.extend(condition_params)
+            for lower, upper in alias_tree_ranges:
+                if upper is None:
+                    conditions.append('%s >= %%s' % tree_id_column)
+                    params.append(lower)
+                else:
+                    conditions.append('(%s >= %%s AND %s <= %%s)' % (
+                        tree_id_column, tree_id_column))
+                    params.extend([lower, upper])
+            scope_sql, scope_params = self._scope_sql(qn, scope)
+            cursor = connection.cursor()
+            cursor.execute('SELECT COUNT(*)%s FROM %s WHERE (%s)%s' % (
+                ''.join(max_edges), qn(opts.db_table),
+                ' OR '.join(conditions), scope_sql),
+                max_edge_params + params + scope_params)
+            row = cursor.fetchone()
+            rows += row[0]
+            for i, (edge_tree_id, lower, upper, own_query) in \
+                    enumerate(alias_edge_ranges):
+                if upper is not None:
+                    continue
+                if self.update_chunk_size:
+                    queries += self._count_chunks((row[i + 1] or 0) -
+                                                  lower + 1)
+                elif own_query:
+                    queries += 1
+            queries += len(alias_tree_ranges)
+        return {'rows': rows, 'queries': queries}
+
+    def flush_pending(self, tree_id=None, using=None, scope=None):
+        """
+        Positions child nodes whose insertion was deferred because the
+        model was registered with ``defer_insertion``, in the tree with
+        the given id or in every tree which has deferred nodes.
+
+        Each deferred node becomes the last child of its parent, in the
+        order the nodes were saved, and space is made for all of a
+        tree's deferred nodes with a single query.
+
+        If trees are scoped, the ``scope`` of the tree must be given.
+
+        Returns the number of nodes which were positioned.
+        """
+        if tree_id is None:
+            trees = self._get_tree_ids(using, pending=True)
+        elif self.tree_scope_attr is None:
+            trees = [tree_id]
+        else:
+            trees = [(scope, tree_id)]
+        flushed = 0
+        for tree in trees:
+            tree_id, scope = self._split_tree(tree)
+            flushed += self._flush_tree(tree_id, using, scope)
+        return flushed
+
     def get_query_set(self):
         """
-        Returns a ``QuerySet`` which contains all tree items, ordered in
-        such a way that that root nodes appear in tree id order and
+        Returns a ``TreeQuerySet`` which contains all tree items, ordered
+        in such a way that that root nodes appear in tree id order and
         their subtrees appear in depth-first order.
+
+        Nodes whose insertion has been deferred have no place in their
+        trees yet, so they are left out until they are positioned.
         """
-        return super(TreeManager, self).get_query_set().order_by(
-            self.tree_id_attr, self.left_attr)
+        if connections is None:
+            queryset = TreeQuerySet(self.model)
+        else:
+            queryset = TreeQuerySet(self.model, using=self._db)
+        if self.defer_insertion:
+            queryset = queryset.filter(**{'%s__gt' % self.left_attr: 0})
+        return queryset.order_by(*self._tree_ordering())
+
+    def import_adjacency(self, rows, batch_size=500, db_table=None,
+                         using=None):
+        """
+        Imports trees from an iterable of ``dict`` rows, such as a
+        ``csv.DictReader``, each of which contains a primary key, a
+        parent primary key (empty or ``None`` for root nodes) and values
+        for any other fields, keyed by field name or column attribute
+        name.
+
+        Tree fields are calculated for every row and rows are inserted
+        in batches of ``batch_size`` without being saved individually.
+        Children are inserted in the order they appear in ``rows``.
+
+        Since a tree's structure can't be known until all of its rows
+        have been read, every row is held in memory until it is
+        inserted.
+
+        ``ValueError`` is raised before anything is inserted if any rows
+        have a parent primary key which no row has.
+
+        If ``db_table`` is given, rows will be inserted into that table
+        instead of this manager's ``Model``'s table - it must have the
+        same columns. See ``swap_table``.
+        """
+        opts = self.model._meta
+        parent_field = opts.get_field(self.parent_attr)
+        pk_field = opts.pk
+        roots = []
+        children = {}
+        pks = {}
+        for row in rows:
+            pks[pk_field.to_python(_row_value(row, pk_field))] = True
+            parent_pk = _row_value(row, parent_field)
+            if parent_pk in (None, ''):
+                roots.append(row)
+            else:
+                parent_pk = parent_field.rel.get_related_field().to_python(
+                    parent_pk)
+                children.setdefault(parent_pk, []).append(row)
+
+        orphaned = [pk for pk in children.keys() if pk not in pks]
+        if orphaned:
+            orphaned.sort()
+            raise ValueError(_('Rows have parents which are not being imported: %s') %
+                             ', '.join([unicode(pk) for pk in orphaned]))
+
+        def get_children(row):
+            return children.get(pk_field.to_python(_row_value(row, pk_field)),
+                                ())
+        self._import_trees(roots, get_children, batch_size, db_table,
+                           self._db_for_write(using=using))
+
+    def import_nested(self, items, batch_size=500, db_table=None,
+                      using=None):
+        """
+        Imports trees from a nested list of ``dict`` items, or from a
+        file containing the same as JSON. Each item contains a primary
+        key and values for any other fields, keyed by field name or
+        column attribute name, with its children in a ``children`` list.
+        This is the format written by ``mptt.utils.write_json_tree``.
+
+        Tree fields and parents are calculated for every item and items
+        are inserted in batches of ``batch_size`` without being saved
+        individually. A file is read into memory in full before any items
+        are inserted.
+
+        If ``db_table`` is given, items will be inserted into that table
+        instead of this manager's ``Model``'s table - it must have the
+        same columns. See ``swap_table``.
+        """
+        if hasattr(items, 'read'):
+            items = simplejson.load(items)
+        self._import_trees(items, lambda item: item.get('children', ()),
+                           batch_size, db_table, self._db_for_write(using=using))
+
+    def insert_children(self, parent, nodes, position='last-child',
+                        batch_size=500, using=None):
+        """
+        Inserts a list of new ``nodes`` as children of ``parent``, in
+        order, as its first or last children as specified by
+        ``position``. Any item in ``nodes`` may instead be a
+        ``(node, children)`` tuple, where ``children`` is a list of the
+        same, to insert a subtree.
+
+        Space is made for every node at once, tree fields are set on each
+        node and nodes are inserted in batches of ``batch_size``, a level
+        at a time, without being saved individually. Primary keys are
+        then set on nodes whose primary key is assigned by the database,
+        and ``parent``'s right edge indicator is updated.
+        """
+        self._flush_for([parent], self._db_for_write(parent, using))
+        if position == 'last-child':
+            space_target = getattr(parent, self.right_attr) - 1
+        elif position == 'first-child':
+            space_target = getattr(parent, self.left_attr)
+        else:
+            raise ValueError(_('An invalid position was given: %s.') % position)
+
+        def get_children(item):
+            children = []
+            for child in item[1]:
+                if not isinstance(child, tuple):
+                    child = (child, ())
+                children.append(child)
+            return children
+        numbered = self._number_tree((None, nodes), get_children)[1:]
+        if not numbered:
+            return
+
+        using = self._db_for_write(parent, using)
+        opts = self.model._meta
+        auto_pk = isinstance(opts.pk, models.AutoField)
+        tree_id = getattr(parent, self.tree_id_attr)
+        scope = self._get_scope(parent)
+        if auto_pk:
+            # Check every node before the tree is changed
+            for item in numbered:
+                if item[0][0].pk is not None:
+                    raise ValueError(_('Cannot insert a node which has already been saved.'))
+        width = 2 * len(numbered)
+        self._create_space(width, space_target, tree_id, using, scope)
+
+        # Set the tree fields of every node, grouping nodes by level
+        levels = {}
+        for item, parent_item, left, right, level in numbered:
+            node = item[0]
+            setattr(node, self.left_attr, space_target + left - 1)
+            setattr(node, self.right_attr, space_target + right - 1)
+            setattr(node, self.level_attr,
+                    getattr(parent, self.level_attr) + level)
+            setattr(node, self.tree_id_attr, tree_id)
+            self._set_scope(node, scope)
+            levels.setdefault(level, []).append((node, parent_item[0]))
+        setattr(parent, self.right_attr,
+                getattr(parent, self.right_attr) + width)
+
+        # Insert a level at a time, so the primary keys of parents are
+        # known when their children are inserted.
+        fields = [f for f in opts.local_fields
+                  if not (auto_pk and f is opts.pk)]
+        level_numbers = levels.keys()
+        level_numbers.sort()
+        for level in level_numbers:
+            level_nodes = [node for node, node_parent in levels[level]]
+            rows = []
+            for node, node_parent in levels[level]:
+                if node_parent is None:
+                    node_parent = parent
+                setattr(node, self.parent_attr, node_parent)
+                rows.append([get_db_prep_save(f, f.pre_save(node, True), using)
+                             for f in fields])
+                if len(rows) >= batch_size:
+                    self._insert_rows(opts.db_table, fields, rows, using)
+                    rows = []
+            if rows:
+                self._insert_rows(opts.db_table, fields, rows, using)
+            if auto_pk:
+                filters = self._scope_filters(scope)
+                filters.update({
+                    self.tree_id_attr: tree_id,
+                    '%s__range' % self.left_attr: (space_target + 1,
+                                                   space_target + width),
+                    self.level_attr: getattr(level_nodes[0], self.level_attr),
+                })
+                pks = dict(query_set_using(self.model._base_manager.filter(
+                    **filters), using).values_list(self.left_attr, 'pk'))
+                for node in level_nodes:
+                    setattr(node, opts.pk.attname,
+                            pks[getattr(node, self.left_attr)])
+            for node in level_nodes:
+                if hasattr(node, '_state'):
+                    # Django >= 1.2
+                    node._state.db = using
+        commit_unless_managed(using)
 
     def insert_node(self, node, target, position='last-child',
-                    commit=False):
+                    commit=False, using=None):
         """
         Sets up the tree state for ``node`` (which has not yet been
         inserted into in the database) so it will be positioned relative
@@ -116,26 +1450,51 @@ class TreeManager(models.Manager):
 
         If ``commit`` is ``True``, ``node``'s ``save()`` method will be
         called before it is returned.
+
+        Space is made in the database with the alias ``using``, which
+        defaults to the database the routers choose for writing
+        ``node``. If trees are sharded, space is made in the database
+        the tree ``node`` is being inserted into is kept in, and a node
+        positioned next to a root node becomes the last root node, as
+        sharded trees can't be reordered.
+
+        If trees are scoped, ``node`` is given the scope of the tree it
+        is being inserted into, unless it is to be the last root node.
         """
-        if node.pk:
+        if node.pk and getattr(node, self.tree_id_attr) is not None:
             raise ValueError(_('Cannot insert a node which has already been saved.'))
 
-        if target is None:
+        if self.tree_router is None:
+            using = self._db_for_write(node, using)
+        self._flush_for([target], using)
+        if target is None or (self.tree_router is not None and
+                              target.is_root_node() and
+                              position in ['left', 'right']):
+            if target is not None:
+                self._set_scope(node, self._get_scope(target))
+            tree_id = self._get_next_tree_id(using=using,
+                                             scope=self._get_scope(node))
+            using = self._db_for_tree(tree_id, using)
             setattr(node, self.left_attr, 1)
             setattr(node, self.right_attr, 2)
             setattr(node, self.level_attr, 0)
-            setattr(node, self.tree_id_attr, self._get_next_tree_id())
+            setattr(node, self.tree_id_attr, tree_id)
             setattr(node, self.parent_attr, None)
         elif target.is_root_node() and position in ['left', 'right']:
-            target_tree_id = getattr(target, self.tree_id_attr)
-            if position == 'left':
-                tree_id = target_tree_id
-                space_target = target_tree_id - 1
+            self._set_scope(node, self._get_scope(target))
+            if self.tree_id_gap:
+                tree_id = self._get_root_sibling_tree_id(node, target,
+                                                         position, using)
             else:
-                tree_id = target_tree_id + 1
-                space_target = target_tree_id
-
-            self._create_tree_space(space_target)
+                target_tree_id = getattr(target, self.tree_id_attr)
+                if position == 'left':
+                    tree_id = target_tree_id
+                    space_target = target_tree_id - 1
+                else:
+                    tree_id = target_tree_id + 1
+                    space_target = target_tree_id
+                self._create_tree_space(space_target, using,
+                                        self._get_scope(target))
 
             setattr(node, self.left_attr, 1)
             setattr(node, self.right_attr, 2)
@@ -149,8 +1508,11 @@ class TreeManager(models.Manager):
             space_target, level, left, parent = \
                 self._calculate_inter_tree_move_values(node, target, position)
             tree_id = getattr(parent, self.tree_id_attr)
+            using = self._db_for_tree(tree_id, using)
+            self._set_scope(node, self._get_scope(parent))
 
-            self._create_space(2, space_target, tree_id)
+            self._create_space(2, space_target, tree_id, using,
+                               self._get_scope(parent))
 
             setattr(node, self.left_attr, -left)
             setattr(node, self.right_attr, -left + 1)
@@ -159,10 +1521,19 @@ class TreeManager(models.Manager):
             setattr(node, self.parent_attr, parent)
 
         if commit:
-            node.save()
+            if using is None:
+                node.save()
+            else:
+                node.save(using=using)
         return node
 
-    def move_node(self, node, target, position='last-child'):
+    def leaf_nodes(self):
+        """
+        Creates a ``QuerySet`` containing leaf nodes, in tree order.
+        """
+        return self.get_query_set().leaf_nodes()
+
+    def move_node(self, node, target, position='last-child', using=None):
         """
         Moves ``node`` relative to a given ``target`` node as specified
         by ``position`` (when appropriate), by examining both nodes and
@@ -180,27 +1551,498 @@ class TreeManager(models.Manager):
         This method explicitly checks for ``node`` being made a sibling
         of a root node, as this is a special case due to our use of tree
         ids to order root nodes.
+
+        The move is made in the database with the alias ``using``, which
+        defaults to the database the routers choose for writing
+        ``node``. If trees are sharded, nodes moved to a tree in another
+        database are copied to it and deleted from their old tree, and
+        a node made a sibling of a root node becomes the last root node,
+        as sharded trees can't be reordered.
+
+        If trees are scoped, nodes can't be moved to a tree in another
+        scope.
         """
+        if (target is not None and
+            self._get_scope(node) != self._get_scope(target)):
+            raise InvalidMove(_('A node may not be moved to a tree in another scope.'))
+        using = self._db_for_write(node, using)
+        self._flush_for([node, target], using)
         if target is None:
             if node.is_child_node():
-                self._make_child_root_node(node)
+                self._make_child_root_node(node, using=using)
         elif target.is_root_node() and position in ['left', 'right']:
-            self._make_sibling_of_root_node(node, target, position)
+            if self.tree_router is not None:
+                if node.is_child_node():
+                    self._make_child_root_node(node, using=using)
+            else:
+                self._make_sibling_of_root_node(node, target, position,
+                                                using)
         else:
             if node.is_root_node():
-                self._move_root_node(node, target, position)
+                self._move_root_node(node, target, position, using)
             else:
-                self._move_child_node(node, target, position)
-        transaction.commit_unless_managed()
+                self._move_child_node(node, target, position, using)
+        commit_unless_managed(using)
 
-    def root_node(self, tree_id):
+    def move_nodes(self, moves, using=None):
         """
-        Returns the root node of the tree with the given id.
+        Moves a batch of nodes, given a list of ``(node, target,
+        position)`` tuples which are applied in order as ``move_node``
+        would apply them. Root nodes can't be moved and nodes can't be
+        made root nodes.
+
+        Every move is validated and the final layout of each affected
+        tree is calculated in memory before anything is written, then
+        only nodes whose tree fields or parent have changed are updated.
+        The given nodes and targets are modified to reflect their new
+        tree state.
         """
-        return self.get(**{
-            self.tree_id_attr: tree_id,
-            '%s__isnull' % self.parent_attr: True,
-        })
+        moves = list(moves)
+        if not moves:
+            return
+        using = self._db_for_write(moves[0][0], using)
+        self._flush_for([node for move in moves for node in move[:2]], using)
+        trees = []
+        for node, target, position in moves:
+            if (target is None or node.is_root_node() or
+                (target.is_root_node() and position in ['left', 'right'])):
+                raise InvalidMove(_('Root nodes may only be created or moved with move_node().'))
+            if self._get_scope(node) != self._get_scope(target):
+                raise InvalidMove(_('A node may not be moved to a tree in another scope.'))
+            for tree in [(self._get_scope(n), getattr(n, self.tree_id_attr))
+                         for n in (node, target)]:
+                if tree not in trees:
+                    trees.append(tree)
+
+        # Every moved node stays within the trees it and its target are
+        # in, so only those trees are read.
+        rows = {}
+        parents = {}
+        children = {}
+        roots = []
+        for scope, tree_id in trees:
+            if self._db_for_tree(tree_id, using) != using:
+                raise InvalidMove(_('A node may not be moved to a tree in another database.'))
+            filters = self._scope_filters(scope)
+            filters[self.tree_id_attr] = tree_id
+            for row in query_set_using(self.model._base_manager.filter(
+                    **filters), using).order_by(self.left_attr).values_list(
+                        'pk', self.parent_attr, self.tree_id_attr,
+                        self.left_attr, self.right_attr, self.level_attr):
+                rows[row[0]] = row
+                parents[row[0]] = row[1]
+                if row[1] is None:
+                    roots.append(row[0])
+                else:
+                    children.setdefault(row[1], []).append(row[0])
+
+        for node, target, position in moves:
+            if position in ['first-child', 'last-child']:
+                new_parent = target.pk
+            elif position in ['left', 'right']:
+                new_parent = parents[target.pk]
+            else:
+                raise ValueError(_('An invalid position was given: %s.') % position)
+            ancestor = target.pk
+            while ancestor is not None:
+                if ancestor == node.pk:
+                    if position in ['left', 'right']:
+                        if target.pk == node.pk:
+                            raise InvalidMove(_('A node may not be made a sibling of itself.'))
+                        raise InvalidMove(_('A node may not be made a sibling of any of its descendants.'))
+                    if target.pk == node.pk:
+                        raise InvalidMove(_('A node may not be made a child of itself.'))
+                    raise InvalidMove(_('A node may not be made a child of any of its descendants.'))
+                ancestor = parents[ancestor]
+            children[parents[node.pk]].remove(node.pk)
+            siblings = children.setdefault(new_parent, [])
+            if position == 'first-child':
+                siblings.insert(0, node.pk)
+            elif position == 'last-child':
+                siblings.append(node.pk)
+            elif position == 'left':
+                siblings.insert(siblings.index(target.pk), node.pk)
+            else:
+                siblings.insert(siblings.index(target.pk) + 1, node.pk)
+            parents[node.pk] = new_parent
+
+        updates = []
+        parent_updates = []
+        values = {}
+        for root in roots:
+            tree_id = rows[root][2]
+            for pk, parent, left, right, level in self._number_tree(root,
+                    lambda pk: children.get(pk, ())):
+                values[pk] = (tree_id, left, right, level)
+                if rows[pk][2:] != values[pk]:
+                    updates.append(values[pk] + (pk,))
+                if rows[pk][1] != parents[pk]:
+                    parent_updates.append((parents[pk], pk))
+        self._update_tree_fields(updates, using)
+        if parent_updates:
+            connection = get_connection(using)
+            qn = connection.ops.quote_name
+            opts = self.model._meta
+            cursor = connection.cursor()
+            cursor.executemany('UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+                qn(opts.db_table), qn(opts.get_field(self.parent_attr).column),
+                qn(opts.pk.column)), parent_updates)
+        commit_unless_managed(using)
+
+        parent_field = self.model._meta.get_field(self.parent_attr)
+        for node, target, position in moves:
+            for instance in (node, target):
+                for attr, value in zip((self.tree_id_attr, self.left_attr,
+                                        self.right_attr, self.level_attr),
+                                       values[instance.pk]):
+                    setattr(instance, attr, value)
+                setattr(instance, parent_field.attname, parents[instance.pk])
+                if hasattr(instance, parent_field.get_cache_name()):
+                    delattr(instance, parent_field.get_cache_name())
+
+    def nodes(self, fields=(), queryset=None, using=None):
+        """
+        Creates an iterator over lightweight, read-only representations
+        of the nodes in ``queryset`` (defaulting to all nodes), in tree
+        order, without creating any model instances.
+
+        Each node will have attributes for its primary key (``pk``), its
+        parent's primary key, its tree fields and the given ``fields``.
+        """
+        if queryset is None:
+            queryset = query_set_using(self.get_query_set(), using)
+        cls = node_class(self.model, fields)
+        return itertools.starmap(cls, queryset.values_list(
+            *(('pk', self.parent_attr) + cls.__slots__[2:])).iterator())
+
+    def swap_table(self, db_table, old_db_table, using=None):
+        """
+        Replaces this manager's ``Model``'s table with ``db_table``,
+        which has usually been populated using ``import_adjacency`` or
+        ``import_nested``, by renaming the current table to
+        ``old_db_table`` and ``db_table`` to the current table's name.
+
+        If trees are sharded, tables are swapped in every database.
+        """
+        rename_query = 'ALTER TABLE %s RENAME TO %s'
+        live_db_table = self.model._meta.db_table
+        for alias in self._get_databases(self._db_for_write(using=using)):
+            connection = get_connection(alias)
+            qn = connection.ops.quote_name
+            cursor = connection.cursor()
+            cursor.execute(rename_query % (qn(live_db_table), qn(old_db_table)))
+            cursor.execute(rename_query % (qn(db_table), qn(live_db_table)))
+            commit_unless_managed(alias)
+
+    def propagate(self, node, field, value, include_self=True, using=None):
+        """
+        Sets ``field`` to ``value`` for all of ``node``'s descendants,
+        and for ``node`` itself if ``include_self`` is ``True``, with a
+        single query on their range of edge indicators.
+
+        Rows are updated directly, so ``save()`` isn't called and no
+        signals are sent for the updated nodes. Tree fields can't be
+        changed this way.
+
+        Returns the number of nodes which were updated.
+        """
+        opts = self.model._meta
+        tree_fields = [self.parent_attr, self.left_attr, self.right_attr,
+                       self.tree_id_attr, self.level_attr,
+                       self.tree_scope_attr]
+        if opts.get_field(field).name in tree_fields:
+            raise ValueError(_('Tree fields cannot be propagated.'))
+
+        using = self._db_for_write(node, using)
+        self._flush_for([node], using)
+        if include_self:
+            setattr(node, field, value)
+        elif tree_models._is_leaf_node(node):
+            return 0
+        filters = self._scope_filters(self._get_scope(node))
+        filters[self.tree_id_attr] = getattr(node, self.tree_id_attr)
+        if include_self:
+            filters['%s__range' % self.left_attr] = (
+                getattr(node, self.left_attr), getattr(node, self.right_attr))
+        else:
+            filters['%s__gt' % self.left_attr] = getattr(node, self.left_attr)
+            filters['%s__lt' % self.left_attr] = getattr(node,
+                                                         self.right_attr)
+        return query_set_using(self.model._base_manager.filter(**filters),
+                               using).update(**{field: value})
+
+    def rebuild_tree(self, tree_id, using=None, scope=None):
+        """
+        Recalculates the tree fields of every node in the tree with the
+        given id from the parent field of each node, reading the tree a
+        level at a time with a query for each level.
+
+        Siblings keep their existing order, as far as it can be
+        determined from their left edge indicators. If the tree has
+        more than one root node, every root node but the first will be
+        given a new tree id.
+
+        Only nodes whose tree fields have changed are updated.
+
+        If trees are scoped, the ``scope`` of the tree must be given.
+        """
+        using = self._db_for_tree(tree_id, self._db_for_write(using=using))
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        query = """
+        SELECT %(pk)s, %(parent)s, %(tree_id)s, %(left)s, %(right)s, %(level)s
+        FROM %(table)s
+        WHERE %(where)s
+        ORDER BY %(left)s, %(pk)s"""
+        columns = {
+            'pk': qn(opts.pk.column),
+            'parent': qn(opts.get_field(self.parent_attr).column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'table': qn(opts.db_table),
+        }
+
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        cursor = connection.cursor()
+        cursor.execute(query % dict(columns, where='%(tree_id)s = %%s AND '
+                                    '%(parent)s IS NULL' % columns + scope_sql),
+                       [tree_id] + scope_params)
+        roots = cursor.fetchall()
+
+        # Retrieve descendants a level at a time by following parent
+        # fields, so nodes which have the wrong tree id are found.
+        children = {}
+        parent_pks = [row[0] for row in roots]
+        while parent_pks:
+            cursor.execute(query % dict(columns, where='%s IN (%s)' % (
+                columns['parent'], ', '.join(['%s'] * len(parent_pks)))),
+                parent_pks)
+            parent_pks = []
+            for row in cursor.fetchall():
+                children.setdefault(row[1], []).append(row)
+                parent_pks.append(row[0])
+
+        def get_children(row):
+            return children.get(row[0], ())
+
+        updates = []
+        for i, root in enumerate(roots):
+            if i > 0:
+                tree_id = self._get_next_tree_id(using=using, scope=scope)
+            for row, parent, left, right, level in self._number_tree(
+                    root, get_children):
+                if row[2:] != (tree_id, left, right, level):
+                    updates.append((tree_id, left, right, level, row[0]))
+            if i > 0:
+                self._update_tree_fields(updates, using)
+                updates = []
+                if self._db_for_tree(tree_id, using) != using:
+                    # The new tree belongs in another database
+                    self._move_subtree_to_database(query_set_using(
+                        self.model._base_manager.all(), using).get(
+                            pk=root[0]), 0, 0, tree_id, None, using)
+        self._update_tree_fields(updates, using)
+        commit_unless_managed(using)
+
+    def reorder_children(self, parent, ordered_pks, using=None):
+        """
+        Reorders the children of ``parent`` to follow the order of the
+        given list of their primary keys, with a single query which only
+        updates nodes within ``parent``.
+
+        The new edge indicators of each child's subtree are calculated
+        from the children's current edge indicators, so ``parent`` and
+        any node instances which were loaded before the reordering will
+        not reflect their new positions.
+        """
+        using = self._db_for_write(parent, using)
+        self._flush_for([parent], using)
+        opts = self.model._meta
+        children = list(query_set_using(self.model._base_manager.filter(**{
+                self.parent_attr: parent,
+            }), using).order_by(self.left_attr).values_list(
+                'pk', self.left_attr, self.right_attr))
+        ordered_pks = [opts.pk.to_python(pk) for pk in ordered_pks]
+        bounds = dict([(pk, (left, right)) for pk, left, right in children])
+        if (len(ordered_pks) != len(bounds) or
+            set(ordered_pks) != set(bounds.keys())):
+            raise ValueError(_('The primary keys of every child node must be given in order.'))
+
+        # Each moved subtree's edge indicators and the amount they change by
+        changes = []
+        if children:
+            target = children[0][1]
+        for pk in ordered_pks:
+            left, right = bounds[pk]
+            if target != left:
+                changes.append((left, right, target - left))
+            target += right - left + 1
+        if not changes:
+            return
+
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        scope_sql, scope_params = self._scope_sql(qn, self._get_scope(parent))
+        columns = {
+            'table': qn(opts.db_table),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'scope': scope_sql,
+        }
+        # Children which keep their place can lie within the updated
+        # range, so their edge indicators change by nothing.
+        case = 'CASE %s ELSE 0 END' % ' '.join([
+            'WHEN %(left)s >= %%s AND %(left)s <= %%s THEN %%s' % columns
+            for change in changes])
+        case_params = []
+        for change in changes:
+            case_params.extend(change)
+        # The right edge indicator is updated first, as MySQL uses values
+        # which have already been updated in later assignments.
+        reorder_query = """
+        UPDATE %(table)s
+        SET %(right)s = %(right)s + %(case)s,
+            %(left)s = %(left)s + %(case)s
+        WHERE %(tree_id)s = %%s
+          AND %(left)s >= %%s AND %(left)s <= %%s%(scope)s""" % dict(columns,
+            case=case)
+        cursor = connection.cursor()
+        cursor.execute(reorder_query, case_params + case_params + [
+            getattr(parent, self.tree_id_attr),
+            min([change[0] for change in changes]),
+            max([change[1] for change in changes]),
+        ] + scope_params)
+        commit_unless_managed(using)
+
+    def resolve_inherited(self, nodes, field, using=None):
+        """
+        Resolves the value of ``field`` which each of the given ``nodes``
+        inherits - its own value, unless that is ``None``, in which case
+        the value of its nearest ancestor for which it isn't.
+
+        The ancestors of all the nodes are retrieved with a single query
+        for each database trees are kept in, then every node's value is
+        resolved in a single pass over them in tree order.
+
+        Returns a dict mapping each node's primary key to its inherited
+        value, which is ``None`` if neither the node nor any of its
+        ancestors has one.
+        """
+        positions = {}
+        for node in nodes:
+            positions[node.pk] = (getattr(node, self.tree_id_attr),
+                                  getattr(node, self.left_attr),
+                                  getattr(node, self.right_attr),
+                                  self._get_scope(node))
+        if not positions:
+            return {}
+
+        if self.defer_insertion:
+            # Deferred nodes have no ancestor range until they have been
+            # positioned, which may also move their ancestors' edges
+            trees = {}
+            for tree_id, left, right, scope in positions.values():
+                if not left:
+                    trees[(tree_id, scope)] = True
+            write_using = self._db_for_write(using=using)
+            for tree_id, scope in trees.keys():
+                tree_using = self._db_for_tree(tree_id, write_using)
+                self._flush_tree(tree_id, tree_using, scope)
+                pks = [pk for pk, position in positions.items()
+                       if (position[0], position[3]) == (tree_id, scope)]
+                for pk, left, right in query_set_using(
+                    self.model._base_manager.filter(pk__in=pks),
+                    tree_using).values_list('pk', self.left_attr,
+                                            self.right_attr):
+                    positions[pk] = (tree_id, left, right, scope)
+
+        using = self._db_for_read(using=using)
+        databases = {}
+        for tree_id, left, right, scope in positions.values():
+            filters = self._scope_filters(scope)
+            filters.update({
+                self.tree_id_attr: tree_id,
+                '%s__lte' % self.left_attr: left,
+                '%s__gte' % self.right_attr: right,
+            })
+            databases.setdefault(self._db_for_tree(tree_id, using),
+                                 []).append(models.Q(**filters))
+        fields = ['pk', self.tree_id_attr, self.left_attr, self.right_attr,
+                  field]
+        if self.tree_scope_attr is not None:
+            fields.append(self.tree_scope_attr)
+
+        values = {}
+        for alias, filters in databases.items():
+            rows = query_set_using(self.model._base_manager.filter(
+                reduce(operator.or_, filters)), alias).order_by(
+                *self._tree_ordering()).values_list(*fields)
+            tree = None
+            # Each item holds the right edge indicator and inherited
+            # value of an ancestor of the rows which follow it
+            stack = []
+            for row in rows:
+                pk, tree_id, left, right, value = row[:5]
+                if (tree_id, row[5:]) != tree:
+                    tree = (tree_id, row[5:])
+                    stack = []
+                while stack and stack[-1][0] < left:
+                    stack.pop()
+                if value is None and stack:
+                    value = stack[-1][1]
+                stack.append((right, value))
+                values[pk] = value
+        return dict([(pk, values.get(pk)) for pk in positions.keys()])
+
+    def resort(self, parent=None, tree_id=None, using=None, scope=None):
+        """
+        Re-sorts siblings at every level below ``parent``, or below the
+        root node of the tree with the given id, or below every root
+        node, according to the model's ``order_insertion_by`` fields.
+        Root nodes are not reordered.
+
+        Each subtree is read with a single query and renumbered in one
+        pass, and only nodes whose tree fields have changed are updated.
+
+        If trees are scoped, the ``scope`` of the tree must be given
+        along with ``tree_id``.
+        """
+        opts = self.model._meta
+        if not opts.order_insertion_by:
+            raise ValueError(_('Only models registered with order_insertion_by can be re-sorted.'))
+        if parent is not None:
+            nodes = [(parent, self._db_for_write(parent, using))]
+        elif tree_id is not None:
+            using = self._db_for_tree(tree_id, self._db_for_write(using=using))
+            nodes = [(query_set_using(self.model._base_manager.all(),
+                                      using).get(**self._root_filters(tree_id,
+                                                                      scope)),
+                      using)]
+        else:
+            nodes = []
+            for alias in self._get_databases(self._db_for_write(using=using)):
+                nodes.extend([(root, alias) for root in query_set_using(
+                    self.model._base_manager.filter(**{
+                        '%s__isnull' % self.parent_attr: True,
+                    }), alias)])
+        aliases = []
+        for node, alias in nodes:
+            self._resort_subtree(node, alias)
+            if alias not in aliases:
+                aliases.append(alias)
+        for alias in aliases:
+            commit_unless_managed(alias)
+
+    def root_node(self, tree_id, scope=None):
+        """
+        Returns the root node of the tree with the given id, in the
+        given ``scope`` if trees are scoped.
+        """
+        return self.get(**self._root_filters(tree_id, scope))
 
     def root_nodes(self):
         """
@@ -208,6 +2050,70 @@ class TreeManager(models.Manager):
         """
         return self.filter(**{'%s__isnull' % self.parent_attr: True})
 
+    def verify_trees(self, using=None):
+        """
+        Checks that every tree is valid using a handful of queries which
+        examine all trees at once, returning a sorted list of the ids of
+        invalid trees.
+
+        This is useful after tree fields have been loaded directly, as
+        they are by the ``loaddata`` management command.
+
+        If trees are sharded, trees are checked in every database. If
+        trees are scoped, ``(scope, tree_id)`` tuples are returned
+        instead of tree ids.
+        """
+        opts = self.model._meta
+        tree_ids = set()
+        for alias in self._get_databases(self._db_for_read(using=using)):
+            connection = get_connection(alias)
+            qn = connection.ops.quote_name
+            tree_columns = [qn(opts.get_field(self.tree_id_attr).column)]
+            tree_aliases = ['tree_id']
+            if self.tree_scope_attr is not None:
+                tree_columns.insert(0, qn(opts.get_field(
+                    self.tree_scope_attr).column))
+                tree_aliases.insert(0, 'tree_scope')
+            def tree(prefix):
+                return ', '.join([prefix + column for column in tree_columns])
+            columns = {
+                'tree': tree(''),
+                'a_tree': tree('a.'),
+                'c_tree': tree('c.'),
+                'p_tree': tree('p.'),
+                'edges_tree': ', '.join(['edges.%s' % tree_alias
+                                         for tree_alias in tree_aliases]),
+                'tree_as': ', '.join(['%s AS %s' % column for column in
+                                      zip(tree_columns, tree_aliases)]),
+                'same_tree': ' AND '.join(['b.%s = a.%s' % (column, column)
+                                           for column in tree_columns]),
+                'different_tree': '(%s)' % ' OR '.join([
+                    'c.%s <> p.%s' % (column, column)
+                    for column in tree_columns]),
+                'pk': qn(opts.pk.column),
+                'parent': qn(opts.get_field(self.parent_attr).column),
+                'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+                'left': qn(opts.get_field(self.left_attr).column),
+                'right': qn(opts.get_field(self.right_attr).column),
+                'level': qn(opts.get_field(self.level_attr).column),
+                'table': qn(opts.db_table),
+                'mod': '%%',
+                'max_edge': self.lazy_delete and '<' or '<>',
+            }
+            if self.defer_insertion:
+                columns['table'] = '(SELECT * FROM %s WHERE %s > 0)' % (
+                    columns['table'], columns['left'])
+            cursor = connection.cursor()
+            for query in INVALID_TREE_QUERIES:
+                cursor.execute(query % columns, [])
+                if self.tree_scope_attr is None:
+                    tree_ids.update([row[0] for row in cursor.fetchall()])
+                else:
+                    tree_ids.update([tuple(row) for row in cursor.fetchall()])
+        tree_ids = list(tree_ids)
+        tree_ids.sort()
+        return tree_ids
+
     def _calculate_inter_tree_move_values(self, node, target, position):
         """
         Calculates values required when moving ``node`` relative to
@@ -215,74 +2121,634 @@ class TreeManager(models.Manager):
         """
         left = getattr(node, self.left_attr)
         level = getattr(node, self.level_attr)
+        target_level = getattr(target, self.level_attr)
+
+        space_target = self._get_space_target(target, position)
+        if position == 'last-child' or position == 'first-child':
+            level_change = level - target_level - 1
+            parent = target
+        else:
+            level_change = level - target_level
+            parent = getattr(target, self.parent_attr)
+
+        left_right_change = left - space_target - 1
+        return space_target, level_change, left_right_change, parent
+
+    def _calculate_within_tree_move_values(self, node, target, position):
+        """
+        Calculates the new edge indicators of child node ``node`` and
+        the values required when moving it within its current tree
+        relative to ``target`` as specified by ``position``.
+        """
+        left = getattr(node, self.left_attr)
+        right = getattr(node, self.right_attr)
+        level = getattr(node, self.level_attr)
+        width = right - left + 1
         target_left = getattr(target, self.left_attr)
         target_right = getattr(target, self.right_attr)
         target_level = getattr(target, self.level_attr)
 
         if position == 'last-child' or position == 'first-child':
+            if node == target:
+                raise InvalidMove(_('A node may not be made a child of itself.'))
+            elif left < target_left < right:
+                raise InvalidMove(_('A node may not be made a child of any of its descendants.'))
             if position == 'last-child':
-                space_target = target_right - 1
+                if target_right > right:
+                    new_left = target_right - width
+                    new_right = target_right - 1
+                else:
+                    new_left = target_right
+                    new_right = target_right + width - 1
             else:
-                space_target = target_left
+                if target_left > left:
+                    new_left = target_left - width + 1
+                    new_right = target_left
+                else:
+                    new_left = target_left + 1
+                    new_right = target_left + width
             level_change = level - target_level - 1
             parent = target
         elif position == 'left' or position == 'right':
+            if node == target:
+                raise InvalidMove(_('A node may not be made a sibling of itself.'))
+            elif left < target_left < right:
+                raise InvalidMove(_('A node may not be made a sibling of any of its descendants.'))
             if position == 'left':
-                space_target = target_left - 1
+                if target_left > left:
+                    new_left = target_left - width
+                    new_right = target_left - 1
+                else:
+                    new_left = target_left
+                    new_right = target_left + width - 1
             else:
-                space_target = target_right
+                if target_right > right:
+                    new_left = target_right - width + 1
+                    new_right = target_right
+                else:
+                    new_left = target_right + 1
+                    new_right = target_right + width
             level_change = level - target_level
             parent = getattr(target, self.parent_attr)
         else:
             raise ValueError(_('An invalid position was given: %s.') % position)
+        return new_left, new_right, level_change, parent
 
-        left_right_change = left - space_target - 1
-        return space_target, level_change, left_right_change, parent
+    def _check_tree(self, tree, chunk_size=1000, using=None):
+        """
+        Checks the structure of the given tree - its tree id, or a
+        ``(scope, tree_id)`` tuple if trees are scoped - returning a list
+        of error messages.
+        """
+        tree_id, scope = self._split_tree(tree)
+        return check_tree_rows(self._iterate_tree_rows(tree_id, chunk_size,
+                                                       using, scope),
+                               self.lazy_delete)
 
-    def _close_gap(self, size, target, tree_id):
+    def _close_gap(self, size, target, tree_id, using=None, scope=None):
         """
         Closes a gap of a certain ``size`` after the given ``target``
         point in the tree identified by ``tree_id``.
         """
-        self._manage_space(-size, target, tree_id)
+        self._manage_space(-size, target, tree_id, using, scope)
 
-    def _create_space(self, size, target, tree_id):
+    def _close_gaps(self, ranges, tree_id, using=None, scope=None):
+        """
+        Closes the gaps left by deleting the subtrees which occupied the
+        given list of ``(left, right)`` edge indicator ``ranges``, in
+        ascending order, in the tree identified by ``tree_id``.
+
+        Every edge indicator is shifted down by the total width of the
+        gaps before it with a single query, unless edge indicators are
+        shifted in chunks, in which case the gaps are closed one at a
+        time, last first.
+        """
+        if self.update_chunk_size:
+            ranges = ranges[:]
+            ranges.reverse()
+            for left, right in ranges:
+                self._close_gap(right - left + 1, right, tree_id, using,
+                                scope)
+            return
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        shifts = []
+        width = 0
+        for left, right in ranges:
+            width += right - left + 1
+            shifts.append((right, width))
+        shifts.reverse()
+        cases = ' '.join(['WHEN %(edge)s > %%s THEN %(edge)s - %%s'] *
+                         len(shifts))
+        case_params = []
+        for right, width in shifts:
+            case_params.extend([right, width])
+        left = qn(opts.get_field(self.left_attr).column)
+        right = qn(opts.get_field(self.right_attr).column)
+        gap_query = """
+        UPDATE %(table)s
+        SET %(left)s = CASE %(left_cases)s ELSE %(left)s END,
+            %(right)s = CASE %(right_cases)s ELSE %(right)s END
+        WHERE %(tree_id)s = %%s
+          AND %(right)s > %%s%(scope)s""" % {
+            'table': qn(opts.db_table),
+            'left': left,
+            'right': right,
+            'left_cases': cases % {'edge': left},
+            'right_cases': cases % {'edge': right},
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'scope': scope_sql,
+        }
+        cursor = connection.cursor()
+        cursor.execute(gap_query, case_params + case_params +
+                                  [tree_id, ranges[0][1]] + scope_params)
+
+    def _count_chunks(self, size):
+        """
+        Determines how many chunks of ``update_chunk_size`` edge
+        indicators ``size`` edge indicators would be shifted in.
+        """
+        if size <= 0:
+            return 0
+        return (size + self.update_chunk_size - 1) // self.update_chunk_size
+
+    def _create_space(self, size, target, tree_id, using=None, scope=None):
         """
         Creates a space of a certain ``size`` after the given ``target``
         point in the tree identified by ``tree_id``.
         """
-        self._manage_space(size, target, tree_id)
+        self._manage_space(size, target, tree_id, using, scope)
 
-    def _create_tree_space(self, target_tree_id):
+    def _create_tree_space(self, target_tree_id, using=None, scope=None,
+                           size=1):
         """
         Creates space for a new tree by incrementing all tree ids
-        greater than ``target_tree_id``.
+        greater than ``target_tree_id`` by ``size``, in the given
+        ``scope`` if trees are scoped.
         """
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
         opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
         cursor = connection.cursor()
         cursor.execute("""
         UPDATE %(table)s
-        SET %(tree_id)s = %(tree_id)s + 1
-        WHERE %(tree_id)s > %%s""" % {
+        SET %(tree_id)s = %(tree_id)s + %%s
+        WHERE %(tree_id)s > %%s%(scope)s""" % {
             'table': qn(opts.db_table),
             'tree_id': qn(opts.get_field(self.tree_id_attr).column),
-        }, [target_tree_id])
+            'scope': scope_sql,
+        }, [size, target_tree_id] + scope_params)
+
+    def _db_for_node(self, node):
+        """
+        Determines which database holds the tree ``node`` is in when
+        trees are sharded. A new node will be inserted into its parent's
+        tree, or a new tree if it has no parent.
+        """
+        tree_id = getattr(node, self.tree_id_attr)
+        if tree_id is None:
+            parent_field = self.model._meta.get_field(self.parent_attr)
+            parent = getattr(node, parent_field.get_cache_name(), None)
+            parent_pk = getattr(node, parent_field.attname)
+            if parent is not None:
+                tree_id = getattr(parent, self.tree_id_attr)
+            elif parent_pk is not None:
+                # The parent could be in any database
+                for alias in self._get_databases():
+                    tree_ids = list(query_set_using(
+                        self.model._base_manager.filter(pk=parent_pk),
+                        alias).values_list(self.tree_id_attr, flat=True))
+                    if tree_ids:
+                        tree_id = tree_ids[0]
+                        break
+            else:
+                tree_id = self._get_next_tree_id(scope=self._get_scope(node))
+        return self._db_for_tree(tree_id)
+
+    def _db_for_read(self, instance=None, using=None):
+        """
+        Determines which database should be read from - the one with
+        the alias ``using``, if given, then the database this manager
+        has been bound to with ``db_manager``, then the database the
+        routers choose for reading ``instance`` or this manager's
+        ``Model``. If trees are sharded, the database ``instance``'s
+        tree is kept in is always used.
+
+        Returns ``None`` if multiple databases aren't supported.
+        """
+        if router is None:
+            return None
+        if self.tree_router is not None and instance is not None:
+            return self._db_for_node(instance)
+        if using or getattr(self, '_db', None):
+            return using or self._db
+        if instance is None:
+            return router.db_for_read(self.model)
+        return router.db_for_read(self.model, instance=instance)
+
+    def _db_for_tree(self, tree_id, using=None):
+        """
+        Determines which database holds the tree with the given id - the
+        one the tree router maps it to if trees are sharded, otherwise
+        the one with the alias ``using``.
+        """
+        if self.tree_router is None or connections is None:
+            return using
+        return self.tree_router.db_for_tree(self.model, tree_id)
+
+    def _db_for_write(self, instance=None, using=None):
+        """
+        Determines which database should be written to - the one with
+        the alias ``using``, if given, then the database this manager
+        has been bound to with ``db_manager``, then the database the
+        routers choose for writing ``instance`` or this manager's
+        ``Model``. If trees are sharded, the database ``instance``'s
+        tree is kept in is always used.
+
+        Returns ``None`` if multiple databases aren't supported.
+        """
+        if router is None:
+            return None
+        if self.tree_router is not None and instance is not None:
+            return self._db_for_node(instance)
+        if using or getattr(self, '_db', None):
+            return using or self._db
+        if instance is None:
+            return router.db_for_write(self.model)
+        return router.db_for_write(self.model, instance=instance)
+
+    def _defer_node(self, node, parent):
+        """
+        Sets up the tree fields of ``node`` (which has not yet been
+        inserted into the database) so it will be saved in ``parent``'s
+        tree without being positioned in it, marking it as deferred
+        with edge indicators of ``0`` until ``flush_pending`` makes it
+        ``parent``'s last child.
+        """
+        self._set_scope(node, self._get_scope(parent))
+        setattr(node, self.left_attr, 0)
+        setattr(node, self.right_attr, 0)
+        setattr(node, self.level_attr, getattr(parent, self.level_attr) + 1)
+        setattr(node, self.tree_id_attr, getattr(parent, self.tree_id_attr))
+
+    def _flush_for(self, nodes, using=None):
+        """
+        Positions deferred nodes in the trees of ``nodes`` before they
+        are used in a tree operation, refreshing the tree fields of
+        ``nodes`` from the database if any deferred nodes were
+        positioned.
+        """
+        if not self.defer_insertion:
+            return
+        nodes = [node for node in nodes if node is not None and node.pk]
+        trees = {}
+        for node in nodes:
+            trees[(getattr(node, self.tree_id_attr),
+                   self._get_scope(node))] = True
+        flushed = 0
+        for tree_id, scope in trees.keys():
+            flushed += self._flush_tree(tree_id, using, scope)
+        if not flushed:
+            return
+        fields = (self.left_attr, self.right_attr, self.level_attr,
+                  self.tree_id_attr)
+        for node in nodes:
+            values = query_set_using(self.model._base_manager.filter(
+                pk=node.pk), using).values_list(*fields)[0]
+            for field, value in zip(fields, values):
+                setattr(node, field, value)
+
+    def _flush_tree(self, tree_id, using=None, scope=None):
+        """
+        Positions the deferred nodes in the tree with the given id as
+        the last children of their parents, in the order they were
+        saved.
+
+        Returns the number of nodes which were positioned.
+        """
+        using = self._db_for_tree(tree_id, self._db_for_write(using=using))
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        columns = {
+            'pk': qn(opts.pk.column),
+            'parent': qn(opts.get_field(self.parent_attr).column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'table': qn(opts.db_table),
+        }
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT %(pk)s, %(parent)s
+        FROM %(table)s
+        WHERE %(tree_id)s = %%s AND %(left)s = 0%(scope)s
+        ORDER BY %(pk)s""" % dict(columns, scope=scope_sql),
+            [tree_id] + scope_params)
+        pending = cursor.fetchall()
+        if not pending:
+            return 0
+
+        children = {}
+        pending_pks = {}
+        for row in pending:
+            children.setdefault(row[1], []).append(row)
+            pending_pks[row[0]] = True
+        anchor_pks = [pk for pk in children if pk not in pending_pks]
+        cursor.execute("""
+        SELECT %(pk)s, %(right)s, %(level)s
+        FROM %(table)s
+        WHERE %(tree_id)s = %%s AND %(pk)s IN (%(pks)s)
+        ORDER BY %(right)s""" % dict(columns,
+                                     pks=', '.join(['%s'] * len(anchor_pks))),
+            [tree_id] + anchor_pks)
+        anchors = cursor.fetchall()
+        if not anchors:
+            return 0
+
+        def get_children(row):
+            return children.get(row[0], ())
+
+        # Each anchor's deferred descendants are numbered from where its
+        # right edge indicator will be once space has been made for the
+        # deferred nodes of anchors to its left.
+        updates = []
+        shifts = []
+        shift = 0
+        for anchor in anchors:
+            anchor_pk, anchor_right, anchor_level = anchor
+            numbered = self._number_tree(anchor, get_children)[1:]
+            offset = anchor_right + shift - 2
+            for row, parent, left, right, level in numbered:
+                updates.append((tree_id, left + offset, right + offset,
+                                level + anchor_level, row[0]))
+            shift += 2 * len(numbered)
+            shifts.append((anchor_right, shift))
+
+        # Make space for every anchor's deferred nodes at once, shifting
+        # each edge indicator by the space made to its left
+        shifts.reverse()
+        cases = ' '.join(['WHEN %(edge)s >= %%s THEN %%s'] * len(shifts))
+        case_params = []
+        for edge, edge_shift in shifts:
+            case_params.extend([edge, edge_shift])
+        cursor.execute("""
+        UPDATE %(table)s
+        SET %(left)s = %(left)s + CASE %(left_cases)s ELSE 0 END,
+            %(right)s = %(right)s + CASE %(right_cases)s ELSE 0 END
+        WHERE %(tree_id)s = %%s AND %(right)s >= %%s%(scope)s""" % dict(
+            columns,
+            left_cases=cases % {'edge': columns['left']},
+            right_cases=cases % {'edge': columns['right']},
+            scope=scope_sql), case_params * 2 + [tree_id, shifts[-1][0]] +
+                              scope_params)
+        self._update_tree_fields(updates, using)
+        commit_unless_managed(using)
+        return len(updates)
+
+    def _get_databases(self, using=None):
+        """
+        Returns the aliases of every database which holds trees - those
+        the tree router maps tree ids to if trees are sharded, otherwise
+        just ``using``.
+        """
+        if self.tree_router is None or connections is None:
+            return [using]
+        return self.tree_router.databases
 
-    def _get_next_tree_id(self):
+    def _get_max_edge(self, tree_id, using=None, scope=None):
+        """
+        Determines the largest edge indicator in the tree identified by
+        ``tree_id``.
+        """
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        cursor = connection.cursor()
+        cursor.execute('SELECT MAX(%s) FROM %s WHERE %s = %%s%s' % (
+            qn(opts.get_field(self.right_attr).column), qn(opts.db_table),
+            qn(opts.get_field(self.tree_id_attr).column), scope_sql),
+            [tree_id] + scope_params)
+        return cursor.fetchone()[0] or 0
+
+    def _get_next_tree_id(self, db_table=None, using=None, scope=None):
         """
         Determines the next largest unused tree id for the tree managed
-        by this manager.
+        by this manager, or in ``db_table`` if given. If trees are
+        sharded, tree ids are unique across every database. If trees are
+        scoped, tree ids are only unique within the given ``scope``. If
+        tree ids are allocated with gaps, the next tree id follows a gap.
+        """
+        opts = self.model._meta
+        max_tree_id = 0
+        for alias in self._get_databases(using):
+            connection = get_connection(alias)
+            qn = connection.ops.quote_name
+            scope_sql, scope_params = self._scope_sql(qn, scope)
+            cursor = connection.cursor()
+            cursor.execute('SELECT MAX(%s) FROM %s WHERE 1 = 1%s' % (
+                qn(opts.get_field(self.tree_id_attr).column),
+                qn(db_table or opts.db_table), scope_sql), scope_params)
+            row = cursor.fetchone()
+            max_tree_id = max(max_tree_id, row[0] or 0)
+        return max_tree_id + (self.tree_id_gap or 1)
+
+    def _get_root_sibling_tree_id(self, node, target, position, using=None):
+        """
+        Determines the tree id ``node`` should be given to position it as
+        specified by ``position`` next to the ``target`` root node when
+        tree ids are allocated with gaps, which is halfway between the
+        tree ids of the target and its neighbouring root node.
+
+        If there is no unused tree id between them, the tree ids of all
+        following trees are increased by the gap to make room, and
+        ``node`` is modified to reflect any change to its own tree id.
+
+        Returns ``None`` if ``node`` is already the target's neighbour.
+        """
+        target_tree_id = getattr(target, self.tree_id_attr)
+        if position == 'left':
+            neighbour = target.get_previous_sibling()
+            upper = target_tree_id
+            if neighbour is None:
+                lower = 0
+            else:
+                lower = getattr(neighbour, self.tree_id_attr)
+        elif position == 'right':
+            neighbour = target.get_next_sibling()
+            lower = target_tree_id
+            if neighbour is None:
+                return lower + self.tree_id_gap
+            upper = getattr(neighbour, self.tree_id_attr)
+        else:
+            raise ValueError(_('An invalid position was given: %s.') % position)
+        if neighbour == node:
+            return None
+
+        if upper - lower <= 1:
+            self._create_tree_space(lower, using, self._get_scope(target),
+                                    self.tree_id_gap)
+            upper += self.tree_id_gap
+            tree_id = getattr(node, self.tree_id_attr)
+            if tree_id is not None and tree_id > lower:
+                setattr(node, self.tree_id_attr, tree_id + self.tree_id_gap)
+        return lower + (upper - lower) // 2
+
+    def _get_scope(self, node):
+        """
+        Returns the value of ``node``'s scope field, or ``None`` if trees
+        aren't scoped.
+        """
+        if self.tree_scope_attr is None:
+            return None
+        return getattr(node, self.model._meta.get_field(
+            self.tree_scope_attr).attname)
+
+    def _get_space_target(self, target, position):
+        """
+        Determines the edge indicator after which space must be made to
+        position a node relative to ``target`` as specified by
+        ``position``.
+        """
+        if position == 'last-child':
+            return getattr(target, self.right_attr) - 1
+        elif position == 'first-child':
+            return getattr(target, self.left_attr)
+        elif position == 'left':
+            return getattr(target, self.left_attr) - 1
+        elif position == 'right':
+            return getattr(target, self.right_attr)
+        raise ValueError(_('An invalid position was given: %s.') % position)
+
+    def _get_tree_ids(self, using=None, pending=False):
+        """
+        Retrieves the ids of all trees in order, or ``(scope, tree_id)``
+        tuples if trees are scoped. If ``pending`` is ``True``, only trees
+        with deferred nodes are included.
+        """
+        opts = self.model._meta
+        tree_ids = []
+        for alias in self._get_databases(using):
+            connection = get_connection(alias)
+            qn = connection.ops.quote_name
+            tree_columns = qn(opts.get_field(self.tree_id_attr).column)
+            if self.tree_scope_attr is not None:
+                tree_columns = '%s, %s' % (qn(opts.get_field(
+                    self.tree_scope_attr).column), tree_columns)
+            where = ''
+            if pending:
+                where = ' WHERE %s = 0' % qn(opts.get_field(
+                    self.left_attr).column)
+            cursor = connection.cursor()
+            cursor.execute('SELECT DISTINCT %(tree)s FROM %(table)s%(where)s '
+                           'ORDER BY %(tree)s' % {
+                'tree': tree_columns,
+                'table': qn(opts.db_table),
+                'where': where,
+            })
+            if self.tree_scope_attr is None:
+                tree_ids.extend([row[0] for row in cursor.fetchall()])
+            else:
+                tree_ids.extend([tuple(row) for row in cursor.fetchall()])
+        tree_ids.sort()
+        return tree_ids
+
+    def _import_trees(self, roots, get_children, batch_size, db_table,
+                      using=None):
+        """
+        Inserts the trees headed by each of the given ``roots`` as new
+        trees, where ``get_children`` returns a list of the children of
+        a given ``dict`` item.
+        """
+        opts = self.model._meta
+        db_table = db_table or opts.db_table
+        parent_field = opts.get_field(self.parent_attr)
+        tree_fields = [opts.get_field(attr) for attr in
+                       (self.left_attr, self.right_attr, self.tree_id_attr,
+                        self.level_attr)]
+        if self.tree_scope_attr is not None:
+            # Every node takes its root node's scope
+            scope_field = opts.get_field(self.tree_scope_attr)
+            tree_fields.append(scope_field)
+        fields = None
+        batch = []
+        aliases = []
+        batch_using = None
+        # The next tree id in each scope
+        tree_ids = {}
+        for root in roots:
+            scope = None
+            if self.tree_scope_attr is not None:
+                scope = scope_field.to_python(_row_value(root, scope_field))
+            if scope not in tree_ids:
+                tree_ids[scope] = self._get_next_tree_id(db_table, using,
+                                                         scope)
+            tree_id = tree_ids[scope]
+            tree_using = self._db_for_tree(tree_id, using)
+            if not aliases:
+                batch_using = tree_using
+            if tree_using != batch_using:
+                # This tree belongs in another database
+                if batch:
+                    self._insert_rows(db_table, fields + [parent_field] +
+                                      tree_fields, batch, batch_using)
+                    batch = []
+                batch_using = tree_using
+            if tree_using not in aliases:
+                aliases.append(tree_using)
+            for item, parent, left, right, level in self._number_tree(
+                    root, get_children):
+                if not _has_row_value(item, opts.pk):
+                    raise ValueError(_('Imported items must have a primary key.'))
+                if fields is None:
+                    # Insert every field the first item has a value for
+                    fields = [f for f in opts.local_fields
+                              if f not in tree_fields and
+                                 f is not parent_field and
+                                 _has_row_value(item, f)]
+                values = [get_db_prep_save(f, f.to_python(_row_value(item, f)),
+                                           tree_using)
+                          for f in fields]
+                if parent is not None:
+                    parent = opts.pk.to_python(_row_value(parent, opts.pk))
+                values.extend([get_db_prep_save(parent_field, parent,
+                                               tree_using),
+                               left, right, tree_id, level])
+                if self.tree_scope_attr is not None:
+                    values.append(get_db_prep_save(scope_field, scope,
+                                                   tree_using))
+                batch.append(values)
+                if len(batch) >= batch_size:
+                    self._insert_rows(db_table, fields + [parent_field] +
+                                      tree_fields, batch, batch_using)
+                    batch = []
+            tree_ids[scope] += self.tree_id_gap or 1
+        if batch:
+            self._insert_rows(db_table, fields + [parent_field] + tree_fields,
+                              batch, batch_using)
+        for alias in aliases:
+            commit_unless_managed(alias)
+
+    def _insert_rows(self, db_table, fields, rows, using=None):
+        """
+        Inserts ``rows`` of values for the given ``fields`` into
+        ``db_table`` with a single statement.
         """
-        opts = self.model._meta
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
         cursor = connection.cursor()
-        cursor.execute('SELECT MAX(%s) FROM %s' % (
-            qn(opts.get_field(self.tree_id_attr).column),
-            qn(opts.db_table)))
-        row = cursor.fetchone()
-        return row[0] and (row[0] + 1) or 1
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+            qn(db_table), ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields))), rows)
 
     def _inter_tree_move_and_close_gap(self, node, level_change,
-            left_right_change, new_tree_id, parent_pk=None):
+            left_right_change, new_tree_id, parent_pk=None, using=None):
         """
         Removes ``node`` from its current tree, with the given set of
         changes being applied to ``node`` and its descendants, closing
@@ -293,7 +2759,10 @@ class TreeManager(models.Manager):
         have its parent field set to ``NULL``. Otherwise, ``node`` will
         have ``parent_pk`` set for its parent field.
         """
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
         opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, self._get_scope(node))
         inter_tree_move_query = """
         UPDATE %(table)s
         SET %(level)s = CASE
@@ -320,7 +2789,7 @@ class TreeManager(models.Manager):
                 WHEN %(pk)s = %%s
                     THEN %(new_parent)s
                 ELSE %(parent)s END
-        WHERE %(tree_id)s = %%s""" % {
+        WHERE %(tree_id)s = %%s%(scope)s""" % {
             'table': qn(opts.db_table),
             'level': qn(opts.get_field(self.level_attr).column),
             'left': qn(opts.get_field(self.left_attr).column),
@@ -329,12 +2798,18 @@ class TreeManager(models.Manager):
             'parent': qn(opts.get_field(self.parent_attr).column),
             'pk': qn(opts.pk.column),
             'new_parent': parent_pk is None and 'NULL' or '%s',
+            'scope': scope_sql,
         }
 
         left = getattr(node, self.left_attr)
         right = getattr(node, self.right_attr)
         gap_size = right - left + 1
         gap_target_left = left - 1
+        if self.update_chunk_size:
+            # Only move the subtree, closing the gap in chunks afterwards
+            inter_tree_move_query += (' AND %(left)s >= %%s AND %(left)s <= %%s' %
+                {'left': qn(opts.get_field(self.left_attr).column)})
+            scope_params = scope_params + [left, right]
         params = [
             left, right, level_change,
             left, right, new_tree_id,
@@ -347,10 +2822,84 @@ class TreeManager(models.Manager):
         ]
         if parent_pk is not None:
             params.insert(-1, parent_pk)
+        params.extend(scope_params)
         cursor = connection.cursor()
         cursor.execute(inter_tree_move_query, params)
-
-    def _make_child_root_node(self, node, new_tree_id=None):
+        if self.update_chunk_size:
+            # The subtree's edge indicators are now unused, so only those
+            # after it need to be shifted
+            tree_id = getattr(node, self.tree_id_attr)
+            scope = self._get_scope(node)
+            self._shift_edges(-gap_size, right + 1,
+                              self._get_max_edge(tree_id, using, scope),
+                              tree_id, using, scope)
+
+    def _iterate_tree_rows(self, tree_id, chunk_size, using=None,
+                           scope=None):
+        """
+        Creates an iterator over ``(pk, parent_pk, tree_id, left, right,
+        level)`` rows for the nodes in the tree with the given id, or in
+        all trees if ``tree_id`` is ``None``, in the order used by
+        ``get_query_set``. If trees are scoped, rows also contain the
+        scope, which must be given with ``tree_id``.
+
+        Rows are fetched ``chunk_size`` at a time, using a server-side
+        cursor with the psycopg2 and MySQLdb database adapters.
+        """
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        columns = {
+            'pk': qn(opts.pk.column),
+            'parent': qn(opts.get_field(self.parent_attr).column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'table': qn(opts.db_table),
+            'scope': '',
+            'order_scope': '',
+            'where': '',
+        }
+        params = []
+        if self.tree_scope_attr is not None:
+            scope_column = qn(opts.get_field(self.tree_scope_attr).column)
+            columns['scope'] = ', %s' % scope_column
+            columns['order_scope'] = '%s, ' % scope_column
+        conditions = []
+        if tree_id is not None:
+            scope_sql, params = self._scope_sql(qn, scope)
+            conditions.append('%s = %%s%s' % (columns['tree_id'], scope_sql))
+            params = [tree_id] + params
+        if self.defer_insertion:
+            # Deferred nodes aren't part of a tree until they have been
+            # positioned
+            conditions.append('%s > 0' % columns['left'])
+        if conditions:
+            columns['where'] = ' WHERE %s' % ' AND '.join(conditions)
+        query = """
+        SELECT %(pk)s, %(parent)s, %(tree_id)s, %(left)s, %(right)s, %(level)s%(scope)s
+        FROM %(table)s%(where)s
+        ORDER BY %(order_scope)s%(tree_id)s, %(left)s""" % columns
+
+        # Ensure a connection has been established
+        cursor = connection.cursor()
+        adapter = type(connection.connection).__module__
+        if adapter.startswith('psycopg2'):
+            cursor = connection.connection.cursor('mptt_tree_rows')
+        elif adapter.startswith('MySQLdb'):
+            from MySQLdb.cursors import SSCursor
+            cursor = connection.connection.cursor(SSCursor)
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+        cursor.close()
+
+    def _make_child_root_node(self, node, new_tree_id=None, using=None):
         """
         Removes ``node`` from its tree, making it the root node of a new
         tree.
@@ -366,11 +2915,17 @@ class TreeManager(models.Manager):
         level = getattr(node, self.level_attr)
         tree_id = getattr(node, self.tree_id_attr)
         if not new_tree_id:
-            new_tree_id = self._get_next_tree_id()
+            new_tree_id = self._get_next_tree_id(using=using,
+                                                 scope=self._get_scope(node))
         left_right_change = left - 1
 
-        self._inter_tree_move_and_close_gap(node, level, left_right_change,
-                                            new_tree_id)
+        new_using = self._db_for_tree(new_tree_id, using)
+        if new_using == using:
+            self._inter_tree_move_and_close_gap(node, level, left_right_change,
+                                                new_tree_id, using=using)
+        else:
+            self._move_subtree_to_database(node, level, left_right_change,
+                                           new_tree_id, None, using)
 
         # Update the node to be consistent with the updated
         # tree in the database.
@@ -380,7 +2935,8 @@ class TreeManager(models.Manager):
         setattr(node, self.tree_id_attr, new_tree_id)
         setattr(node, self.parent_attr, None)
 
-    def _make_sibling_of_root_node(self, node, target, position):
+    def _make_sibling_of_root_node(self, node, target, position,
+                                   using=None):
         """
         Moves ``node``, making it a sibling of the given ``target`` root
         node as specified by ``position``.
@@ -391,7 +2947,9 @@ class TreeManager(models.Manager):
         Since we use tree ids to reduce the number of rows affected by
         tree mangement during insertion and deletion, root nodes are not
         true siblings; thus, making an item a sibling of a root node is
-        a special case which involves shuffling tree ids around.
+        a special case which involves shuffling tree ids around. If tree
+        ids are allocated with gaps, only the tree being moved is usually
+        given a new tree id.
         """
         if node == target:
             raise InvalidMove(_('A node may not be made a sibling of itself.'))
@@ -401,6 +2959,11 @@ class TreeManager(models.Manager):
         target_tree_id = getattr(target, self.tree_id_attr)
 
         if node.is_child_node():
+            if self.tree_id_gap:
+                new_tree_id = self._get_root_sibling_tree_id(node, target,
+                                                             position, using)
+                self._make_child_root_node(node, new_tree_id, using)
+                return
             if position == 'left':
                 space_target = target_tree_id - 1
                 new_tree_id = target_tree_id
@@ -410,16 +2973,26 @@ class TreeManager(models.Manager):
             else:
                 raise ValueError(_('An invalid position was given: %s.') % position)
 
-            self._create_tree_space(space_target)
+            self._create_tree_space(space_target, using,
+                                    self._get_scope(node))
             if tree_id > space_target:
                 # The node's tree id has been incremented in the
                 # database - this change must be reflected in the node
                 # object for the method call below to operate on the
                 # correct tree.
                 setattr(node, self.tree_id_attr, tree_id + 1)
-            self._make_child_root_node(node, new_tree_id)
+            self._make_child_root_node(node, new_tree_id, using)
         else:
-            if position == 'left':
+            if self.tree_id_gap:
+                new_tree_id = self._get_root_sibling_tree_id(node, target,
+                                                             position, using)
+                if new_tree_id is None:
+                    return
+                # Only the node's own tree is given a new tree id
+                tree_id = getattr(node, self.tree_id_attr)
+                lower_bound = upper_bound = tree_id
+                shift = 0
+            elif position == 'left':
                 if target_tree_id > tree_id:
                     left_sibling = target.get_previous_sibling()
                     if node == left_sibling:
@@ -446,28 +3019,70 @@ class TreeManager(models.Manager):
             else:
                 raise ValueError(_('An invalid position was given: %s.') % position)
 
+            connection = get_connection(using)
+            qn = connection.ops.quote_name
+            scope_sql, scope_params = self._scope_sql(qn,
+                                                      self._get_scope(node))
             root_sibling_query = """
             UPDATE %(table)s
             SET %(tree_id)s = CASE
                 WHEN %(tree_id)s = %%s
                     THEN %%s
                 ELSE %(tree_id)s + %%s END
-            WHERE %(tree_id)s >= %%s AND %(tree_id)s <= %%s""" % {
+            WHERE %(tree_id)s >= %%s AND %(tree_id)s <= %%s%(scope)s""" % {
                 'table': qn(opts.db_table),
                 'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+                'scope': scope_sql,
             }
             cursor = connection.cursor()
             cursor.execute(root_sibling_query, [tree_id, new_tree_id, shift,
-                                                lower_bound, upper_bound])
+                                                lower_bound, upper_bound] +
+                                               scope_params)
             setattr(node, self.tree_id_attr, new_tree_id)
 
-    def _manage_space(self, size, target, tree_id):
+    def _number_tree(self, root, get_children):
+        """
+        Calculates tree fields for ``root`` and its descendants, where
+        ``get_children`` returns a list of the children of a given node,
+        without recursion.
+
+        Returns a list of ``(node, parent, left, right, level)`` tuples
+        in tree order.
+        """
+        root_values = [root, None, 1, None, 0]
+        numbered = [root_values]
+        stack = [(root_values, iter(get_children(root)))]
+        edge = 2
+        while stack:
+            values, children = stack[-1]
+            try:
+                child = children.next()
+            except StopIteration:
+                values[3] = edge
+                edge += 1
+                stack.pop()
+                continue
+            child_values = [child, values[0], edge, None, values[4] + 1]
+            edge += 1
+            numbered.append(child_values)
+            stack.append((child_values, iter(get_children(child))))
+        return [tuple(values) for values in numbered]
+
+    def _manage_space(self, size, target, tree_id, using=None, scope=None):
         """
         Manages spaces in the tree identified by ``tree_id`` by changing
         the values of the left and right columns by ``size`` after the
         given ``target`` point.
         """
+        if self.update_chunk_size:
+            self._shift_edges(size, target + 1,
+                              self._get_max_edge(tree_id, using, scope),
+                              tree_id, using, scope)
+            return
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
         opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
         space_query = """
         UPDATE %(table)s
         SET %(left)s = CASE
@@ -479,17 +3094,18 @@ class TreeManager(models.Manager):
                     THEN %(right)s + %%s
                 ELSE %(right)s END
         WHERE %(tree_id)s = %%s
-          AND (%(left)s > %%s OR %(right)s > %%s)""" % {
+          AND (%(left)s > %%s OR %(right)s > %%s)%(scope)s""" % {
             'table': qn(opts.db_table),
             'left': qn(opts.get_field(self.left_attr).column),
             'right': qn(opts.get_field(self.right_attr).column),
             'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'scope': scope_sql,
         }
         cursor = connection.cursor()
         cursor.execute(space_query, [target, size, target, size, tree_id,
-                                     target, target])
+                                     target, target] + scope_params)
 
-    def _move_child_node(self, node, target, position):
+    def _move_child_node(self, node, target, position, using=None):
         """
         Calls the appropriate method to move child node ``node``
         relative to the given ``target`` node as specified by
@@ -500,11 +3116,11 @@ class TreeManager(models.Manager):
 
         if (getattr(node, self.tree_id_attr) ==
             getattr(target, self.tree_id_attr)):
-            self._move_child_within_tree(node, target, position)
+            self._move_child_within_tree(node, target, position, using)
         else:
-            self._move_child_to_new_tree(node, target, position)
+            self._move_child_to_new_tree(node, target, position, using)
 
-    def _move_child_to_new_tree(self, node, target, position):
+    def _move_child_to_new_tree(self, node, target, position, using=None):
         """
         Moves child node ``node`` to a different tree, inserting it
         relative to the given ``target`` node in the new tree as
@@ -528,10 +3144,16 @@ class TreeManager(models.Manager):
         tree_width = right - left + 1
 
         # Make space for the subtree which will be moved
-        self._create_space(tree_width, space_target, new_tree_id)
+        new_using = self._db_for_tree(new_tree_id, using)
+        self._create_space(tree_width, space_target, new_tree_id, new_using,
+                           self._get_scope(node))
         # Move the subtree
-        self._inter_tree_move_and_close_gap(node, level_change,
-            left_right_change, new_tree_id, parent.pk)
+        if new_using == using:
+            self._inter_tree_move_and_close_gap(node, level_change,
+                left_right_change, new_tree_id, parent.pk, using)
+        else:
+            self._move_subtree_to_database(node, level_change,
+                left_right_change, new_tree_id, parent.pk, using)
 
         # Update the node to be consistent with the updated
         # tree in the database.
@@ -541,7 +3163,7 @@ class TreeManager(models.Manager):
         setattr(node, self.tree_id_attr, new_tree_id)
         setattr(node, self.parent_attr, parent)
 
-    def _move_child_within_tree(self, node, target, position):
+    def _move_child_within_tree(self, node, target, position, using=None):
         """
         Moves child node ``node`` within its current tree relative to
         the given ``target`` node as specified by ``position``.
@@ -553,55 +3175,9 @@ class TreeManager(models.Manager):
         right = getattr(node, self.right_attr)
         level = getattr(node, self.level_attr)
         width = right - left + 1
-        tree_id = getattr(node, self.tree_id_attr)
-        target_left = getattr(target, self.left_attr)
-        target_right = getattr(target, self.right_attr)
-        target_level = getattr(target, self.level_attr)
 
-        if position == 'last-child' or position == 'first-child':
-            if node == target:
-                raise InvalidMove(_('A node may not be made a child of itself.'))
-            elif left < target_left < right:
-                raise InvalidMove(_('A node may not be made a child of any of its descendants.'))
-            if position == 'last-child':
-                if target_right > right:
-                    new_left = target_right - width
-                    new_right = target_right - 1
-                else:
-                    new_left = target_right
-                    new_right = target_right + width - 1
-            else:
-                if target_left > left:
-                    new_left = target_left - width + 1
-                    new_right = target_left
-                else:
-                    new_left = target_left + 1
-                    new_right = target_left + width
-            level_change = level - target_level - 1
-            parent = target
-        elif position == 'left' or position == 'right':
-            if node == target:
-                raise InvalidMove(_('A node may not be made a sibling of itself.'))
-            elif left < target_left < right:
-                raise InvalidMove(_('A node may not be made a sibling of any of its descendants.'))
-            if position == 'left':
-                if target_left > left:
-                    new_left = target_left - width
-                    new_right = target_left - 1
-                else:
-                    new_left = target_left
-                    new_right = target_left + width - 1
-            else:
-                if target_right > right:
-                    new_left = target_right - width + 1
-                    new_right = target_right
-                else:
-                    new_left = target_right + 1
-                    new_right = target_right + width
-            level_change = level - target_level
-            parent = getattr(target, self.parent_attr)
-        else:
-            raise ValueError(_('An invalid position was given: %s.') % position)
+        new_left, new_right, level_change, parent = \
+            self._calculate_within_tree_move_values(node, target, position)
 
         left_boundary = min(left, new_left)
         right_boundary = max(right, new_right)
@@ -610,52 +3186,14 @@ class TreeManager(models.Manager):
         if left_right_change > 0:
             gap_size = -gap_size
 
-        opts = self.model._meta
-        # The level update must come before the left update to keep
-        # MySQL happy - left seems to refer to the updated value
-        # immediately after its update has been specified in the query
-        # with MySQL, but not with SQLite or Postgres.
-        move_subtree_query = """
-        UPDATE %(table)s
-        SET %(level)s = CASE
-                WHEN %(left)s >= %%s AND %(left)s <= %%s
-                  THEN %(level)s - %%s
-                ELSE %(level)s END,
-            %(left)s = CASE
-                WHEN %(left)s >= %%s AND %(left)s <= %%s
-                  THEN %(left)s + %%s
-                WHEN %(left)s >= %%s AND %(left)s <= %%s
-                  THEN %(left)s + %%s
-                ELSE %(left)s END,
-            %(right)s = CASE
-                WHEN %(right)s >= %%s AND %(right)s <= %%s
-                  THEN %(right)s + %%s
-                WHEN %(right)s >= %%s AND %(right)s <= %%s
-                  THEN %(right)s + %%s
-                ELSE %(right)s END,
-            %(parent)s = CASE
-                WHEN %(pk)s = %%s
-                  THEN %%s
-                ELSE %(parent)s END
-        WHERE %(tree_id)s = %%s""" % {
-            'table': qn(opts.db_table),
-            'level': qn(opts.get_field(self.level_attr).column),
-            'left': qn(opts.get_field(self.left_attr).column),
-            'right': qn(opts.get_field(self.right_attr).column),
-            'parent': qn(opts.get_field(self.parent_attr).column),
-            'pk': qn(opts.pk.column),
-            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
-        }
-
-        cursor = connection.cursor()
-        cursor.execute(move_subtree_query, [
-            left, right, level_change,
-            left, right, left_right_change,
-            left_boundary, right_boundary, gap_size,
-            left, right, left_right_change,
-            left_boundary, right_boundary, gap_size,
-            node.pk, parent.pk,
-            tree_id])
+        if self.update_chunk_size:
+            self._move_subtree_in_chunks(node, new_left, level_change,
+                                         left_boundary, right_boundary,
+                                         gap_size, parent, using)
+        else:
+            self._move_subtree_within_tree(node, new_left, level_change,
+                                           left_boundary, right_boundary,
+                                           gap_size, parent, using)
 
         # Update the node to be consistent with the updated
         # tree in the database.
@@ -664,7 +3202,7 @@ class TreeManager(models.Manager):
         setattr(node, self.level_attr, level - level_change)
         setattr(node, self.parent_attr, parent)
 
-    def _move_root_node(self, node, target, position):
+    def _move_root_node(self, node, target, position, using=None):
         """
         Moves root node``node`` to a different tree, inserting it
         relative to the given ``target`` node as specified by
@@ -689,10 +3227,24 @@ class TreeManager(models.Manager):
             self._calculate_inter_tree_move_values(node, target, position)
 
         # Create space for the tree which will be inserted
-        self._create_space(width, space_target, new_tree_id)
+        new_using = self._db_for_tree(new_tree_id, using)
+        self._create_space(width, space_target, new_tree_id, new_using,
+                           self._get_scope(node))
+        if new_using != using:
+            self._move_subtree_to_database(node, level_change,
+                left_right_change, new_tree_id, parent.pk, using)
+            setattr(node, self.left_attr, left - left_right_change)
+            setattr(node, self.right_attr, right - left_right_change)
+            setattr(node, self.level_attr, level - level_change)
+            setattr(node, self.tree_id_attr, new_tree_id)
+            setattr(node, self.parent_attr, parent)
+            return
 
         # Move the root node, making it a child node
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
         opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, self._get_scope(node))
         move_tree_query = """
         UPDATE %(table)s
         SET %(level)s = %(level)s - %%s,
@@ -704,7 +3256,7 @@ class TreeManager(models.Manager):
                     THEN %%s
                 ELSE %(parent)s END
         WHERE %(left)s >= %%s AND %(left)s <= %%s
-          AND %(tree_id)s = %%s""" % {
+          AND %(tree_id)s = %%s%(scope)s""" % {
             'table': qn(opts.db_table),
             'level': qn(opts.get_field(self.level_attr).column),
             'left': qn(opts.get_field(self.left_attr).column),
@@ -712,11 +3264,12 @@ class TreeManager(models.Manager):
             'tree_id': qn(opts.get_field(self.tree_id_attr).column),
             'parent': qn(opts.get_field(self.parent_attr).column),
             'pk': qn(opts.pk.column),
+            'scope': scope_sql,
         }
         cursor = connection.cursor()
         cursor.execute(move_tree_query, [level_change, left_right_change,
             left_right_change, new_tree_id, node.pk, parent.pk, left, right,
-            tree_id])
+            tree_id] + scope_params)
 
         # Update the former root node to be consistent with the updated
         # tree in the database.
@@ -725,3 +3278,373 @@ class TreeManager(models.Manager):
         setattr(node, self.level_attr, level - level_change)
         setattr(node, self.tree_id_attr, new_tree_id)
         setattr(node, self.parent_attr, parent)
+
+    def _move_subtree_in_chunks(self, node, new_left, level_change,
+                                left_boundary, right_boundary, gap_size,
+                                parent, using=None):
+        """
+        Moves ``node``'s subtree so its left edge indicator becomes
+        ``new_left``, changing the edge indicators of other nodes from
+        ``left_boundary`` to ``right_boundary`` by ``gap_size``, shifting
+        edge indicators in chunks.
+
+        The subtree is moved past the end of the tree first, so the nodes
+        between its old and new positions can be shifted into the space
+        it left before it is moved into the space they left.
+        """
+        left = getattr(node, self.left_attr)
+        right = getattr(node, self.right_attr)
+        tree_id = getattr(node, self.tree_id_attr)
+        scope = self._get_scope(node)
+        temporary_change = self._get_max_edge(tree_id, using, scope) + 1 - left
+        self._shift_edges(temporary_change, left, right, tree_id, using,
+                          scope)
+        self._shift_edges(gap_size, left_boundary, right_boundary, tree_id,
+                          using, scope)
+        self._shift_edges(new_left - left - temporary_change,
+                          left + temporary_change, right + temporary_change,
+                          tree_id, using, scope)
+
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        cursor = connection.cursor()
+        cursor.execute("""
+        UPDATE %(table)s
+        SET %(level)s = %(level)s - %%s,
+            %(parent)s = CASE
+                WHEN %(pk)s = %%s
+                  THEN %%s
+                ELSE %(parent)s END
+        WHERE %(tree_id)s = %%s
+          AND %(left)s >= %%s AND %(left)s <= %%s%(scope)s""" % {
+            'table': qn(opts.db_table),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'parent': qn(opts.get_field(self.parent_attr).column),
+            'pk': qn(opts.pk.column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'scope': scope_sql,
+        }, [level_change, node.pk, parent.pk, tree_id, new_left,
+            new_left + right - left] + scope_params)
+
+    def _move_subtree_to_database(self, node, level_change,
+            left_right_change, new_tree_id, parent_pk, using):
+        """
+        Moves ``node`` and its descendants from the database with the
+        alias ``using`` to the database which holds the tree with the
+        given ``new_tree_id`` when trees are sharded, by copying them
+        and then deleting them, with the given set of changes being
+        applied to their tree fields and ``parent_pk`` being set for
+        ``node``'s parent field. The gap left in ``node``'s old tree is
+        closed.
+
+        Rows in other tables which are related to the moved nodes are
+        not moved.
+        """
+        opts = self.model._meta
+        left = getattr(node, self.left_attr)
+        right = getattr(node, self.right_attr)
+        tree_id = getattr(node, self.tree_id_attr)
+        new_using = self._db_for_tree(new_tree_id, using)
+        parent_field = opts.get_field(self.parent_attr)
+        fields = opts.local_fields
+
+        scope = self._get_scope(node)
+        filters = self._scope_filters(scope)
+        filters[self.tree_id_attr] = tree_id
+        filters['%s__range' % self.left_attr] = (left, right)
+        rows = []
+        for descendant in query_set_using(self.model._base_manager.filter(
+                **filters), using).order_by(self.left_attr):
+            setattr(descendant, self.left_attr,
+                    getattr(descendant, self.left_attr) - left_right_change)
+            setattr(descendant, self.right_attr,
+                    getattr(descendant, self.right_attr) - left_right_change)
+            setattr(descendant, self.level_attr,
+                    getattr(descendant, self.level_attr) - level_change)
+            setattr(descendant, self.tree_id_attr, new_tree_id)
+            if descendant.pk == node.pk:
+                setattr(descendant, parent_field.attname, parent_pk)
+            rows.append([get_db_prep_save(f, getattr(descendant, f.attname),
+                                          new_using) for f in fields])
+        self._insert_rows(opts.db_table, fields, rows, new_using)
+        commit_unless_managed(new_using)
+        if hasattr(node, '_state'):
+            # Django >= 1.2 - the node now belongs to the other database
+            node._state.db = new_using
+
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        cursor = connection.cursor()
+        cursor.execute("""
+        DELETE FROM %(table)s
+        WHERE %(tree_id)s = %%s
+          AND %(left)s >= %%s AND %(left)s <= %%s%(scope)s""" % {
+            'table': qn(opts.db_table),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'scope': scope_sql,
+        }, [tree_id, left, right] + scope_params)
+        self._close_gap(right - left + 1, right, tree_id, using, scope)
+
+    def _move_subtree_within_tree(self, node, new_left, level_change,
+                                  left_boundary, right_boundary, gap_size,
+                                  parent, using=None):
+        """
+        Moves ``node``'s subtree so its left edge indicator becomes
+        ``new_left``, changing the edge indicators of other nodes from
+        ``left_boundary`` to ``right_boundary`` by ``gap_size``, with a
+        single query.
+        """
+        left = getattr(node, self.left_attr)
+        right = getattr(node, self.right_attr)
+        tree_id = getattr(node, self.tree_id_attr)
+        left_right_change = new_left - left
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, self._get_scope(node))
+        # The level update must come before the left update to keep
+        # MySQL happy - left seems to refer to the updated value
+        # immediately after its update has been specified in the query
+        # with MySQL, but not with SQLite or Postgres.
+        move_subtree_query = """
+        UPDATE %(table)s
+        SET %(level)s = CASE
+                WHEN %(left)s >= %%s AND %(left)s <= %%s
+                  THEN %(level)s - %%s
+                ELSE %(level)s END,
+            %(left)s = CASE
+                WHEN %(left)s >= %%s AND %(left)s <= %%s
+                  THEN %(left)s + %%s
+                WHEN %(left)s >= %%s AND %(left)s <= %%s
+                  THEN %(left)s + %%s
+                ELSE %(left)s END,
+            %(right)s = CASE
+                WHEN %(right)s >= %%s AND %(right)s <= %%s
+                  THEN %(right)s + %%s
+                WHEN %(right)s >= %%s AND %(right)s <= %%s
+                  THEN %(right)s + %%s
+                ELSE %(right)s END,
+            %(parent)s = CASE
+                WHEN %(pk)s = %%s
+                  THEN %%s
+                ELSE %(parent)s END
+        WHERE %(tree_id)s = %%s%(scope)s""" % {
+            'table': qn(opts.db_table),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'parent': qn(opts.get_field(self.parent_attr).column),
+            'pk': qn(opts.pk.column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'scope': scope_sql,
+        }
+
+        cursor = connection.cursor()
+        cursor.execute(move_subtree_query, [
+            left, right, level_change,
+            left, right, left_right_change,
+            left_boundary, right_boundary, gap_size,
+            left, right, left_right_change,
+            left_boundary, right_boundary, gap_size,
+            node.pk, parent.pk,
+            tree_id] + scope_params)
+
+    def _resort_subtree(self, node, using=None):
+        """
+        Re-sorts siblings at every level below ``node`` according to the
+        model's ``order_insertion_by`` fields, falling back on their
+        existing order.
+        """
+        opts = self.model._meta
+        filters = self._scope_filters(self._get_scope(node))
+        filters[self.tree_id_attr] = getattr(node, self.tree_id_attr)
+        filters['%s__range' % self.left_attr] = (getattr(node, self.left_attr),
+                                                 getattr(node, self.right_attr))
+        rows = list(query_set_using(self.model._base_manager.filter(
+            **filters), using).order_by(self.left_attr).values_list(
+                'pk', self.parent_attr, self.left_attr, self.right_attr,
+                self.level_attr, *opts.order_insertion_by))
+        if not rows:
+            return
+
+        # Rows are retrieved in tree order, so ties keep their order
+        children = {}
+        for row in rows[1:]:
+            children.setdefault(row[1], []).append((row[5:], row[2], row))
+        for siblings in children.values():
+            siblings.sort()
+        def get_children(row):
+            return [sibling[2] for sibling in children.get(row[0], ())]
+
+        root = rows[0]
+        tree_id = getattr(node, self.tree_id_attr)
+        updates = []
+        for row, parent, left, right, level in self._number_tree(
+                root, get_children):
+            left, right, level = (left + root[2] - 1, right + root[2] - 1,
+                                  level + root[4])
+            if row[2:5] != (left, right, level):
+                updates.append((tree_id, left, right, level, row[0]))
+        self._update_tree_fields(updates, using)
+
+    def _root_filters(self, tree_id, scope=None):
+        """
+        Creates filters which match the root node of the tree with the
+        given id, in the given ``scope`` if trees are scoped.
+        """
+        filters = self._scope_filters(scope)
+        filters[self.tree_id_attr] = tree_id
+        filters['%s__isnull' % self.parent_attr] = True
+        return filters
+
+    def _same_scope_sql(self, qn, table, other_table):
+        """
+        Creates a condition which matches rows of ``table`` and
+        ``other_table`` in the same scope, to be added to a query's
+        existing conditions, if trees are scoped.
+        """
+        if self.tree_scope_attr is None:
+            return ''
+        column = qn(self.model._meta.get_field(self.tree_scope_attr).column)
+        return ' AND %s.%s = %s.%s' % (table, column, other_table, column)
+
+    def _scope_filters(self, scope):
+        """
+        Creates filters which match nodes in the given ``scope``, if trees
+        are scoped.
+        """
+        if self.tree_scope_attr is None:
+            return {}
+        return {self.tree_scope_attr: scope}
+
+    def _scope_sql(self, qn, scope):
+        """
+        Creates a condition which matches rows in the given ``scope``, to
+        be added to a query's existing conditions, and its parameters, if
+        trees are scoped.
+        """
+        if self.tree_scope_attr is None:
+            return '', []
+        return ' AND %s = %%s' % qn(self.model._meta.get_field(
+            self.tree_scope_attr).column), [scope]
+
+    def _set_scope(self, node, scope):
+        """
+        Sets ``node``'s scope field, if trees are scoped.
+        """
+        if self.tree_scope_attr is not None:
+            setattr(node, self.model._meta.get_field(
+                self.tree_scope_attr).attname, scope)
+
+    def _shift_edges(self, size, lower, upper, tree_id, using=None,
+                     scope=None):
+        """
+        Changes edge indicators from ``lower`` to ``upper`` inclusive in
+        the tree identified by ``tree_id`` by ``size``, in chunks of
+        ``update_chunk_size`` edge indicators, committing and pausing
+        for ``update_chunk_pause`` seconds between chunks.
+
+        The edge indicators which edge indicators are being shifted into
+        must be unused. Chunks furthest in the direction of the shift are
+        shifted first, so no two edge indicators are ever the same.
+        """
+        chunks = []
+        chunk_lower = lower
+        while chunk_lower <= upper:
+            chunks.append((chunk_lower,
+                           min(chunk_lower + self.update_chunk_size - 1,
+                               upper)))
+            chunk_lower += self.update_chunk_size
+        if size > 0:
+            chunks.reverse()
+
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        scope_sql, scope_params = self._scope_sql(qn, scope)
+        shift_query = """
+        UPDATE %(table)s
+        SET %(left)s = CASE
+                WHEN %(left)s >= %%s AND %(left)s <= %%s
+                    THEN %(left)s + %%s
+                ELSE %(left)s END,
+            %(right)s = CASE
+                WHEN %(right)s >= %%s AND %(right)s <= %%s
+                    THEN %(right)s + %%s
+                ELSE %(right)s END
+        WHERE %(tree_id)s = %%s
+          AND (%(left)s >= %%s AND %(left)s <= %%s OR
+               %(right)s >= %%s AND %(right)s <= %%s)%(scope)s""" % {
+            'table': qn(opts.db_table),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'scope': scope_sql,
+        }
+        cursor = connection.cursor()
+        for i, (chunk_lower, chunk_upper) in enumerate(chunks):
+            if i > 0:
+                commit_unless_managed(using)
+                if self.update_chunk_pause:
+                    time.sleep(self.update_chunk_pause)
+            cursor.execute(shift_query, [chunk_lower, chunk_upper, size,
+                                         chunk_lower, chunk_upper, size,
+                                         tree_id, chunk_lower, chunk_upper,
+                                         chunk_lower, chunk_upper] +
+                                        scope_params)
+
+    def _split_tree(self, tree):
+        """
+        Splits a tree identifier - a tree id, or a ``(scope, tree_id)``
+        tuple if trees are scoped - into a ``(tree_id, scope)`` tuple.
+        """
+        if self.tree_scope_attr is None:
+            return tree, None
+        return tree[1], tree[0]
+
+    def _tree_ordering(self):
+        """
+        Returns the fields which put nodes in tree order - scope, if
+        trees are scoped, then tree id and left edge indicator.
+        """
+        if self.tree_scope_attr is None:
+            return [self.tree_id_attr, self.left_attr]
+        scope_field = self.model._meta.get_field(self.tree_scope_attr)
+        scope_ordering = self.tree_scope_attr
+        if scope_field.rel:
+            # Order by the related key itself rather than by the related
+            # model's ordering.
+            scope_ordering = '%s__%s' % (self.tree_scope_attr,
+                                         scope_field.rel.field_name)
+        return [scope_ordering, self.tree_id_attr, self.left_attr]
+
+    def _update_tree_fields(self, updates, using=None):
+        """
+        Updates the tree fields of nodes, given a list of
+        ``(tree_id, left, right, level, pk)`` tuples.
+        """
+        if not updates:
+            return
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        cursor = connection.cursor()
+        cursor.executemany("""
+        UPDATE %(table)s
+        SET %(tree_id)s = %%s,
+            %(left)s = %%s,
+            %(right)s = %%s,
+            %(level)s = %%s
+        WHERE %(pk)s = %%s""" % {
+            'table': qn(opts.db_table),
+            'tree_id': qn(opts.get_field(self.tree_id_attr).column),
+            'left': qn(opts.get_field(self.left_attr).column),
+            'right': qn(opts.get_field(self.right_attr).column),
+            'level': qn(opts.get_field(self.level_attr).column),
+            'pk': qn(opts.pk.column),
+        }, updates)
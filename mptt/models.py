@@ -2,6 +2,64 @@
 New instance methods for Django models which are set up for Modified
 Preorder Tree Traversal.
 """
+try:
+    from django.db import router
+except ImportError:
+    # Django < 1.2 only supports a single database
+    router = None
+
+def _query_set(node, manager):
+    """
+    Creates a ``QuerySet`` from ``manager`` which reads from the
+    database the routers choose for reading ``node``.
+    """
+    queryset = manager.all()
+    if router is not None:
+        queryset = queryset.using(router.db_for_read(node.__class__,
+                                                     instance=node))
+    return queryset
+
+def _get_enclosed_count(node):
+    """
+    Returns the number of nodes there is room for between ``node``'s
+    edge indicators, which is its number of descendants unless there
+    are gaps in its tree.
+    """
+    opts = node._meta
+    if not getattr(node, opts.left_attr):
+        # Deferred nodes haven't been given any room yet
+        return 0
+    return (getattr(node, opts.right_attr) -
+            getattr(node, opts.left_attr) - 1) / 2
+
+def _is_leaf_node(node):
+    """
+    Returns ``True`` if there is no room for descendants between
+    ``node``'s edge indicators, which is always the case for leaf nodes
+    unless there are gaps in their tree.
+    """
+    return not _get_enclosed_count(node)
+
+def _same_tree(node, other):
+    """
+    Returns ``True`` if ``node`` and ``other`` are in the same tree,
+    based on their tree ids and scopes, if trees are scoped.
+    """
+    opts = node._meta
+    if getattr(node, opts.tree_id_attr) != getattr(other, opts.tree_id_attr):
+        return False
+    if opts.tree_scope_attr is None:
+        return True
+    attname = opts.get_field(opts.tree_scope_attr).attname
+    return getattr(node, attname) == getattr(other, attname)
+
+def _scope_filters(node):
+    """
+    Creates filters which match nodes in the same scope as ``node``, if
+    trees are scoped.
+    """
+    tree_manager = node._tree_manager
+    return tree_manager._scope_filters(tree_manager._get_scope(node))
 
 def get_ancestors(self, ascending=False):
     """
@@ -17,11 +75,13 @@ def get_ancestors(self, ascending=False):
         return self._tree_manager.none()
 
     opts = self._meta
-    return self._default_manager.filter(**{
+    filters = _scope_filters(self)
+    filters.update({
         '%s__lt' % opts.left_attr: getattr(self, opts.left_attr),
         '%s__gt' % opts.right_attr: getattr(self, opts.right_attr),
         opts.tree_id_attr: getattr(self, opts.tree_id_attr),
-    }).order_by('%s%s' % ({True: '-', False: ''}[ascending], opts.left_attr))
+    })
+    return _query_set(self, self._default_manager).filter(**filters).order_by('%s%s' % ({True: '-', False: ''}[ascending], opts.left_attr))
 
 def get_children(self):
     """
@@ -33,40 +93,68 @@ def get_children(self):
     database query can be avoided in the case where the instance is
     a leaf node (it has no children).
     """
-    if self.is_leaf_node():
+    if _is_leaf_node(self):
         return self._tree_manager.none()
 
-    return self._tree_manager.filter(**{
+    return _query_set(self, self._tree_manager).filter(**{
         self._meta.parent_attr: self,
     })
 
-def get_descendants(self, include_self=False):
+def get_descendants(self, include_self=False, max_depth=None):
     """
     Creates a ``QuerySet`` containing descendants of this model
     instance, in tree order.
 
     If ``include_self`` is ``True``, the ``QuerySet`` will also
     include this model instance.
+
+    If ``max_depth`` is given, only descendants up to that many levels
+    below this model instance will be included.
     """
-    if not include_self and self.is_leaf_node():
+    if not include_self and (_is_leaf_node(self) or max_depth == 0):
         return self._tree_manager.none()
 
     opts = self._meta
-    filters = {opts.tree_id_attr: getattr(self, opts.tree_id_attr)}
+    filters = _scope_filters(self)
+    filters[opts.tree_id_attr] = getattr(self, opts.tree_id_attr)
     if include_self:
         filters['%s__range' % opts.left_attr] = (getattr(self, opts.left_attr),
                                                  getattr(self, opts.right_attr))
     else:
         filters['%s__gt' % opts.left_attr] = getattr(self, opts.left_attr)
         filters['%s__lt' % opts.left_attr] = getattr(self, opts.right_attr)
-    return self._tree_manager.filter(**filters)
+    if max_depth is not None:
+        filters['%s__lte' % opts.level_attr] = (getattr(self, opts.level_attr) +
+                                                max_depth)
+    queryset = _query_set(self, self._tree_manager).filter(**filters)
+    if max_depth is None and not opts.lazy_delete:
+        # The edge indicators say how many nodes the QuerySet contains
+        queryset._node_count = _get_enclosed_count(self) + int(include_self)
+    return queryset
 
 def get_descendant_count(self):
     """
     Returns the number of descendants this model instance has.
+
+    If the model was registered with ``lazy_delete``, its edge
+    indicators may enclose gaps left by deleted nodes, so descendants
+    are counted with a query unless it has no room for any.
+    """
+    if self._meta.lazy_delete and not _is_leaf_node(self):
+        return self.get_descendants().count()
+    return _get_enclosed_count(self)
+
+def get_leafnodes(self, include_self=False):
+    """
+    Creates a ``QuerySet`` containing the leaf nodes among the
+    descendants of this model instance, in tree order.
+
+    If ``include_self`` is ``True``, the ``QuerySet`` will also
+    include this model instance if it is a leaf node.
     """
-    return (getattr(self, self._meta.right_attr) -
-            getattr(self, self._meta.left_attr) - 1) / 2
+    if _is_leaf_node(self):
+        return self.get_descendants(include_self)
+    return self.get_descendants(include_self).leaf_nodes()
 
 def get_next_sibling(self):
     """
@@ -75,10 +163,11 @@ def get_next_sibling(self):
     """
     opts = self._meta
     if self.is_root_node():
-        filters = {
+        filters = _scope_filters(self)
+        filters.update({
             '%s__isnull' % opts.parent_attr: True,
             '%s__gt' % opts.tree_id_attr: getattr(self, opts.tree_id_attr),
-        }
+        })
     else:
         filters = {
              opts.parent_attr: getattr(self, '%s_id' % opts.parent_attr),
@@ -87,7 +176,7 @@ def get_next_sibling(self):
 
     sibling = None
     try:
-        sibling = self._tree_manager.filter(**filters)[0]
+        sibling = _query_set(self, self._tree_manager).filter(**filters)[0]
     except IndexError:
         pass
     return sibling
@@ -99,10 +188,11 @@ def get_previous_sibling(self):
     """
     opts = self._meta
     if self.is_root_node():
-        filters = {
+        filters = _scope_filters(self)
+        filters.update({
             '%s__isnull' % opts.parent_attr: True,
             '%s__lt' % opts.tree_id_attr: getattr(self, opts.tree_id_attr),
-        }
+        })
         order_by = '-%s' % opts.tree_id_attr
     else:
         filters = {
@@ -113,7 +203,8 @@ def get_previous_sibling(self):
 
     sibling = None
     try:
-        sibling = self._tree_manager.filter(**filters).order_by(order_by)[0]
+        sibling = _query_set(self, self._tree_manager).filter(
+            **filters).order_by(order_by)[0]
     except IndexError:
         pass
     return sibling
@@ -126,10 +217,12 @@ def get_root(self):
         return self
 
     opts = self._meta
-    return self._default_manager.get(**{
+    filters = _scope_filters(self)
+    filters.update({
         opts.tree_id_attr: getattr(self, opts.tree_id_attr),
         '%s__isnull' % opts.parent_attr: True,
     })
+    return _query_set(self, self._default_manager).get(**filters)
 
 def get_siblings(self, include_self=False):
     """
@@ -142,20 +235,32 @@ def get_siblings(self, include_self=False):
     """
     opts = self._meta
     if self.is_root_node():
-        filters = {'%s__isnull' % opts.parent_attr: True}
+        filters = _scope_filters(self)
+        filters['%s__isnull' % opts.parent_attr] = True
     else:
         filters = {opts.parent_attr: getattr(self, '%s_id' % opts.parent_attr)}
-    queryset = self._tree_manager.filter(**filters)
+    queryset = _query_set(self, self._tree_manager).filter(**filters)
     if not include_self:
         queryset = queryset.exclude(pk=self.pk)
     return queryset
 
-def insert_at(self, target, position='first-child', commit=False):
+def insert_at(self, target, position='first-child', commit=False,
+              using=None):
     """
     Convenience method for calling ``TreeManager.insert_node`` with this
     model instance.
     """
-    self._tree_manager.insert_node(self, target, position, commit)
+    self._tree_manager.insert_node(self, target, position, commit, using)
+
+def is_ancestor_of(self, other, include_self=False):
+    """
+    Returns ``True`` if this model instance is an ancestor of ``other``,
+    ``False`` otherwise, without querying the database.
+
+    If ``include_self`` is ``True``, ``True`` will also be returned if
+    ``other`` is this model instance.
+    """
+    return is_descendant_of(other, self, include_self)
 
 def is_child_node(self):
     """
@@ -164,6 +269,21 @@ def is_child_node(self):
     """
     return not self.is_root_node()
 
+def is_descendant_of(self, other, include_self=False):
+    """
+    Returns ``True`` if this model instance is a descendant of
+    ``other``, ``False`` otherwise, without querying the database.
+
+    If ``include_self`` is ``True``, ``True`` will also be returned if
+    ``other`` is this model instance.
+    """
+    if include_self and self.pk == other.pk:
+        return True
+    opts = self._meta
+    return (_same_tree(self, other) and
+            getattr(other, opts.left_attr) < getattr(self, opts.left_attr) and
+            getattr(self, opts.right_attr) < getattr(other, opts.right_attr))
+
 def is_leaf_node(self):
     """
     Returns ``True`` if this model instance is a leaf node (it has no
@@ -178,9 +298,9 @@ def is_root_node(self):
     """
     return getattr(self, '%s_id' % self._meta.parent_attr) is None
 
-def move_to(self, target, position='first-child'):
+def move_to(self, target, position='first-child', using=None):
     """
     Convenience method for calling ``TreeManager.move_node`` with this
     model instance.
     """
-    self._tree_manager.move_node(self, target, position)
+    self._tree_manager.move_node(self, target, position, using)
@@ -0,0 +1,58 @@
+"""
+Tree routers, which determine which database each tree of a model set
+up for MPTT is kept in, for sharding trees across multiple databases.
+"""
+__all__ = ('TreeRouter', 'ModuloTreeRouter', 'TreeShardRouter')
+
+class TreeRouter(object):
+    """
+    Determines which of a list of ``databases`` each tree is kept in,
+    given its tree id.
+    """
+    def __init__(self, databases):
+        self.databases = list(databases)
+
+    def db_for_tree(self, model, tree_id):
+        """
+        Returns the alias of the database the tree of ``model`` with the
+        given id is kept in.
+        """
+        raise NotImplementedError
+
+class ModuloTreeRouter(TreeRouter):
+    """
+    Spreads trees evenly across databases in tree id order.
+    """
+    def db_for_tree(self, model, tree_id):
+        return self.databases[(tree_id - 1) % len(self.databases)]
+
+class TreeShardRouter(object):
+    """
+    A database router which sends queries for nodes of models which
+    have been registered with a tree router to the database their tree
+    is kept in, or will be inserted into.
+
+    This should be added to the ``DATABASE_ROUTERS`` setting, so nodes
+    are saved and deleted in the right database.
+    """
+    def db_for_read(self, model, **hints):
+        return self._db_for_node(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_node(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Allows nodes of sharded models to be related to each other, as
+        nodes are moved to their parent's database when they're moved.
+        """
+        if (obj1.__class__ is obj2.__class__ and
+            getattr(obj1._meta, 'tree_router', None) is not None):
+            return True
+        return None
+
+    def _db_for_node(self, model, node):
+        if (getattr(model._meta, 'tree_router', None) is None or
+            not isinstance(node, model)):
+            return None
+        return model._tree_manager._db_for_node(node)
@@ -5,6 +5,10 @@ related logic when model instances are about to be saved or deleted.
 import operator
 
 from django.db.models.query import Q
+from django.utils.translation import ugettext as _
+
+from mptt.exceptions import InvalidMove
+from mptt.managers import query_set_using
 
 __all__ = ('pre_save',)
 
@@ -32,12 +36,13 @@ def _insertion_target_filters(node, order_insertion_by):
         fields.append((field, value))
     return reduce(operator.or_, filters)
 
-def _get_ordered_insertion_target(node, parent):
+def _get_ordered_insertion_target(node, parent, using=None):
     """
     Attempts to retrieve a suitable right sibling for ``node``
     underneath ``parent`` (which may be ``None`` in the case of root
     nodes) so that ordering by the fields specified by the node's class'
-    ``order_insertion_by`` option is maintained.
+    ``order_insertion_by`` option is maintained, from the database with
+    the alias ``using``.
 
     Returns ``None`` if no suitable sibling can be found.
     """
@@ -54,13 +59,17 @@ def _get_ordered_insertion_target(node, parent):
             # the same values.
             order_by.append(opts.left_attr)
         else:
+            tree_manager = node._tree_manager
             filters = filters & Q(**{'%s__isnull' % opts.parent_attr: True})
+            filters = filters & Q(**tree_manager._scope_filters(
+                tree_manager._get_scope(node)))
             # Fall back on tree id ordering if multiple root nodes have
             # the same values.
             order_by.append(opts.tree_id_attr)
         try:
-            right_sibling = \
-                node._default_manager.filter(filters).order_by(*order_by)[0]
+            right_sibling = query_set_using(
+                node._default_manager.filter(filters),
+                using).order_by(*order_by)[0]
         except IndexError:
             # No suitable right sibling could be found
             pass
@@ -68,9 +77,10 @@ def _get_ordered_insertion_target(node, parent):
 
 def pre_save(instance, **kwargs):
     """
-    If this is a new node, sets tree fields up before it is inserted
-    into the database, making room in the tree structure as neccessary,
-    defaulting to making the new node the last child of its parent.
+    If this is a new node - it has no primary key or no tree id yet -
+    sets tree fields up before it is inserted into the database, making
+    room in the tree structure as neccessary, defaulting to making the
+    new node the last child of its parent.
 
     It the node's left and right edge indicators already been set, we
     take this as indication that the node has already been set up for
@@ -83,44 +93,70 @@ def pre_save(instance, **kwargs):
     In either case, if the node's class has its ``order_insertion_by``
     tree option set, the node will be inserted or moved to the
     appropriate position to maintain ordering by the specified field.
+    Otherwise, if its ``defer_insertion`` tree option is set, a new
+    child node is saved without being positioned in its tree until
+    ``TreeManager.flush_pending`` is called.
+
+    The tree is managed in the database the routers choose for writing
+    the node, as it is by ``Model.save``, unless the signal says which
+    database the node is being saved to.
     """
     if kwargs.get('raw'):
         return
 
     opts = instance._meta
+    using = instance._tree_manager._db_for_write(instance,
+                                                 kwargs.get('using'))
     parent = getattr(instance, opts.parent_attr)
-    if not instance.pk:
+    if not instance.pk or getattr(instance, opts.tree_id_attr) is None:
         if (getattr(instance, opts.left_attr) and
             getattr(instance, opts.right_attr)):
             # This node has already been set up for insertion.
             return
 
         if opts.order_insertion_by:
-            right_sibling = _get_ordered_insertion_target(instance, parent)
+            right_sibling = _get_ordered_insertion_target(instance, parent,
+                                                          using)
             if right_sibling:
-                instance.insert_at(right_sibling, 'left')
+                instance.insert_at(right_sibling, 'left', using=using)
                 return
+        elif opts.defer_insertion and parent is not None:
+            instance._tree_manager._defer_node(instance, parent)
+            return
 
         # Default insertion
-        instance.insert_at(parent, position='last-child')
+        instance.insert_at(parent, position='last-child', using=using)
     else:
         # TODO Is it possible to track the original parent so we
         #      don't have to look it up again on each save after the
         #      first?
-        old_parent = getattr(instance._default_manager.get(pk=instance.pk),
+        old_parent = getattr(query_set_using(instance._default_manager.all(),
+                                             using).get(pk=instance.pk),
                              opts.parent_attr)
         if parent != old_parent:
+            tree_manager = instance._tree_manager
+            if tree_manager.tree_router is not None:
+                if parent is None:
+                    tree_id = tree_manager._get_next_tree_id(
+                        scope=tree_manager._get_scope(instance))
+                else:
+                    tree_id = getattr(parent, opts.tree_id_attr)
+                if tree_manager._db_for_tree(tree_id) != using:
+                    # The node would be saved back to the database it was
+                    # moved out of.
+                    raise InvalidMove(_('A node can only be moved to a tree in another database with move_to().'))
             setattr(instance, opts.parent_attr, old_parent)
             try:
                 if opts.order_insertion_by:
                     right_sibling = _get_ordered_insertion_target(instance,
-                                                                  parent)
+                                                                  parent,
+                                                                  using)
                     if right_sibling:
-                        instance.move_to(right_sibling, 'left')
+                        instance.move_to(right_sibling, 'left', using)
                         return
 
                 # Default movement
-                instance.move_to(parent, position='last-child')
+                instance.move_to(parent, position='last-child', using=using)
             finally:
                 # Make sure the instance's new parent is always
                 # restored on the way out in case of errors.
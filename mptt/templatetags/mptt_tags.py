@@ -13,29 +13,43 @@ from mptt.utils import tree_item_iterator, drilldown_tree_for_node
 register = template.Library()
 
 class FullTreeForModelNode(template.Node):
-    def __init__(self, model, context_var):
+    def __init__(self, model, context_var, max_level=None):
         self.model = model
         self.context_var = context_var
+        self.max_level = max_level
+        if max_level is not None:
+            self.max_level = template.Variable(max_level)
 
     def render(self, context):
         cls = get_model(*self.model.split('.'))
         if cls is None:
             raise template.TemplateSyntaxError(_('full_tree_for_model tag was given an invalid model: %s') % self.model)
-        context[self.context_var] = cls._tree_manager.all()
+        queryset = cls._tree_manager.all()
+        if self.max_level is not None:
+            queryset = queryset.filter(**{
+                '%s__lte' % cls._meta.level_attr: int(self.max_level.resolve(context)),
+            })
+        context[self.context_var] = queryset
         return ''
 
 class DrilldownTreeForNodeNode(template.Node):
     def __init__(self, node, context_var, foreign_key=None, count_attr=None,
-                 cumulative=False):
+                 cumulative=False, max_depth=None):
         self.node = template.Variable(node)
         self.context_var = context_var
         self.foreign_key = foreign_key
         self.count_attr = count_attr
         self.cumulative = cumulative
+        self.max_depth = max_depth
+        if max_depth is not None:
+            self.max_depth = template.Variable(max_depth)
 
     def render(self, context):
         # Let any VariableDoesNotExist raised bubble up
         args = [self.node.resolve(context)]
+        kwargs = {}
+        if self.max_depth is not None:
+            kwargs['max_depth'] = int(self.max_depth.resolve(context))
 
         if self.foreign_key is not None:
             app_label, model_name, fk_attr = self.foreign_key.split('.')
@@ -48,7 +62,7 @@ class DrilldownTreeForNodeNode(template.Node):
                 raise template.TemplateSyntaxError(_('drilldown_tree_for_node tag was given an invalid model field: %s') % fk_attr)
             args.extend([cls, fk_attr, self.count_attr, self.cumulative])
 
-        context[self.context_var] = drilldown_tree_for_node(*args)
+        context[self.context_var] = drilldown_tree_for_node(*args, **kwargs)
         return ''
 
 def do_full_tree_for_model(parser, token):
@@ -60,18 +74,30 @@ def do_full_tree_for_model(parser, token):
 
        {% full_tree_for_model [model] as [varname] %}
 
+    Extended usage::
+
+       {% full_tree_for_model [model] as [varname] max_level [level] %}
+
     The model is specified in ``[appname].[modelname]`` format.
 
-    Example::
+    When the extended form is used, only nodes up to and including the
+    given tree level are retrieved.
+
+    Examples::
 
        {% full_tree_for_model tests.Genre as genres %}
+       {% full_tree_for_model tests.Genre as genres max_level 2 %}
 
     """
     bits = token.contents.split()
-    if len(bits) != 4:
-        raise template.TemplateSyntaxError(_('%s tag requires three arguments') % bits[0])
+    if len(bits) not in (4, 6):
+        raise template.TemplateSyntaxError(_('%s tag requires either three or five arguments') % bits[0])
     if bits[2] != 'as':
         raise template.TemplateSyntaxError(_("second argument to %s tag must be 'as'") % bits[0])
+    if len(bits) == 6:
+        if bits[4] != 'max_level':
+            raise template.TemplateSyntaxError(_("if five arguments are given, fourth argument to %s tag must be 'max_level'") % bits[0])
+        return FullTreeForModelNode(bits[1], bits[3], bits[5])
     return FullTreeForModelNode(bits[1], bits[3])
 
 def do_drilldown_tree_for_node(parser, token):
@@ -110,14 +136,23 @@ def do_drilldown_tree_for_node(parser, token):
     If cumulative is also specified, this count will be for items
     related to the child node and all of its descendants.
 
+    Any of these forms may be followed by ``max_depth [depth]``, in which
+    case descendants up to that many levels below the given node are
+    included instead of its children, and will also have counts added.
+
     Examples::
 
        {% drilldown_tree_for_node genre as drilldown %}
        {% drilldown_tree_for_node genre as drilldown count tests.Game.genre in game_count %}
        {% drilldown_tree_for_node genre as drilldown cumulative count tests.Game.genre in game_count %}
+       {% drilldown_tree_for_node genre as drilldown max_depth 2 %}
 
     """
     bits = token.contents.split()
+    max_depth = None
+    if len(bits) > 4 and bits[-2] == 'max_depth':
+        max_depth = bits[-1]
+        bits = bits[:-2]
     len_bits = len(bits)
     if len_bits not in (4, 8, 9):
         raise TemplateSyntaxError(_('%s tag requires either three, seven or eight arguments') % bits[0])
@@ -128,7 +163,8 @@ def do_drilldown_tree_for_node(parser, token):
             raise TemplateSyntaxError(_("if seven arguments are given, fourth argument to %s tag must be 'with'") % bits[0])
         if bits[6] != 'in':
             raise TemplateSyntaxError(_("if seven arguments are given, sixth argument to %s tag must be 'in'") % bits[0])
-        return DrilldownTreeForNodeNode(bits[1], bits[3], bits[5], bits[7])
+        return DrilldownTreeForNodeNode(bits[1], bits[3], bits[5], bits[7],
+                                        max_depth=max_depth)
     elif len_bits == 9:
         if bits[4] != 'cumulative':
             raise TemplateSyntaxError(_("if eight arguments are given, fourth argument to %s tag must be 'cumulative'") % bits[0])
@@ -136,9 +172,10 @@ def do_drilldown_tree_for_node(parser, token):
             raise TemplateSyntaxError(_("if eight arguments are given, fifth argument to %s tag must be 'count'") % bits[0])
         if bits[7] != 'in':
             raise TemplateSyntaxError(_("if eight arguments are given, seventh argument to %s tag must be 'in'") % bits[0])
-        return DrilldownTreeForNodeNode(bits[1], bits[3], bits[6], bits[8], cumulative=True)
+        return DrilldownTreeForNodeNode(bits[1], bits[3], bits[6], bits[8],
+                                        cumulative=True, max_depth=max_depth)
     else:
-        return DrilldownTreeForNodeNode(bits[1], bits[3])
+        return DrilldownTreeForNodeNode(bits[1], bits[3], max_depth=max_depth)
 
 def tree_info(items, features=None):
     """
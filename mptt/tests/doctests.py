@@ -87,6 +87,41 @@ AlreadyRegistered: The model Genre has already been registered.
 >>> [item.name for item in drilldown_tree_for_node(platformer_3d)]
 [u'Action', u'Platformer', u'3D Platformer']
 
+>>> from StringIO import StringIO
+>>> from django.utils import simplejson
+>>> from mptt.utils import write_json_tree
+>>> stream = StringIO()
+>>> write_json_tree(stream, Genre.tree.all(), ['pk', 'name'])
+>>> print stream.getvalue()
+[{"pk": 1, "name": "Action", "children": [{"pk": 2, "name": "Platformer", "children": [{"pk": 3, "name": "2D Platformer"}, {"pk": 4, "name": "3D Platformer"}, {"pk": 5, "name": "4D Platformer"}]}]}, {"pk": 6, "name": "Role-playing Game", "children": [{"pk": 7, "name": "Action RPG"}, {"pk": 8, "name": "Tactical RPG"}]}]
+>>> len(simplejson.loads(stream.getvalue()))
+2
+
+>>> stream = StringIO()
+>>> write_json_tree(stream, Genre.tree.all(), ['name'], max_level=1)
+>>> print stream.getvalue()
+[{"name": "Action", "children": [{"name": "Platformer"}]}, {"name": "Role-playing Game", "children": [{"name": "Action RPG"}, {"name": "Tactical RPG"}]}]
+
+>>> stream = StringIO()
+>>> write_json_tree(stream, Genre.tree.all(), ['name'], roots=[platformer_3d, Genre.objects.get(pk=platformer.pk)])
+>>> print stream.getvalue()
+[{"name": "Platformer", "children": [{"name": "2D Platformer"}, {"name": "3D Platformer"}, {"name": "4D Platformer"}]}]
+
+>>> stream = StringIO()
+>>> write_json_tree(stream, Genre.tree.all(), ['name'], roots=[action, Genre.objects.get(pk=arpg.pk)], max_level=1)
+>>> print stream.getvalue()
+[{"name": "Action", "children": [{"name": "Platformer"}]}, {"name": "Action RPG"}]
+
+>>> stream = StringIO()
+>>> write_json_tree(stream, Genre.tree.exclude(pk=platformer.pk), ['name'])
+>>> print stream.getvalue()
+[{"name": "Action", "children": [{"name": "2D Platformer"}, {"name": "3D Platformer"}, {"name": "4D Platformer"}]}, {"name": "Role-playing Game", "children": [{"name": "Action RPG"}, {"name": "Tactical RPG"}]}]
+
+>>> stream = StringIO()
+>>> write_json_tree(stream, Genre.tree.all(), roots=[])
+>>> print stream.getvalue()
+[]
+
 # Forms #######################################################################
 >>> from mptt.forms import TreeNodeChoiceField, MoveNodeForm
 
@@ -194,6 +229,48 @@ AlreadyRegistered: The model Genre has already been registered.
 <option value="right">Right sibling</option>
 </select></td></tr>
 
+>>> f = TreeNodeChoiceField(queryset=Genre.tree.all(), label_field='name')
+>>> print(f.widget.render("test", None))
+<select name="test">
+<option value="1"> Action</option>
+<option value="2">--- Platformer</option>
+<option value="3">------ 2D Platformer</option>
+<option value="4">------ 3D Platformer</option>
+<option value="5">------ 4D Platformer</option>
+<option value="6"> Role-playing Game</option>
+<option value="7">--- Action RPG</option>
+<option value="8">--- Tactical RPG</option>
+</select>
+
+>>> f = TreeNodeChoiceField(queryset=Genre.tree.all(), label_field='name', page_size=3, required=False)
+>>> print(f.widget.render("test", 4))
+<select name="test">
+<option value="">---------</option>
+<option value="4" selected="selected">------ 3D Platformer</option>
+</select>
+>>> f.choices_page()
+([(1, u' Action'), (2, u'--- Platformer'), (3, u'------ 2D Platformer')], '1:3')
+>>> f.choices_page('1:3')
+([(4, u'------ 3D Platformer'), (5, u'------ 4D Platformer'), (6, u' Role-playing Game')], '2:1')
+>>> f.choices_page('2:1')
+([(7, u'--- Action RPG'), (8, u'--- Tactical RPG')], None)
+>>> f.choices_page(search='rpg')
+([(7, u'--- Action RPG'), (8, u'--- Tactical RPG')], None)
+>>> f.clean('5')
+<Genre: 4D Platformer>
+
+>>> TreeNodeChoiceField(queryset=Genre.tree.all(), page_size=3)
+Traceback (most recent call last):
+    ...
+ValueError: A label_field must be given to paginate choices.
+
+>>> form = MoveNodeForm(Genre.objects.get(pk=7), label_field='name', page_size=50)
+>>> print(form['target'])
+<select id="id_target" name="target" size="10">
+</select>
+>>> form.fields['target'].choices_page()[0]
+[(1, u' Action'), (2, u'--- Platformer'), (3, u'------ 2D Platformer'), (4, u'------ 3D Platformer'), (5, u'------ 4D Platformer'), (6, u' Role-playing Game'), (8, u'--- Tactical RPG')]
+
 # TreeManager Methods #########################################################
 
 >>> Genre.tree.root_node(action.tree_id)
@@ -208,6 +285,23 @@ DoesNotExist: Genre matching query does not exist.
 >>> [g.name for g in Genre.tree.root_nodes()]
 [u'Action', u'Role-playing Game']
 
+>>> nodes = list(Genre.tree.nodes(['name']))
+>>> nodes
+[<Genre node: Action>, <Genre node: Platformer>, <Genre node: 2D Platformer>, <Genre node: 3D Platformer>, <Genre node: 4D Platformer>, <Genre node: Role-playing Game>, <Genre node: Action RPG>, <Genre node: Tactical RPG>]
+>>> [(n.pk, n.parent_id, n.tree_id, n.level, n.lft, n.rght) for n in nodes[:3]]
+[(1, None, 1, 0, 1, 10), (2, 1, 1, 1, 2, 9), (3, 2, 1, 2, 3, 4)]
+>>> [(n.is_root_node(), n.is_leaf_node(), n.get_descendant_count()) for n in nodes[:3]]
+[(True, False, 4), (False, False, 3), (False, True, 0)]
+>>> for i,s in tree_item_iterator(Genre.tree.nodes(['name'], Genre.tree.filter(tree_id=2)), ancestors=True):
+...     print (i, s['new_level'], s['ancestors'], s['closed_levels'])
+(<Genre node: Role-playing Game>, True, [], [])
+(<Genre node: Action RPG>, True, [u'Role-playing Game'], [])
+(<Genre node: Tactical RPG>, False, [u'Role-playing Game'], [1, 0])
+>>> nodes[0].name = 'Changed'
+Traceback (most recent call last):
+    ...
+AttributeError: Genre nodes are read-only.
+
 # Model Instance Methods ######################################################
 >>> action = Genre.objects.get(pk=action.pk)
 >>> [g.name for g in action.get_ancestors()]
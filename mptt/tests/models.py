@@ -1,6 +1,7 @@
 from django.db import models
 
 import mptt
+from mptt.routers import ModuloTreeRouter
 
 class Category(models.Model):
     name = models.CharField(max_length=50)
@@ -19,9 +20,48 @@ class Genre(models.Model):
     def __unicode__(self):
         return self.name
 
+class Folder(models.Model):
+    name = models.CharField(max_length=50)
+    visibility = models.CharField(max_length=10, null=True, blank=True)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
+class Game(models.Model):
+    name = models.CharField(max_length=50)
+    genre = models.ForeignKey(Genre, related_name='games')
+    price = models.PositiveIntegerField()
+
+    def __unicode__(self):
+        return self.name
+
+class Compilation(models.Model):
+    name = models.CharField(max_length=50)
+    genres = models.ManyToManyField(Genre, related_name='compilations')
+    stock = models.PositiveIntegerField()
+
+    def __unicode__(self):
+        return self.name
+
+class Comment(models.Model):
+    name = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, null=True, blank=True)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
 class Insert(models.Model):
     parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
 
+class Menu(models.Model):
+    name = models.CharField(max_length=50)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
 class MultiOrder(models.Model):
     name = models.CharField(max_length=50)
     size = models.PositiveIntegerField()
@@ -41,14 +81,46 @@ class OrderedInsertion(models.Model):
     def __unicode__(self):
         return self.name
 
+class Outline(models.Model):
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+class Page(models.Model):
+    site = models.PositiveIntegerField()
+    name = models.CharField(max_length=50)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
+class Region(models.Model):
+    name = models.CharField(max_length=50)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
+class Thread(models.Model):
+    name = models.CharField(max_length=50)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
 class Tree(models.Model):
     parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
 
 mptt.register(Category)
+mptt.register(Comment, defer_insertion=True)
+mptt.register(Folder)
 mptt.register(Genre)
 mptt.register(Insert)
+mptt.register(Menu, tree_id_gap=10)
 mptt.register(MultiOrder, order_insertion_by=['name', 'size', 'date'])
 mptt.register(Node, left_attr='does', right_attr='zis', level_attr='madness',
               tree_id_attr='work')
 mptt.register(OrderedInsertion, order_insertion_by=['name'])
+mptt.register(Outline, update_chunk_size=3)
+mptt.register(Page, tree_scope_attr='site')
+mptt.register(Region, tree_router=ModuloTreeRouter(['default', 'other']))
+mptt.register(Thread, lazy_delete=True, compact_threshold=5)
 mptt.register(Tree)
@@ -21,6 +21,23 @@ DATABASE_NAME = os.path.join(DIRNAME, 'mptt.db')
 #DATABASE_HOST = 'localhost'
 #DATABASE_PORT = '5432'
 
+# Django >= 1.2 - a second database, set up like the default database, is
+# used to test multiple database support.
+DATABASES = {}
+for alias, suffix in (('default', ''), ('other', '_other')):
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.%s' % DATABASE_ENGINE,
+        'NAME': DATABASE_NAME + suffix,
+        'USER': globals().get('DATABASE_USER', ''),
+        'PASSWORD': globals().get('DATABASE_PASSWORD', ''),
+        'HOST': globals().get('DATABASE_HOST', ''),
+        'PORT': globals().get('DATABASE_PORT', ''),
+    }
+
+DATABASE_ROUTERS = ['mptt.routers.TreeShardRouter']
+
+ROOT_URLCONF = 'mptt.tests.urls'
+
 INSTALLED_APPS = (
     'mptt',
     'mptt.tests',
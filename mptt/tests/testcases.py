@@ -1,10 +1,27 @@
+import csv
 import re
+import sys
+from StringIO import StringIO
 
+from django import template
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.utils import simplejson
+
+try:
+    from django.db import router
+except ImportError:
+    # Django < 1.2 only supports a single database
+    router = None
 
 from mptt.exceptions import InvalidMove
+from mptt.forms import TreeNodeChoiceField
 from mptt.tests import doctests
-from mptt.tests.models import Category, Genre
+from mptt.utils import drilldown_tree_for_node, tree_item_iterator
+from mptt.tests.models import Category, Comment, Compilation, Folder, Game, \
+    Genre, Menu, OrderedInsertion, Outline, Page, Region, Thread, Tree
 
 def get_tree_details(nodes):
     """Creates pertinent tree details for the given list of nodes."""
@@ -26,6 +43,49 @@ def tree_details(text):
     """
     return leading_whitespace_re.sub('', text)
 
+def create_tree(model, nodes):
+    """
+    Creates instances of the given ``model`` from a list of ``(name,
+    parent name)`` tuples, in order. A dictionary of other field values
+    may be given as a third item.
+    """
+    for node in nodes:
+        name, parent = node[:2]
+        if parent is not None:
+            parent = model._default_manager.get(name=parent)
+        kwargs = dict(name=name, parent=parent)
+        if len(node) > 2:
+            kwargs.update(node[2])
+        model._default_manager.create(**kwargs)
+
+def count_queries(func, *args, **kwargs):
+    """
+    Calls the given function, returning its result and a list of the
+    queries it performed.
+    """
+    old_debug = settings.DEBUG
+    settings.DEBUG = True
+    connection.queries = []
+    try:
+        result = func(*args, **kwargs)
+        queries = connection.queries
+    finally:
+        settings.DEBUG = old_debug
+    return result, queries
+
+def command_output(*args, **kwargs):
+    """
+    Calls the management command with the given arguments, returning what
+    it wrote to standard output.
+    """
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        call_command(*args, **kwargs)
+    finally:
+        sys.stdout = stdout
+    return output.getvalue()
+
 # genres.json defines the following tree structure
 #
 # 1 - 1 0 1 16   action
@@ -299,6 +359,1227 @@ class DeletionTestCase(TestCase):
                                          9 8 1 2 9 10
                                          10 8 1 2 11 12"""))
 
+    def test_delete_queryset(self):
+        Category(name='Following root').insert_at(Category.objects.get(id=1),
+                                                  'right', commit=True)
+        # Node 6 is covered by the deletion of its parent
+        Category.tree.filter(id__in=[3, 5, 6, 10, 11]).delete()
+        self.assertEqual(get_tree_details(Category.tree.all()),
+                         tree_details("""1 - 1 0 1 10
+                                         2 1 1 1 2 5
+                                         4 2 1 2 3 4
+                                         8 1 1 1 6 9
+                                         9 8 1 2 7 8"""))
+        self.assertEqual(Category.tree.verify_trees(), [])
+
+        Category.tree.none().delete()
+        Category.tree.filter(parent__isnull=True).delete()
+        self.assertEqual(Category.tree.count(), 0)
+
+class BulkInsertionTestCase(TestCase):
+    """
+    Tests that lists of new nodes and subtrees are inserted under a
+    parent at once.
+    """
+    fixtures = ['genres.json']
+
+    def test_insert_children(self):
+        rpg = Genre.objects.get(id=9)
+        mmorpg = Genre(name='mmorpg')
+        fantasy = Genre(name='mmorpg_fantasy')
+        Genre.tree.insert_children(rpg, [Genre(name='jrpg'),
+                                         (mmorpg, [fantasy])])
+        self.assertEqual(rpg.rght, 12)
+        self.assertEqual((mmorpg.pk, fantasy.pk, fantasy.parent_id),
+                         (13, 14, 13))
+        self.assertEqual(get_tree_details(Genre.tree.filter(tree_id=2)),
+                         tree_details("""9 - 2 0 1 12
+                                         10 9 2 1 2 3
+                                         11 9 2 1 4 5
+                                         12 9 2 1 6 7
+                                         13 9 2 1 8 11
+                                         14 13 2 2 9 10"""))
+
+        Genre.tree.insert_children(Genre.objects.get(id=1),
+                                   [Genre(name='beat_em_up')],
+                                   position='first-child', batch_size=1)
+        self.assertEqual(get_tree_details(Genre.tree.filter(tree_id=1)[:3]),
+                         tree_details("""1 - 1 0 1 18
+                                         15 1 1 1 2 3
+                                         2 1 1 1 4 11"""))
+        self.assertEqual(Genre.tree.verify_trees(), [])
+
+    def test_saved_nodes(self):
+        details = get_tree_details(Genre.tree.all())
+        self.assertRaises(ValueError, Genre.tree.insert_children,
+                          Genre.objects.get(id=9), [Genre.objects.get(id=2)])
+        # Nested nodes are also checked before any space is made
+        self.assertRaises(ValueError, Genre.tree.insert_children,
+                          Genre.objects.get(id=9),
+                          [(Genre(name='mmorpg'), [Genre.objects.get(id=3)])])
+        self.assertEqual(get_tree_details(Genre.tree.all()), details)
+        self.assertEqual(Genre.tree.verify_trees(), [])
+
+class BatchMovementTestCase(TestCase):
+    """
+    Tests that batches of moves are validated and applied at once.
+    """
+    fixtures = ['genres.json']
+
+    def test_move_nodes(self):
+        platformer_3d = Genre.objects.get(id=4)
+        trpg = Genre.objects.get(id=11)
+        Genre.tree.move_nodes([
+            (platformer_3d, Genre.objects.get(id=6), 'first-child'),
+            (Genre.objects.get(id=10), Genre.objects.get(id=2), 'left'),
+            (trpg, Genre.objects.get(id=10), 'last-child'),
+        ])
+        self.assertEqual(get_tree_details([platformer_3d, trpg]),
+                         tree_details("""4 6 1 2 13 14
+                                         11 10 1 2 3 4"""))
+        self.assertEqual(get_tree_details(Genre.tree.all()),
+                         tree_details("""1 - 1 0 1 20
+                                         10 1 1 1 2 5
+                                         11 10 1 2 3 4
+                                         2 1 1 1 6 11
+                                         3 2 1 2 7 8
+                                         5 2 1 2 9 10
+                                         6 1 1 1 12 19
+                                         4 6 1 2 13 14
+                                         7 6 1 2 15 16
+                                         8 6 1 2 17 18
+                                         9 - 2 0 1 2"""))
+
+    def test_invalid_moves(self):
+        before = get_tree_details(Genre.tree.all())
+        # The second move is only invalid once the first has been made
+        self.assertRaises(InvalidMove, Genre.tree.move_nodes, [
+            (Genre.objects.get(id=2), Genre.objects.get(id=6), 'last-child'),
+            (Genre.objects.get(id=6), Genre.objects.get(id=3), 'last-child'),
+        ])
+        self.assertRaises(InvalidMove, Genre.tree.move_nodes, [
+            (Genre.objects.get(id=9), Genre.objects.get(id=1), 'last-child'),
+        ])
+        self.assertEqual(get_tree_details(Genre.tree.all()), before)
+
+class PropagationTestCase(TestCase):
+    """
+    Tests that field values are set for whole subtrees with a single
+    query.
+    """
+    fixtures = ['categories.json']
+
+    def test_propagate(self):
+        node = Category.objects.get(id=5)
+        self.assertEqual(Category.tree.propagate(node, 'name', 'hidden'), 3)
+        self.assertEqual(node.name, 'hidden')
+        self.assertEqual([c.pk for c in Category.tree.filter(name='hidden')],
+                         [5, 6, 7])
+        self.assertEqual(Category.tree.propagate(
+            Category.objects.get(id=8), 'name', 'hidden',
+            include_self=False), 2)
+        self.assertEqual(Category.tree.propagate(
+            Category.objects.get(id=9), 'name', 'hidden',
+            include_self=False), 0)
+        self.assertEqual([c.pk for c in Category.tree.filter(name='hidden')],
+                         [5, 6, 7, 9, 10])
+        self.assertEqual(Category.tree.verify_trees(), [])
+
+    def test_deferred_nodes(self):
+        root = Comment.objects.create(name='root')
+        Comment.objects.create(name='child', parent=root)
+        self.assertEqual(Comment.tree.propagate(root, 'name', 'hidden'), 2)
+        self.assertEqual(Comment.tree.filter(name='hidden').count(), 2)
+
+    def test_tree_fields(self):
+        node = Category.objects.get(id=5)
+        for field in ['parent', 'lft', 'rght', 'tree_id', 'level']:
+            self.assertRaises(ValueError, Category.tree.propagate, node,
+                              field, 1)
+
+class InheritanceTestCase(TestCase):
+    """
+    Tests that values inherited from the nearest ancestor which has one
+    are resolved for many nodes at once.
+    """
+    def setUp(self):
+        create_tree(Folder, [('a', None, {'visibility': 'public'}),
+                             ('a1', 'a'),
+                             ('a1a', 'a1', {'visibility': 'private'}),
+                             ('a1a1', 'a1a'), ('a2', 'a'), ('b', None),
+                             ('b1', 'b')])
+
+    def test_resolve_inherited(self):
+        folders = Folder.tree.exclude(name='a')
+        values = Folder.tree.resolve_inherited(folders, 'visibility')
+        self.assertEqual(dict([(Folder.objects.get(pk=pk).name, value)
+                               for pk, value in values.items()]),
+                         {'a1': 'public', 'a1a': 'private',
+                          'a1a1': 'private', 'a2': 'public', 'b': None,
+                          'b1': None})
+        self.assertEqual(Folder.tree.resolve_inherited(
+            Folder.tree.nodes(['visibility'], Folder.tree.filter(name='a2')),
+            'visibility'), {5: 'public'})
+        self.assertEqual(Folder.tree.resolve_inherited([], 'visibility'), {})
+
+    def test_deferred_nodes(self):
+        root = Comment.objects.create(name='root', status='approved')
+        child = Comment.objects.create(name='child', parent=root)
+        # The deferred child is positioned before its ancestors are found
+        self.assertEqual(Comment.tree.resolve_inherited([child, root],
+                                                        'status'),
+                         {root.pk: 'approved', child.pk: 'approved'})
+
+class DepthLimitTestCase(TestCase):
+    """
+    Tests that descendants and nodes can be limited to certain levels.
+    """
+    fixtures = ['genres.json']
+
+    def test_get_descendants(self):
+        action = Genre.objects.get(id=1)
+        self.assertEqual([g.pk for g in action.get_descendants(max_depth=1)],
+                         [2, 6])
+        self.assertEqual([g.pk for g in action.get_descendants(
+                             include_self=True, max_depth=1)], [1, 2, 6])
+        self.assertEqual([g.pk for g in action.get_descendants(max_depth=2)],
+                         [2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(list(action.get_descendants(max_depth=0)), [])
+        self.assertEqual([g.pk for g in action.get_descendants(
+                             include_self=True, max_depth=0)], [1])
+
+    def test_at_level(self):
+        self.assertEqual([g.pk for g in Genre.tree.at_level(0)], [1, 9])
+        self.assertEqual([g.pk for g in Genre.tree.at_level(1)], [2, 6, 10, 11])
+        self.assertEqual([g.pk for g in Genre.tree.at_level(1, tree_id=2)],
+                         [10, 11])
+
+    def test_drilldown_tree_for_node(self):
+        platformer = Genre.objects.get(id=2)
+        self.assertEqual([g.pk for g in drilldown_tree_for_node(
+                             Genre.objects.get(id=1), Game, 'genre',
+                             'game_count', max_depth=2)],
+                         [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual([g.pk for g in drilldown_tree_for_node(platformer,
+                                                                max_depth=2)],
+                         [1, 2, 3, 4, 5])
+
+    def test_template_tags(self):
+        context = template.Context({'genre': Genre.objects.get(id=1)})
+        template.Template('{% load mptt_tags %}'
+                          '{% full_tree_for_model tests.Genre as genres max_level 0 %}'
+                          '{% drilldown_tree_for_node genre as drilldown max_depth 2 %}'
+                          '{% drilldown_tree_for_node genre as counted count tests.Game.genre in game_count max_depth 2 %}'
+                          ).render(context)
+        self.assertEqual([g.pk for g in context['genres']], [1, 9])
+        self.assertEqual([g.pk for g in context['drilldown']],
+                         [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual([getattr(g, 'game_count', None)
+                          for g in context['counted']], [None] + [0] * 7)
+
+class ArithmeticTestCase(TestCase):
+    """
+    Tests that questions which can be answered from tree fields alone
+    don't query the database.
+    """
+    fixtures = ['genres.json']
+
+    def assertNumQueries(self, num, func, *args, **kwargs):
+        result, queries = count_queries(func, *args, **kwargs)
+        self.assertEqual(len(queries), num)
+        return result
+
+    def test_containment(self):
+        action, platformer, platformer_2d, rpg = [Genre.objects.get(id=id)
+                                                  for id in (1, 2, 3, 9)]
+        self.assertTrue(self.assertNumQueries(
+            0, platformer_2d.is_descendant_of, action))
+        self.assertTrue(self.assertNumQueries(
+            0, action.is_ancestor_of, platformer_2d))
+        self.assertFalse(action.is_descendant_of(platformer))
+        self.assertFalse(platformer.is_descendant_of(rpg))
+        self.assertFalse(platformer.is_descendant_of(platformer))
+        self.assertTrue(platformer.is_descendant_of(platformer,
+                                                    include_self=True))
+        self.assertTrue(platformer.is_ancestor_of(platformer,
+                                                  include_self=True))
+        nodes = dict([(node.pk, node) for node in Genre.tree.nodes()])
+        self.assertTrue(nodes[3].is_descendant_of(nodes[1]))
+        self.assertFalse(nodes[3].is_ancestor_of(nodes[1]))
+
+    def test_leaf_nodes(self):
+        self.assertEqual([g.pk for g in Genre.tree.leaf_nodes()],
+                         [3, 4, 5, 7, 8, 10, 11])
+        self.assertEqual([g.pk for g in Genre.tree.filter(tree_id=2
+                                                          ).leaf_nodes()],
+                         [10, 11])
+        action = Genre.objects.get(id=1)
+        self.assertEqual([g.pk for g in action.get_leafnodes()],
+                         [3, 4, 5, 7, 8])
+        platformer_2d = Genre.objects.get(id=3)
+        self.assertEqual(list(platformer_2d.get_leafnodes()), [])
+        self.assertEqual([g.pk for g in platformer_2d.get_leafnodes(
+                             include_self=True)], [3])
+
+    def test_count(self):
+        action = Genre.objects.get(id=1)
+        self.assertEqual(self.assertNumQueries(
+            0, action.get_descendants().count), 7)
+        self.assertEqual(self.assertNumQueries(
+            0, action.get_descendants(include_self=True).count), 8)
+        self.assertEqual(self.assertNumQueries(
+            1, action.get_descendants().filter(level=1).count), 2)
+        self.assertEqual(self.assertNumQueries(
+            1, action.get_descendants(max_depth=1).count), 2)
+
+    def test_lazy_deletion(self):
+        create_tree(Thread, [('a', None), ('a1', 'a'), ('a1a', 'a1'),
+                             ('a2', 'a')])
+        Thread.objects.get(name='a1a').delete()
+        self.assertEqual([t.name for t in Thread.tree.leaf_nodes()],
+                         ['a1', 'a2'])
+        a = Thread.objects.get(name='a')
+        self.assertEqual(a.get_descendants().count(), 2)
+
+class CopyingTestCase(TestCase):
+    """
+    Tests that subtrees are copied with set-based queries.
+    """
+    fixtures = ['categories.json']
+
+    def test_copy_subtree(self):
+        copied_pks = {}
+        copy = Category.tree.copy_subtree(Category.objects.get(id=2),
+            Category.objects.get(id=8), overrides={'name': 'Copy'},
+            copy_related=copied_pks.update)
+        self.assertEqual(get_tree_details([copy]), '11 8 1 2 19 24')
+        self.assertEqual(copied_pks, {2: 11, 3: 12, 4: 13})
+        self.assertEqual(get_tree_details(Category.tree.all()),
+                         tree_details("""1 - 1 0 1 26
+                                         2 1 1 1 2 7
+                                         3 2 1 2 3 4
+                                         4 2 1 2 5 6
+                                         5 1 1 1 8 13
+                                         6 5 1 2 9 10
+                                         7 5 1 2 11 12
+                                         8 1 1 1 14 25
+                                         9 8 1 2 15 16
+                                         10 8 1 2 17 18
+                                         11 8 1 2 19 24
+                                         12 11 1 3 20 21
+                                         13 11 1 3 22 23"""))
+        self.assertEqual([c.name for c in Category.objects.filter(id__gt=10)],
+                         [u'Copy'] * 3)
+
+    def test_copy_to_new_tree(self):
+        Category.tree.copy_subtree(Category.objects.get(id=5), None)
+        Category.tree.copy_subtree(Category.objects.get(id=1),
+                                   Category.objects.get(id=1), 'left')
+        self.assertEqual(get_tree_details(Category.tree.filter(tree_id=3)),
+                         tree_details("""11 - 3 0 1 6
+                                         12 11 3 1 2 3
+                                         13 11 3 1 4 5"""))
+        self.assertEqual([c.name for c in Category.tree.root_nodes()],
+                         [u'PC & Video Games', u'PC & Video Games',
+                          u'Xbox 360'])
+        self.assertEqual(Category.tree.verify_trees(), [])
+
+    def test_copy_into_own_subtree(self):
+        self.assertRaises(InvalidMove, Category.tree.copy_subtree,
+                          Category.objects.get(id=1),
+                          Category.objects.get(id=2))
+
+class ChunkedUpdateTestCase(TestCase):
+    """
+    Tests that shifting edge indicators in chunks gives the same trees as
+    shifting them with single queries.
+    """
+    def assertSameTrees(self):
+        self.assertEqual(get_tree_details(Outline.tree.all()),
+                         get_tree_details(Tree.tree.all()))
+        self.assertEqual(Outline.tree.verify_trees(), [])
+
+    def test_chunked_updates(self):
+        for model in (Outline, Tree):
+            parents = [None, 1, 2, 2, 1, 5, 5, 1, None, 9, 10]
+            for parent in parents:
+                node = model()
+                if parent is not None:
+                    node.parent = model.objects.get(pk=parent)
+                node.save()
+        self.assertSameTrees()
+        moves = [
+            # Within a tree, to the right and to the left
+            (3, 7, 'right'),
+            (5, 2, 'first-child'),
+            (4, 8, 'last-child'),
+            # Between trees
+            (5, 10, 'left'),
+            (9, 8, 'last-child'),
+        ]
+        for pk, target, position in moves:
+            for model in (Outline, Tree):
+                model.tree.move_node(model.objects.get(pk=pk),
+                                     model.objects.get(pk=target), position)
+            self.assertSameTrees()
+        for model in (Outline, Tree):
+            model.objects.get(pk=2).delete()
+        self.assertSameTrees()
+        for model in (Outline, Tree):
+            model.tree.filter(pk__in=[3, 4, 6, 10]).delete()
+        self.assertSameTrees()
+        self.assertEqual(Outline.tree.count(), 5)
+
+class DeferredInsertionTestCase(TestCase):
+    """
+    Tests that the insertion of new child nodes can be deferred and that
+    deferred nodes are positioned when they are flushed.
+    """
+    def setUp(self):
+        create_tree(Comment, [('a', None), ('a1', 'a'), ('b', None)])
+        self.assertEqual(Comment.tree.flush_pending(), 1)
+        create_tree(Comment, [('a2', 'a'), ('a1a', 'a1'), ('a2a', 'a2'),
+                              ('b1', 'b'), ('a3', 'a')])
+
+    def test_deferred_nodes(self):
+        self.assertEqual(get_tree_details(Comment.objects.filter(
+                             name__in=['a2', 'a2a', 'b1'])),
+                         tree_details("""4 1 1 1 0 0
+                                         6 4 1 2 0 0
+                                         7 3 2 1 0 0"""))
+        # The last consistent state is read until the tree is flushed
+        root = Comment.objects.get(name='a')
+        self.assertEqual([c.name for c in root.get_descendants()], ['a1'])
+        self.assertEqual(Comment.tree.verify_trees(), [])
+        self.assertEqual(Comment.tree.check_tree_integrity(), {})
+        self.assertEqual(Comment.tree.flush_pending(1), 4)
+        self.assertEqual(get_tree_details(Comment.tree.all()),
+                         tree_details("""1 - 1 0 1 12
+                                         2 1 1 1 2 5
+                                         5 2 1 2 3 4
+                                         4 1 1 1 6 9
+                                         6 4 1 2 7 8
+                                         8 1 1 1 10 11
+                                         3 - 2 0 1 2"""))
+        # Tree 2 still has a deferred node
+        self.assertEqual(Comment.tree.verify_trees(), [])
+        self.assertEqual(Comment.tree.check_tree_integrity(), {})
+        self.assertEqual(Comment.tree.flush_pending(), 1)
+        self.assertEqual(Comment.tree.verify_trees(), [])
+        self.assertEqual(Comment.tree.check_tree_integrity(), {})
+        self.assertEqual(Comment.tree.flush_pending(), 0)
+
+    def test_pending_reads(self):
+        # Deferred nodes are left out of trees until they are positioned
+        self.assertEqual(get_tree_details(Comment.tree.all()),
+                         tree_details("""1 - 1 0 1 4
+                                         2 1 1 1 2 3
+                                         3 - 2 0 1 2"""))
+        self.assertEqual([(c.name, s['new_level'], s['closed_levels'])
+                          for c, s in tree_item_iterator(Comment.tree.all())],
+                         [('a', True, []), ('a1', True, [1]),
+                          ('b', False, [0])])
+        self.assertEqual([n.name for n in Comment.tree.nodes(['name'])],
+                         ['a', 'a1', 'b'])
+        self.assertEqual(list(Comment.tree.filter(name='a2')), [])
+        a2 = Comment.objects.get(name='a2')
+        self.assertEqual(a2.get_descendant_count(), 0)
+        self.assertTrue(a2.is_leaf_node())
+
+    def test_pending_verification(self):
+        # Deferred nodes don't make their trees invalid
+        self.assertEqual(Comment.tree.verify_trees(), [])
+        self.assertEqual(Comment.tree.check_tree_integrity(), {})
+        self.assertEqual(Comment.tree.check_tree_integrity(tree_ids=[1, 2]),
+                         {})
+        output = command_output('verifytrees', 'tests.Comment', repair=True)
+        self.assertTrue('tests.Comment: all trees are valid.' in output)
+        self.assertEqual(Comment.tree.flush_pending(), 5)
+
+    def test_operations_flush(self):
+        b1 = Comment.objects.get(name='b1')
+        Comment.tree.move_node(b1, Comment.objects.get(name='a2'))
+        self.assertEqual(get_tree_details([b1]), '7 4 1 2 9 10')
+        self.assertEqual(Comment.tree.verify_trees(), [])
+
+    def test_delete_deferred_node(self):
+        Comment.objects.get(name='a2').delete()
+        self.assertEqual(Comment.objects.filter(name='a2a').count(), 0)
+        Comment.tree.flush_pending()
+        self.assertEqual(get_tree_details(Comment.tree.filter(tree_id=1)),
+                         tree_details("""1 - 1 0 1 8
+                                         2 1 1 1 2 5
+                                         5 2 1 2 3 4
+                                         8 1 1 1 6 7"""))
+        self.assertEqual(Comment.tree.verify_trees(), [])
+
+    def test_command(self):
+        self.assertEqual(Comment.tree.verify_trees(), [])
+        self.assertEqual(Comment.tree.check_tree_integrity(), {})
+        output = command_output('flushpending', 'tests.Comment')
+        self.assertTrue('tests.Comment: positioned 5 deferred nodes.' in
+                        output)
+        self.assertEqual(Comment.tree.verify_trees(), [])
+        self.assertEqual(Comment.tree.check_tree_integrity(), {})
+
+class LazyDeletionTestCase(TestCase):
+    """
+    Tests that deleting nodes can leave gaps in trees which are closed by
+    compacting them.
+    """
+    def setUp(self):
+        create_tree(Thread, [('a', None), ('a1', 'a'), ('a1a', 'a1'),
+                             ('a2', 'a'), ('a2a', 'a2'), ('a3', 'a'),
+                             ('b', None), ('b1', 'b')])
+
+    def test_gaps(self):
+        Thread.objects.get(name='a1a').delete()
+        Thread.objects.get(name='a2a').delete()
+        self.assertEqual(get_tree_details(Thread.tree.all()),
+                         tree_details("""1 - 1 0 1 12
+                                         2 1 1 1 2 5
+                                         4 1 1 1 6 9
+                                         6 1 1 1 10 11
+                                         7 - 2 0 1 4
+                                         8 7 2 1 2 3"""))
+        self.assertEqual(Thread.tree.verify_trees(), [])
+        self.assertEqual(Thread.tree.check_tree_integrity(), {})
+        a1 = Thread.objects.get(name='a1')
+        self.assertEqual(a1.get_descendant_count(), 0)
+        self.assertTrue(a1.is_leaf_node())
+        self.assertEqual(list(a1.get_children()), [])
+        self.assertEqual(Thread.objects.get(name='a').get_descendant_count(), 3)
+
+        # Nodes can be inserted and moved as usual
+        Thread.objects.create(name='a1b', parent=a1)
+        Thread.tree.move_node(Thread.objects.get(name='a3'),
+                              Thread.objects.get(name='a2'))
+        self.assertEqual(Thread.tree.verify_trees(), [])
+
+        self.assertEqual(Thread.tree.compact_trees(), [1])
+        self.assertEqual(get_tree_details(Thread.tree.all()),
+                         tree_details("""1 - 1 0 1 10
+                                         2 1 1 1 2 5
+                                         9 2 1 2 3 4
+                                         4 1 1 1 6 9
+                                         6 4 1 2 7 8
+                                         7 - 2 0 1 4
+                                         8 7 2 1 2 3"""))
+        self.assertEqual(Thread.tree.compact_trees(), [])
+
+    def test_threshold(self):
+        Thread.objects.get(name='a1a').delete()
+        Thread.objects.get(name='a2a').delete()
+        self.assertFalse(Thread.tree.compact_tree(1, threshold=4))
+        # Deleting a third node leaves more gaps than the model's
+        # threshold, so its tree is compacted
+        Thread.objects.get(name='a3').delete()
+        self.assertEqual(get_tree_details(Thread.tree.filter(tree_id=1)),
+                         tree_details("""1 - 1 0 1 6
+                                         2 1 1 1 2 3
+                                         4 1 1 1 4 5"""))
+
+    def test_delete_queryset(self):
+        Thread.tree.filter(name__in=['a1', 'a1a']).delete()
+        self.assertEqual(get_tree_details(Thread.tree.filter(tree_id=1)),
+                         tree_details("""1 - 1 0 1 12
+                                         4 1 1 1 6 9
+                                         5 4 1 2 7 8
+                                         6 1 1 1 10 11"""))
+        self.assertEqual(Thread.tree.verify_trees(), [])
+        # Deleting another node leaves more gaps than the model's
+        # threshold, so its tree is compacted
+        Thread.tree.filter(name='a3').delete()
+        self.assertEqual(get_tree_details(Thread.tree.filter(tree_id=1)),
+                         tree_details("""1 - 1 0 1 6
+                                         4 1 1 1 2 5
+                                         5 4 1 2 3 4"""))
+
+    def test_command(self):
+        Thread.objects.get(name='b1').delete()
+        output = (command_output('compacttrees', 'tests.Thread') +
+                  command_output('compacttrees', 'tests.Thread'))
+        for message in ['tests.Thread: compacted trees: 2',
+                        'tests.Thread: no trees needed compacting.']:
+            self.assertTrue(message in output)
+
+class EstimateTestCase(TestCase):
+    """
+    Tests that estimates of the cost of tree operations match the rows
+    and queries the operations write.
+    """
+    fixtures = ['genres.json']
+
+    def get_rows(self, model):
+        rows = {}
+        for node in model._default_manager.all():
+            rows[node.pk] = get_tree_details([node])
+        return rows
+
+    def assertEstimate(self, model, op, node, target=None,
+                       position='last-child'):
+        estimate = model.tree.estimate(op, node, target, position)
+        rows = self.get_rows(model)
+        def perform():
+            if op == 'insert':
+                model.tree.insert_node(node, target, position, commit=True)
+            elif op == 'move':
+                model.tree.move_node(node, target, position)
+            else:
+                node.delete()
+        queries = count_queries(perform)[1]
+        queries = len([query for query in queries
+                       if not query['sql'].startswith('SELECT')])
+        new_rows = self.get_rows(model)
+        changed = len([pk for pk in rows if rows[pk] != new_rows.get(pk)])
+        changed += len([pk for pk in new_rows if pk not in rows])
+        self.assertEqual(estimate['rows'], changed)
+        if op != 'delete':
+            # Deleting also writes related objects
+            self.assertEqual(estimate['queries'], queries)
+
+    def test_estimates(self):
+        get = Genre.objects.get
+        self.assertEstimate(Genre, 'insert', Genre(name='Beat em up'),
+                            get(pk=2), 'first-child')
+        self.assertEstimate(Genre, 'insert', Genre(name='Puzzle'),
+                            get(pk=1), 'right')
+        self.assertEstimate(Genre, 'insert', Genre(name='Racing'))
+        self.assertEstimate(Genre, 'move', get(pk=5), get(pk=7), 'left')
+        self.assertEstimate(Genre, 'move', get(pk=3), get(pk=2), 'right')
+        self.assertEstimate(Genre, 'move', get(pk=8), get(pk=10), 'left')
+        self.assertEstimate(Genre, 'move', get(pk=9), get(pk=2))
+        self.assertEstimate(Genre, 'move', get(pk=6), None)
+        self.assertEstimate(Genre, 'move', get(pk=4), get(pk=1), 'left')
+        self.assertEstimate(Genre, 'move', get(pk=6), get(pk=1), 'right')
+        self.assertEstimate(Genre, 'delete', get(pk=2))
+        self.assertEqual(Genre.tree.verify_trees(), [])
+
+    def test_chunked_estimates(self):
+        parents = [None, 1, 2, 2, 1, 5, 5, 1, None, 9, 10]
+        for parent in parents:
+            node = Outline()
+            if parent is not None:
+                node.parent = Outline.objects.get(pk=parent)
+            node.save()
+        get = Outline.objects.get
+        self.assertEstimate(Outline, 'insert', Outline(), get(pk=2),
+                            'first-child')
+        self.assertEstimate(Outline, 'move', get(pk=3), get(pk=7), 'right')
+        self.assertEstimate(Outline, 'move', get(pk=5), get(pk=2),
+                            'first-child')
+        self.assertEstimate(Outline, 'move', get(pk=5), get(pk=10), 'left')
+        self.assertEstimate(Outline, 'move', get(pk=9), get(pk=8))
+        self.assertEstimate(Outline, 'delete', get(pk=2))
+        self.assertEqual(Outline.tree.verify_trees(), [])
+
+    def test_invalid_operation(self):
+        self.assertRaises(ValueError, Genre.tree.estimate, 'copy',
+                          Genre.objects.get(pk=1))
+
+class ReorderingTestCase(TestCase):
+    """
+    Tests that the children of a node are reordered in place.
+    """
+    fixtures = ['genres.json']
+
+    def test_reorder_children(self):
+        Genre.tree.reorder_children(Genre.objects.get(id=1), ['6', 2])
+        self.assertEqual(get_tree_details(Genre.tree.all()),
+                         tree_details("""1 - 1 0 1 16
+                                         6 1 1 1 2 7
+                                         7 6 1 2 3 4
+                                         8 6 1 2 5 6
+                                         2 1 1 1 8 15
+                                         3 2 1 2 9 10
+                                         4 2 1 2 11 12
+                                         5 2 1 2 13 14
+                                         9 - 2 0 1 6
+                                         10 9 2 1 2 3
+                                         11 9 2 1 4 5"""))
+        Genre.tree.reorder_children(Genre.objects.get(id=2), [4, 5, 3])
+        self.assertEqual(get_tree_details(Genre.objects.get(id=2).get_children()),
+                         tree_details("""4 2 1 2 9 10
+                                         5 2 1 2 11 12
+                                         3 2 1 2 13 14"""))
+        self.assertEqual(Genre.tree.verify_trees(), [])
+
+    def test_unmoved_children(self):
+        # 4 keeps its place between the children which swap around it
+        Genre.tree.reorder_children(Genre.objects.get(id=2), [5, 4, 3])
+        self.assertEqual(get_tree_details(Genre.objects.get(id=2).get_children()),
+                         tree_details("""5 2 1 2 3 4
+                                         4 2 1 2 5 6
+                                         3 2 1 2 7 8"""))
+        self.assertEqual(Genre.tree.verify_trees(), [])
+
+    def test_invalid_children(self):
+        parent = Genre.objects.get(id=1)
+        self.assertRaises(ValueError, Genre.tree.reorder_children, parent, [6])
+        self.assertRaises(ValueError, Genre.tree.reorder_children, parent,
+                          [6, 2, 10])
+        self.assertRaises(ValueError, Genre.tree.reorder_children, parent,
+                          [6, 6])
+
+class ResortTestCase(TestCase):
+    """
+    Tests that siblings are re-sorted after their ordering fields change.
+    """
+    def setUp(self):
+        create_tree(OrderedInsertion, [('a', None), ('b', 'a'), ('c', 'a'),
+                                       ('d', 'c'), ('e', 'c'), ('x', None)])
+        self.assertEqual(OrderedInsertion.tree.verify_trees(), [])
+        OrderedInsertion.objects.filter(name='b').update(name='z')
+        OrderedInsertion.objects.filter(name='d').update(name='f')
+
+    def get_names(self):
+        return ' '.join([n.name for n in OrderedInsertion.tree.all()])
+
+    def test_resort(self):
+        OrderedInsertion.tree.resort(tree_id=1)
+        self.assertEqual(self.get_names(), 'a c e f z x')
+        self.assertEqual(OrderedInsertion.tree.verify_trees(), [])
+        self.assertEqual(get_tree_details(OrderedInsertion.tree.filter(
+                                              tree_id=1)),
+                         tree_details("""1 - 1 0 1 10
+                                         3 1 1 1 2 7
+                                         5 3 1 2 3 4
+                                         4 3 1 2 5 6
+                                         2 1 1 1 8 9"""))
+
+    def test_resort_subtree(self):
+        OrderedInsertion.tree.resort(OrderedInsertion.objects.get(name='c'))
+        self.assertEqual(self.get_names(), 'a z c e f x')
+        OrderedInsertion.tree.resort()
+        self.assertEqual(self.get_names(), 'a c e f z x')
+
+    def test_unordered_model(self):
+        self.assertRaises(ValueError, Genre.tree.resort)
+
+class RelatedAggregateTestCase(TestCase):
+    """
+    Tests that related item aggregates are calculated correctly for
+    foreign key and many-to-many relations.
+    """
+    fixtures = ['genres.json']
+
+    def setUp(self):
+        Game.objects.create(name='Mario', genre_id=3, price=10)
+        Game.objects.create(name='Sonic', genre_id=3, price=20)
+        Game.objects.create(name='Ikaruga', genre_id=7, price=30)
+        Game.objects.create(name='Diablo', genre_id=10, price=40)
+        retro = Compilation.objects.create(name='Retro', stock=5)
+        retro.genres.add(Genre.objects.get(id=3), Genre.objects.get(id=7))
+        classics = Compilation.objects.create(name='Classics', stock=7)
+        classics.genres.add(Genre.objects.get(id=3), Genre.objects.get(id=10))
+
+    def test_foreign_key_aggregates(self):
+        genres = Genre.tree.add_related_aggregate(Genre.tree.root_nodes(),
+            Game, 'genre', 'total_price', 'SUM', 'price', cumulative=True)
+        self.assertEqual([(g.pk, g.total_price) for g in genres],
+                         [(1, 60), (9, 40)])
+        genres = Genre.tree.add_related_aggregate(
+            Genre.tree.filter(id__in=[1, 3]), Game, 'genre', 'game_count')
+        self.assertEqual([(g.pk, g.game_count) for g in genres],
+                         [(1, 0), (3, 2)])
+
+    def test_many_to_many_aggregates(self):
+        genres = Genre.tree.add_related_aggregate(Genre.tree.root_nodes(),
+            Compilation, 'genres', 'compilation_count', cumulative=True)
+        # Retro is related to two nodes under Action, but only counted once
+        self.assertEqual([(g.pk, g.compilation_count) for g in genres],
+                         [(1, 2), (9, 1)])
+        genres = Genre.tree.add_related_aggregate(Genre.tree.root_nodes(),
+            Compilation, 'genres', 'stock', 'SUM', 'stock', cumulative=True)
+        self.assertEqual([(g.pk, g.stock) for g in genres],
+                         [(1, 12), (9, 7)])
+        genres = Genre.tree.add_related_aggregate(Genre.tree.root_nodes(),
+            Compilation, 'genres', 'min_stock', 'MIN', 'stock', cumulative=True)
+        self.assertEqual([(g.pk, g.min_stock) for g in genres],
+                         [(1, 5), (9, 7)])
+
+    def test_invalid_aggregates(self):
+        self.assertRaises(ValueError, Genre.tree.add_related_aggregate,
+                          Genre.tree.all(), Game, 'genre', 'x', 'MEDIAN')
+        self.assertRaises(ValueError, Genre.tree.add_related_aggregate,
+                          Genre.tree.all(), Game, 'genre', 'x', 'SUM')
+
+class ImportTestCase(TestCase):
+    """
+    Tests that imported trees have the appropriate tree fields.
+    """
+    fixtures = ['genres.json']
+
+    def test_import_nested(self):
+        Genre.tree.import_nested(StringIO("""[
+            {"pk": 20, "name": "Puzzle", "children": [
+                {"pk": 21, "name": "Falling Blocks", "children": [
+                    {"pk": 22, "name": "Tetris-like"}]},
+                {"pk": 23, "name": "Physics"}]},
+            {"pk": 24, "name": "Racing"}]"""), batch_size=2)
+        self.assertEqual(get_tree_details(Genre.tree.filter(tree_id__gt=2)),
+                         tree_details("""20 - 3 0 1 8
+                                         21 20 3 1 2 5
+                                         22 21 3 2 3 4
+                                         23 20 3 1 6 7
+                                         24 - 4 0 1 2"""))
+        self.assertEqual(Genre.objects.get(pk=22).name, 'Tetris-like')
+
+    def test_import_adjacency(self):
+        rows = csv.DictReader(StringIO('id,parent_id,name\n'
+                                       '30,31,Strategy Child\n'
+                                       '31,,Strategy\n'
+                                       '32,30,Grandchild\n'
+                                       '33,31,Second Child\n'))
+        Genre.tree.import_adjacency(rows)
+        self.assertEqual(get_tree_details(Genre.tree.filter(tree_id__gt=2)),
+                         tree_details("""31 - 3 0 1 8
+                                         30 31 3 1 2 5
+                                         32 30 3 2 3 4
+                                         33 31 3 1 6 7"""))
+
+    def test_orphaned_rows(self):
+        rows = csv.DictReader(StringIO('id,parent_id,name\n'
+                                       '30,,Strategy\n'
+                                       '31,40,Orphan\n'
+                                       '32,41,Other Orphan\n'
+                                       '33,31,Orphan Child\n'))
+        try:
+            Genre.tree.import_adjacency(rows)
+        except ValueError, e:
+            self.assertTrue('40, 41' in str(e))
+        else:
+            self.fail('Orphaned rows were not reported.')
+        self.assertEqual(Genre.objects.filter(pk__gte=30).count(), 0)
+
+    def test_import_requires_primary_keys(self):
+        self.assertRaises(ValueError, Genre.tree.import_nested,
+                          [{'name': 'Puzzle'}])
+
+class VerificationTestCase(TestCase):
+    """
+    Tests that invalid trees are detected and repaired.
+    """
+    fixtures = ['genres.json']
+
+    def test_valid_trees(self):
+        self.assertEqual(Genre.tree.verify_trees(), [])
+
+    def test_invalid_trees(self):
+        # Wrong level
+        Genre.objects.filter(id=7).update(level=1)
+        self.assertEqual(Genre.tree.verify_trees(), [1])
+        # Partially overlapping siblings in another tree
+        Genre.objects.filter(id=10).update(rght=4)
+        Genre.objects.filter(id=11).update(lft=3)
+        self.assertEqual(Genre.tree.verify_trees(), [1, 2])
+
+        Genre.tree.rebuild_tree(1)
+        Genre.tree.rebuild_tree(2)
+        self.assertEqual(Genre.tree.verify_trees(), [])
+        self.assertEqual(get_tree_details(Genre.tree.all()),
+                         tree_details("""1 - 1 0 1 16
+                                         2 1 1 1 2 9
+                                         3 2 1 2 3 4
+                                         4 2 1 2 5 6
+                                         5 2 1 2 7 8
+                                         6 1 1 1 10 15
+                                         7 6 1 2 11 12
+                                         8 6 1 2 13 14
+                                         9 - 2 0 1 6
+                                         10 9 2 1 2 3
+                                         11 9 2 1 4 5"""))
+
+    def test_rebuild_follows_parents(self):
+        # A node which was loaded with the wrong tree id
+        Genre.objects.filter(id=11).update(tree_id=1, lft=17, rght=18)
+        self.assertEqual(Genre.tree.verify_trees(), [1, 2])
+        Genre.tree.rebuild_tree(2)
+        Genre.tree.rebuild_tree(1)
+        self.assertEqual(Genre.tree.verify_trees(), [])
+        self.assertEqual(get_tree_details([Genre.objects.get(id=11)]),
+                         '11 9 2 1 4 5')
+
+    def test_command(self):
+        Genre.objects.filter(id=7).update(level=1)
+        output = (command_output('verifytrees', 'tests.Genre') +
+                  command_output('verifytrees', 'tests.Genre', repair=True) +
+                  command_output('verifytrees', 'tests.Genre'))
+        for message in ['tests.Genre: invalid trees: 1',
+                        'tests.Genre: rebuilt trees: 1',
+                        'tests.Genre: all trees are valid.']:
+            self.assertTrue(message in output)
+
+class IntegrityTestCase(TestCase):
+    """
+    Tests that the integrity checker describes what is wrong with each
+    invalid tree.
+    """
+    fixtures = ['genres.json']
+
+    def test_valid_trees(self):
+        self.assertEqual(Genre.tree.check_tree_integrity(), {})
+        self.assertEqual(Genre.tree.check_tree_integrity(tree_ids=[1, 2],
+                                                          chunk_size=2), {})
+
+    def test_gaps_and_overlaps(self):
+        Genre.objects.filter(id=1).update(rght=17)
+        Genre.objects.filter(id=8).update(lft=12)
+        self.assertEqual(Genre.tree.check_tree_integrity(chunk_size=3), {
+            1: [u'Node 8 overlaps the node before it.',
+                u'Edge indicators 13 to 13 are unused before the right edge of node 8.',
+                u'Edge indicators 16 to 16 are unused before the right edge of node 1.'],
+        })
+
+    def test_parents_and_levels(self):
+        Genre.objects.filter(id=7).update(parent=2)
+        Genre.objects.filter(id=8).update(level=1)
+        Genre.objects.filter(id=11).update(parent=None)
+        self.assertEqual(Genre.tree.check_tree_integrity(tree_ids=[1, 2]), {
+            1: [u'Node 7 is not enclosed by its parent, node 2.',
+                u'Node 8 has a level of 1 instead of 2.'],
+            2: [u'Root node 11 is enclosed by node 9.'],
+        })
+
+    def test_command(self):
+        Genre.objects.filter(id=8).update(level=1)
+        output = command_output('verifytrees', 'tests.Genre', details=True)
+        for message in ['tests.Genre: invalid trees: 1',
+                        'Tree 1: Node 8 has a level of 1 instead of 2.']:
+            self.assertTrue(message in output)
+
+class ScopeTestCase(TestCase):
+    """
+    Tests that trees registered with a scope are numbered and reordered
+    independently within each scope.
+    """
+    def get_tree_details(self, site):
+        return get_tree_details(Page.tree.filter(site=site))
+
+    def setUp(self):
+        for site in (1, 2):
+            home = Page.objects.create(site=site, name='home')
+            Page.objects.create(site=site, name='about')
+            Page.objects.create(site=site, name='news', parent=home)
+
+    def test_tree_ids(self):
+        self.assertEqual(self.get_tree_details(1),
+                         tree_details("""1 - 1 0 1 4
+                                         3 1 1 1 2 3
+                                         2 - 2 0 1 2"""))
+        self.assertEqual(self.get_tree_details(2),
+                         tree_details("""4 - 1 0 1 4
+                                         6 4 1 1 2 3
+                                         5 - 2 0 1 2"""))
+
+    def test_root_ordering(self):
+        # Inserting and moving roots only renumbers trees in their scope
+        contact = Page(site=1, name='contact')
+        contact.insert_at(Page.objects.get(pk=1), 'left', commit=True)
+        Page.objects.get(pk=2).move_to(Page.objects.get(pk=1), 'left')
+        self.assertEqual(self.get_tree_details(1),
+                         tree_details("""7 - 1 0 1 2
+                                         2 - 2 0 1 2
+                                         1 - 3 0 1 4
+                                         3 1 3 1 2 3"""))
+        self.assertEqual(self.get_tree_details(2),
+                         tree_details("""4 - 1 0 1 4
+                                         6 4 1 1 2 3
+                                         5 - 2 0 1 2"""))
+        self.assertEqual([p.pk for p in Page.objects.get(pk=2).get_siblings()],
+                         [7, 1])
+        self.assertEqual(Page.objects.get(pk=7).get_next_sibling().pk, 2)
+        self.assertEqual(Page.tree.root_node(1, scope=2).pk, 4)
+
+    def test_children_take_parent_scope(self):
+        page = Page(site=2, name='archive', parent=Page.objects.get(pk=3))
+        page.save()
+        self.assertEqual(page.site, 1)
+        self.assertEqual(self.get_tree_details(1),
+                         tree_details("""1 - 1 0 1 6
+                                         3 1 1 1 2 5
+                                         7 3 1 2 3 4
+                                         2 - 2 0 1 2"""))
+        self.assertEqual([p.pk for p in page.get_ancestors()], [1, 3])
+        self.assertEqual([p.pk for p in Page.objects.get(pk=4).get_descendants()],
+                         [6])
+
+    def test_moves_between_scopes(self):
+        self.assertRaises(InvalidMove, Page.tree.move_node,
+                          Page.objects.get(pk=3), Page.objects.get(pk=5))
+
+    def test_deletion(self):
+        Page.objects.get(pk=3).delete()
+        self.assertEqual(self.get_tree_details(1),
+                         tree_details("""1 - 1 0 1 2
+                                         2 - 2 0 1 2"""))
+        self.assertEqual(self.get_tree_details(2),
+                         tree_details("""4 - 1 0 1 4
+                                         6 4 1 1 2 3
+                                         5 - 2 0 1 2"""))
+
+    def test_verification(self):
+        self.assertEqual(Page.tree.verify_trees(), [])
+        self.assertEqual(Page.tree.check_tree_integrity(), {})
+        Page.objects.filter(pk=6).update(level=2)
+        self.assertEqual(Page.tree.verify_trees(), [(2, 1)])
+        self.assertEqual(Page.tree.check_tree_integrity(), {
+            (2, 1): [u'Node 6 has a level of 2 instead of 1.'],
+        })
+        Page.tree.rebuild_tree(1, scope=2)
+        self.assertEqual(Page.tree.verify_trees(), [])
+
+    def test_choices_page(self):
+        field = TreeNodeChoiceField(queryset=Page.tree.all(),
+                                    label_field='name', page_size=4)
+        choices, cursor = field.choices_page()
+        self.assertEqual([pk for pk, label in choices], [1, 3, 2, 4])
+        self.assertEqual(cursor, '2:1:1')
+        choices, cursor = field.choices_page(cursor)
+        self.assertEqual([pk for pk, label in choices], [6, 5])
+        self.assertEqual(cursor, None)
+
+class ChoicesViewTestCase(TestCase):
+    """
+    Tests that pages of a paginated field's choices are served as JSON.
+    """
+    fixtures = ['genres.json']
+
+    def get_page(self, **params):
+        response = self.client.get('/genre-choices/', params)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return simplejson.loads(response.content)
+
+    def test_choices(self):
+        self.assertEqual(self.get_page(),
+                         {'choices': [[1, ' Action'], [2, '--- Platformer'],
+                                      [3, '------ 2D Platformer']],
+                          'next': '1:3'})
+        self.assertEqual(self.get_page(after='2:1'),
+                         {'choices': [[10, '--- Action RPG'],
+                                      [11, '--- Tactical RPG']],
+                          'next': None})
+        self.assertEqual(self.get_page(q='rpg')['choices'],
+                         [[10, '--- Action RPG'], [11, '--- Tactical RPG']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/genre-choices/', {'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+class TreeIdGapTestCase(TestCase):
+    """
+    Tests that root nodes are reordered without renumbering other trees
+    when tree ids are allocated with gaps.
+    """
+    def setUp(self):
+        for name in ('a', 'b', 'c'):
+            Menu.objects.create(name=name)
+        Menu.objects.create(name='d', parent=Menu.objects.get(name='a'))
+
+    def get_roots(self):
+        return [(m.name, m.tree_id) for m in Menu.tree.root_nodes()]
+
+    def test_new_trees(self):
+        self.assertEqual(self.get_roots(), [('a', 10), ('b', 20), ('c', 30)])
+
+    def test_insert_root_siblings(self):
+        Menu(name='e').insert_at(Menu.objects.get(name='b'), 'left',
+                                 commit=True)
+        Menu(name='f').insert_at(Menu.objects.get(name='c'), 'right',
+                                 commit=True)
+        self.assertEqual(self.get_roots(), [('a', 10), ('e', 15), ('b', 20),
+                                            ('c', 30), ('f', 40)])
+
+    def test_move_root_siblings(self):
+        Menu.objects.get(name='c').move_to(Menu.objects.get(name='a'), 'right')
+        self.assertEqual(self.get_roots(), [('a', 10), ('c', 15), ('b', 20)])
+        Menu.objects.get(name='b').move_to(Menu.objects.get(name='c'), 'left')
+        self.assertEqual(self.get_roots(), [('a', 10), ('b', 12), ('c', 15)])
+        # Making a child node a root node
+        Menu.objects.get(name='d').move_to(Menu.objects.get(name='a'), 'left')
+        self.assertEqual(self.get_roots(), [('d', 5), ('a', 10), ('b', 12),
+                                            ('c', 15)])
+        self.assertEqual(Menu.tree.verify_trees(), [])
+
+    def test_exhausted_gap(self):
+        Menu.objects.filter(name='b').update(tree_id=11)
+        Menu(name='e').insert_at(Menu.objects.get(name='b'), 'left',
+                                 commit=True)
+        self.assertEqual(self.get_roots(), [('a', 10), ('e', 15), ('b', 21),
+                                            ('c', 40)])
+        self.assertEqual(Menu.tree.verify_trees(), [])
+
+class OtherDatabaseRouter(object):
+    """
+    Sends all reads and writes to the ``'other'`` database.
+    """
+    def db_for_read(self, model, **hints):
+        return 'other'
+
+    def db_for_write(self, model, **hints):
+        return 'other'
+
+if router is not None:
+    class MultipleDatabaseTestCase(TestCase):
+        """
+        Tests that trees are managed in the database nodes are being
+        read from or written to.
+        """
+        multi_db = True
+
+        def test_using(self):
+            action = Genre.tree.insert_node(Genre(name='Action'), None,
+                                            commit=True, using='other')
+            platformer = Genre(name='Platformer')
+            platformer.insert_at(action, 'last-child', commit=True,
+                                 using='other')
+            # Nodes are saved to their parent's database
+            action = Genre.objects.using('other').get(pk=action.pk)
+            shmup = Genre(name='Shmup', parent=action)
+            shmup.save()
+            rpg = Genre.tree.insert_node(Genre(name='RPG'), None, commit=True,
+                                         using='other')
+            self.assertEqual(Genre.objects.using('default').count(), 0)
+            self.assertEqual(get_tree_details(Genre.tree.using('other').all()),
+                             tree_details("""1 - 1 0 1 6
+                                             2 1 1 1 2 3
+                                             3 1 1 1 4 5
+                                             4 - 2 0 1 2"""))
+
+            shmup = Genre.objects.using('other').get(pk=shmup.pk)
+            shmup.move_to(platformer, 'first-child')
+            Genre.tree.db_manager('other').move_node(rpg, shmup)
+            self.assertEqual(get_tree_details(Genre.tree.using('other').all()),
+                             tree_details("""1 - 1 0 1 8
+                                             2 1 1 1 2 7
+                                             3 2 1 2 3 6
+                                             4 3 1 3 4 5"""))
+            self.assertEqual(
+                [g.name for g in rpg.get_ancestors()],
+                ['Action', 'Platformer', 'Shmup'])
+
+            Genre.objects.using('other').get(pk=platformer.pk).delete()
+            self.assertEqual(get_tree_details(Genre.tree.using('other').all()),
+                             '1 - 1 0 1 2')
+            self.assertEqual(Genre.tree.verify_trees(using='other'), [])
+            self.assertEqual(Genre.tree.db_manager('other').verify_trees(), [])
+
+        def test_router(self):
+            routers = router.routers
+            router.routers = [OtherDatabaseRouter()]
+            try:
+                action = Genre.objects.create(name='Action')
+                Genre.objects.create(name='Platformer', parent=action)
+                action = Genre.objects.get(pk=action.pk)
+                Genre.objects.create(name='Shmup', parent=action)
+                self.assertEqual(
+                    get_tree_details(Genre.tree.using('other').all()),
+                    tree_details("""1 - 1 0 1 6
+                                    2 1 1 1 2 3
+                                    3 1 1 1 4 5"""))
+                action = Genre.objects.get(pk=action.pk)
+                self.assertEqual(
+                    [g.name for g in action.get_descendants()],
+                    ['Platformer', 'Shmup'])
+                self.assertEqual(Genre.tree.verify_trees(), [])
+            finally:
+                router.routers = routers
+            self.assertEqual(Genre.objects.count(), 0)
+
+    class ShardingTestCase(TestCase):
+        """
+        Tests that trees are kept in the database their tree router maps
+        them to, with nodes being copied between databases when they're
+        moved to a tree in another database.
+        """
+        multi_db = True
+
+        def get_tree_details(self, using):
+            return get_tree_details(Region.tree.using(using).all())
+
+        def create(self, **kwargs):
+            # QuerySet.create() chooses a database without looking at the
+            # node being created.
+            region = Region(**kwargs)
+            region.save()
+            return region
+
+        def test_sharding(self):
+            # Primary keys must be unique across databases
+            europe = self.create(id=1, name='Europe')
+            asia = self.create(id=2, name='Asia')
+            self.create(id=3, name='Africa')
+            france = self.create(id=4, name='France', parent=europe)
+            self.create(id=5, name='Japan', parent=asia)
+            self.create(id=6, name='Paris', parent=france)
+            self.assertEqual(self.get_tree_details('default'),
+                             tree_details("""1 - 1 0 1 6
+                                             4 1 1 1 2 5
+                                             6 4 1 2 3 4
+                                             3 - 3 0 1 2"""))
+            self.assertEqual(self.get_tree_details('other'),
+                             tree_details("""2 - 2 0 1 4
+                                             5 2 2 1 2 3"""))
+            self.assertEqual([r.name for r in Region.tree.all_root_nodes()],
+                             ['Europe', 'Asia', 'Africa'])
+            self.assertEqual([r.name for r in Region.tree.db_manager(
+                                  'other').root_nodes()], ['Asia'])
+
+            # Moving a child node to a tree in another database
+            france = Region.objects.using('default').get(pk=4)
+            japan = Region.objects.using('other').get(pk=5)
+            france.move_to(japan, 'last-child')
+            self.assertEqual(self.get_tree_details('default'),
+                             tree_details("""1 - 1 0 1 2
+                                             3 - 3 0 1 2"""))
+            self.assertEqual(self.get_tree_details('other'),
+                             tree_details("""2 - 2 0 1 8
+                                             5 2 2 1 2 7
+                                             4 5 2 2 3 6
+                                             6 4 2 3 4 5"""))
+
+            # Moving a root node to a tree in another database
+            africa = Region.objects.using('default').get(pk=3)
+            africa.move_to(france, 'first-child')
+            self.assertEqual(self.get_tree_details('default'), '1 - 1 0 1 2')
+
+            # Making a child node the root of a tree in another database
+            france = Region.objects.using('other').get(pk=4)
+            france.move_to(None)
+            self.assertEqual(self.get_tree_details('default'),
+                             tree_details("""1 - 1 0 1 2
+                                             4 - 3 0 1 6
+                                             3 4 3 1 2 3
+                                             6 4 3 1 4 5"""))
+            self.assertEqual(self.get_tree_details('other'),
+                             tree_details("""2 - 2 0 1 4
+                                             5 2 2 1 2 3"""))
+            self.assertEqual(Region.tree.verify_trees(), [])
+            self.assertEqual(Region.tree.check_tree_integrity(), {})
+            self.assertEqual([r.name for r in Region.tree.all_root_nodes()],
+                             ['Europe', 'Asia', 'France'])
+
+            # Changing a node's parent to a node in another database
+            japan = Region.objects.using('other').get(pk=5)
+            japan.parent = Region.objects.using('default').get(pk=1)
+            self.assertRaises(InvalidMove, japan.save)
+
+        def test_delete_queryset(self):
+            europe = self.create(id=1, name='Europe')
+            asia = self.create(id=2, name='Asia')
+            france = self.create(id=3, name='France', parent=europe)
+            self.create(id=4, name='Japan', parent=asia)
+            self.create(id=5, name='Paris', parent=france)
+            asia = Region.objects.using('other').get(pk=2)
+            self.create(id=6, name='China', parent=asia)
+            Region.tree.filter(name__in=['France', 'Japan']).delete()
+            self.assertEqual(self.get_tree_details('default'),
+                             '1 - 1 0 1 2')
+            self.assertEqual(self.get_tree_details('other'),
+                             tree_details("""2 - 2 0 1 4
+                                             6 2 2 1 2 3"""))
+            self.assertEqual(Region.tree.verify_trees(), [])
+
 class IntraTreeMovementTestCase(TestCase):
     pass
 
@@ -0,0 +1,11 @@
+from django.conf.urls.defaults import *
+
+from mptt.forms import TreeNodeChoiceField
+from mptt.tests.models import Genre
+
+urlpatterns = patterns('mptt.views',
+    (r'^genre-choices/$', 'tree_node_choices', {
+        'field': TreeNodeChoiceField(queryset=Genre.tree.all(),
+                                     label_field='name', page_size=3),
+    }),
+)
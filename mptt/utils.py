@@ -4,9 +4,15 @@ trees.
 """
 import copy
 import itertools
+import operator
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import ManyToManyField
+from django.db.models.query import Q
+from django.utils import simplejson
 
 __all__ = ('previous_current_next', 'tree_item_iterator',
-           'drilldown_tree_for_node')
+           'drilldown_tree_for_node', 'write_json_tree')
 
 def previous_current_next(items):
     """
@@ -100,12 +106,16 @@ def tree_item_iterator(items, ancestors=False):
         yield current, copy.deepcopy(structure)
 
 def drilldown_tree_for_node(node, rel_cls=None, rel_field=None, count_attr=None,
-                            cumulative=False):
+                            cumulative=False, max_depth=1):
     """
     Creates a drilldown tree for the given node. A drilldown tree
     consists of a node's ancestors, itself and its immediate children,
     all in tree order.
 
+    If a ``max_depth`` greater than ``1`` is given, descendants up to
+    that many levels below the node are included instead of its
+    immediate children, and are retrieved with a single query.
+
     Optional arguments may be given to specify a ``Model`` class which
     is related to the node's class, for the purpose of adding related
     item counts to the node's children:
@@ -125,10 +135,106 @@ def drilldown_tree_for_node(node, rel_cls=None, rel_field=None, count_attr=None,
     ``cumulative``
        If ``True``, the count will be for each child and all of its
        descendants, otherwise it will be for each child itself.
+
+    ``rel_field`` may also be the name of a ``ManyToManyField``, in
+    which case items related to more than one node in a child's subtree
+    are only counted once.
+
+    If a ``max_depth`` greater than ``1`` is given, counts are added to
+    every descendant in the drilldown tree.
     """
-    if rel_cls and rel_field and count_attr:
-        children = node._tree_manager.add_related_count(
-            node.get_children(), rel_cls, rel_field, count_attr, cumulative)
-    else:
+    if max_depth == 1:
         children = node.get_children()
+    else:
+        children = node.get_descendants(max_depth=max_depth)
+    if rel_cls and rel_field and count_attr:
+        if isinstance(rel_cls._meta.get_field(rel_field), ManyToManyField):
+            children = node._tree_manager.add_related_aggregate(
+                children, rel_cls, rel_field, count_attr,
+                cumulative=cumulative)
+        else:
+            children = node._tree_manager.add_related_count(
+                children, rel_cls, rel_field, count_attr, cumulative)
     return itertools.chain(node.get_ancestors(), [node], children)
+
+def write_json_tree(stream, queryset, fields=('pk',), max_level=None,
+                    roots=None):
+    """
+    Writes the tree items in ``queryset`` to ``stream`` (any object with
+    a ``write`` method, such as a file or an ``HttpResponse``) as nested
+    JSON - a list of objects containing the given ``fields``, with the
+    children of each item in a ``children`` list.
+
+    Items are read in tree order using the ``QuerySet``'s ``iterator``
+    method and written as they are read, so no more than one item per
+    tree level is held in memory at any time.
+
+    Items are nested within the closest preceding item which contains
+    them, so items whose ancestors aren't in ``queryset`` are written
+    under their closest ancestor which is, or at the top level.
+
+    If ``max_level`` is given, only items up to and including that tree
+    level will be written. Levels count from the root nodes of their
+    trees, even if ``roots`` are given.
+
+    If a list of ``roots`` is given, only those nodes and their
+    descendants will be written, with the given nodes being at the top
+    level of the nested JSON.
+    """
+    opts = queryset.model._meta
+    if max_level is not None:
+        queryset = queryset.filter(**{'%s__lte' % opts.level_attr: max_level})
+    if roots is not None:
+        if not roots:
+            stream.write('[]')
+            return
+        tree_manager = queryset.model._tree_manager
+        queryset = queryset.filter(reduce(operator.or_, [Q(**{
+            opts.tree_id_attr: getattr(root, opts.tree_id_attr),
+            '%s__range' % opts.left_attr: (getattr(root, opts.left_attr),
+                                           getattr(root, opts.right_attr)),
+        }) & Q(**tree_manager._scope_filters(tree_manager._get_scope(root)))
+            for root in roots]))
+    tree_manager = queryset.model._tree_manager
+    queryset = queryset.order_by(*tree_manager._tree_ordering())
+    tree_fields = [opts.tree_id_attr, opts.left_attr, opts.right_attr]
+    if tree_manager.tree_scope_attr is not None:
+        tree_fields.append(tree_manager.tree_scope_attr)
+
+    encoder = DjangoJSONEncoder()
+    keys = [simplejson.dumps(field) for field in fields]
+    # Each open item's tree, its right edge indicator and whether its
+    # children list has been opened.
+    open_items = []
+    def close_item():
+        if open_items.pop()[2]:
+            stream.write(']}')
+        else:
+            stream.write('}')
+
+    first = True
+    stream.write('[')
+    for values in queryset.values_list(*(tree_fields + list(fields))).iterator():
+        tree = (values[0],) + values[3:len(tree_fields)]
+        left, right = values[1:3]
+        values = values[len(tree_fields):]
+        # Close the previous item and any items which don't contain
+        # this one
+        while open_items and (open_items[-1][0] != tree or
+                              open_items[-1][1] < left):
+            close_item()
+        if open_items:
+            if open_items[-1][2]:
+                stream.write(', ')
+            else:
+                stream.write(', "children": [')
+                open_items[-1][2] = True
+        elif not first:
+            stream.write(', ')
+        first = False
+        stream.write('{%s' % ', '.join(['%s: %s' % (key, encoder.encode(value))
+                                        for key, value in zip(keys, values)]))
+        open_items.append([tree, right, False])
+    while open_items:
+        close_item()
+    stream.write(']')
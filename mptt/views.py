@@ -0,0 +1,33 @@
+"""
+Views for working with trees.
+"""
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import simplejson
+
+__all__ = ('tree_node_choices',)
+
+def tree_node_choices(request, field):
+    """
+    Serves a page of the choices of ``field``, a paginated
+    ``TreeNodeChoiceField``, as JSON, for use by a script which
+    populates the field's ``<select>``.
+
+    The cursor of the previous page and a search string may be given in
+    the ``after`` and ``q`` query string parameters. The response holds
+    a ``choices`` list of ``[pk, label]`` pairs and a ``next`` cursor,
+    which is ``null`` if there are no more pages.
+
+    ``field`` is usually given in the URLconf, as the arguments of
+    Django's generic views are::
+
+       (r'^category-choices/$', 'mptt.views.tree_node_choices',
+        {'field': CategoryForm.base_fields['category']}),
+    """
+    try:
+        choices, cursor = field.choices_page(request.GET.get('after'),
+                                             request.GET.get('q'))
+    except ValueError, e:
+        return HttpResponseBadRequest(unicode(e))
+    return HttpResponse(simplejson.dumps({'choices': choices,
+                                          'next': cursor}),
+                        mimetype='application/json')